@@ -2,118 +2,216 @@
 AI Provider modules for different AI services.
 Supports both ASI1 Mini and OpenAI ChatGPT-4o.
 
+This module holds the provider interface, errors and the registry. Provider
+implementations are imported by the registry when first instantiated, so
+importing it does not load the HTTP clients.
+
 Created by: Saqeb Newaz
 """
 
+import hashlib
+import importlib
+import json
 import os
-import requests
+import threading
 from abc import ABC, abstractmethod
-from typing import Optional
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple, Union
+from config import REQUEST_COALESCING_ENABLED, SCHEDULER_ENABLED
 
 
 class AIProvider(ABC):
     """Abstract base class for AI providers."""
     
+    # False for providers that only delegate to other registered providers
+    direct = True
+    
     @abstractmethod
     def call(self, prompt: str) -> str:
         """Send prompt to AI service and return response."""
         pass
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the response as content deltas. Defaults to a single chunk."""
+        yield self.call(prompt)
+    
+    async def acall(self, prompt: str) -> str:
+        """Coroutine counterpart of call(). Defaults to running call() in a worker thread."""
+        import asyncio  # Only async callers pay for the event loop machinery
+        
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.call, prompt)
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Coroutine counterpart of stream(). Defaults to a single chunk from acall()."""
+        yield await self.acall(prompt)
+    
+    def request_fingerprint(self, prompt: str) -> str:
+        """Return a stable key identifying the full upstream request for a prompt."""
+        key = json.dumps([type(self).__name__, prompt])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
 
-class ASI1MiniProvider(AIProvider):
-    """ASI1 Mini API provider."""
+class ProviderWrapper(AIProvider):
+    """Base class for providers that decorate another provider (caching, etc.)."""
     
-    def __init__(self):
-        self.api_key = os.getenv("ASI1_MINI_API_KEY")
-        if not self.api_key:
-            raise RuntimeError("Please set your ASI1_MINI_API_KEY environment variable")
-        
-        self.api_url = os.getenv(
-            "ASI1_MINI_API_URL",
-            "https://asi1.ai/chat"
-        )
+    def __init__(self, provider: AIProvider):
+        self.provider = provider
+    
+    def __getattr__(self, name: str):
+        # Expose attributes such as display_name of the wrapped provider
+        if name == "provider":
+            raise AttributeError(name)
+        return getattr(self.provider, name)
     
     def call(self, prompt: str) -> str:
-        """Send prompt to ASI1 Mini and return the assistant's reply."""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": "asi1-mini",
-            "messages": [{"role": "user", "content": prompt}]
-        }
-        
-        try:
-            response = requests.post(self.api_url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"]
-        except requests.RequestException as exc:
-            return f"Error contacting ASI1 Mini API: {exc}"
-        except (KeyError, ValueError) as exc:
-            return f"Invalid response from ASI1 Mini API: {exc}"
+        return self.provider.call(prompt)
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        return self.provider.stream(prompt)
+    
+    async def acall(self, prompt: str) -> str:
+        return await self.provider.acall(prompt)
+    
+    def astream(self, prompt: str) -> AsyncIterator[str]:
+        return self.provider.astream(prompt)
+    
+    def request_fingerprint(self, prompt: str) -> str:
+        return self.provider.request_fingerprint(prompt)
 
 
-class OpenAIProvider(AIProvider):
-    """OpenAI ChatGPT-4o API provider."""
+class ProviderError(Exception):
+    """Base class for failures talking to an AI provider."""
     
-    def __init__(self):
-        self.api_key = os.getenv("OPENAI_API_KEY")
-        if not self.api_key:
-            raise RuntimeError("Please set your OPENAI_API_KEY environment variable")
-        
-        self.api_url = os.getenv(
-            "OPENAI_API_URL",
-            "https://api.openai.com/v1/chat/completions"
-        )
+    retryable = False
     
-    def call(self, prompt: str) -> str:
-        """Send prompt to OpenAI ChatGPT-4o and return the assistant's reply."""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are an expert Lean manufacturing consultant with deep knowledge of TPS, FPS, SPW, and Lean Six Sigma frameworks. Provide practical, actionable advice for factory floor optimization. Created by Saqeb Newaz."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "max_tokens": 2000,
-            "temperature": 0.7
-        }
-        
-        try:
-            response = requests.post(self.api_url, json=payload, headers=headers, timeout=30)
-            response.raise_for_status()
-            return response.json()["choices"][0]["message"]["content"]
-        except requests.RequestException as exc:
-            return f"Error contacting OpenAI API: {exc}"
-        except (KeyError, ValueError) as exc:
-            return f"Invalid response from OpenAI API: {exc}"
+    def __init__(self, provider: str, message: str):
+        super().__init__(message)
+        self.provider = provider
+
+
+class ProviderConnectionError(ProviderError):
+    """The provider could not be reached or the connection dropped."""
+    
+    retryable = True
+
+
+class ProviderTimeoutError(ProviderConnectionError):
+    """The provider did not answer within the configured timeout."""
+
+
+class ProviderHTTPError(ProviderError):
+    """The provider answered with an HTTP error status."""
+    
+    def __init__(self, provider: str, message: str, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(provider, message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+    
+    @property
+    def retryable(self) -> bool:
+        return self.status_code == 408 or self.status_code >= 500
+
+
+class RateLimitError(ProviderHTTPError):
+    """The provider answered HTTP 429 Too Many Requests."""
+    
+    @property
+    def retryable(self) -> bool:
+        return True
+
+
+class InvalidResponseError(ProviderError):
+    """The provider answered, but not with a usable chat completion."""
+
+
+# Provider name -> "module:class", imported on first use so cold start skips the HTTP stack
+PROVIDER_CLASSES: Dict[str, str] = {
+    "asi1": "chat_providers:ASI1MiniProvider",
+    "openai": "chat_providers:OpenAIProvider",
+    "chatgpt": "chat_providers:OpenAIProvider",  # Alias for OpenAI
+    "auto": "routing:RoutingProvider",
+}
+
+
+def _provider_class(provider_name: str):
+    target = PROVIDER_CLASSES.get(provider_name.lower())
+    if not target:
+        available = ", ".join(PROVIDER_CLASSES)
+        raise ValueError(f"Unknown provider '{provider_name}'. Available: {available}")
+    module_name, _, class_name = target.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def __getattr__(name: str):
+    # Provider classes used to live here; keep "from ai_providers import OpenAIProvider" working
+    if name in ("ChatCompletionsProvider", "ASI1MiniProvider", "OpenAIProvider"):
+        return getattr(importlib.import_module("chat_providers"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_ai_provider(provider_name: str = "openai") -> AIProvider:
     """Factory function to get AI provider instance."""
-    providers = {
-        "asi1": ASI1MiniProvider,
-        "openai": OpenAIProvider,
-        "chatgpt": OpenAIProvider,  # Alias for OpenAI
-    }
-    
-    provider_class = providers.get(provider_name.lower())
-    if not provider_class:
-        available = ", ".join(providers.keys())
-        raise ValueError(f"Unknown provider '{provider_name}'. Available: {available}")
+    return _provider_class(provider_name)()
+
+
+def provider_config_key(provider_name: str) -> str:
+    """Identify a provider by class and current configuration (without exposing secrets)."""
+    provider_class = _provider_class(provider_name)
+    values = [provider_class.__name__] + [os.getenv(name, "") for name in provider_class.config_env]
+    return hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()[:16]
+
+
+class ProviderRegistry:
+    """Process-wide provider instances, created once per (provider, configuration)."""
+    
+    def __init__(self):
+        self._instances: Dict[str, Tuple[str, AIProvider]] = {}
+        # Re-entrant: the routing provider builds its members while being built
+        self._lock = threading.RLock()
+    
+    def get(self, provider_name: str) -> AIProvider:
+        """Return the shared instance for a provider, building it on first use."""
+        name = _provider_class(provider_name).__name__
+        config_key = provider_config_key(provider_name)
+        
+        entry = self._instances.get(name)
+        if entry is not None and entry[0] == config_key:
+            return entry[1]
+        
+        with self._lock:
+            entry = self._instances.get(name)
+            if entry is None or entry[0] != config_key:
+                # New or changed configuration replaces the stale instance
+                entry = (config_key, self._build(provider_name))
+                self._instances[name] = entry
+            return entry[1]
     
-    return provider_class()
\ No newline at end of file
+    def _build(self, provider_name: str) -> AIProvider:
+        provider = get_ai_provider(provider_name)
+        if SCHEDULER_ENABLED and provider.direct:
+            # Inside coalescing, so requests that join another one never take a slot
+            from scheduler import SchedulingProvider
+            provider = SchedulingProvider(provider)
+        if REQUEST_COALESCING_ENABLED:
+            # coalesce imports this module, so resolve it on first use
+            from coalesce import CoalescingProvider
+            provider = CoalescingProvider(provider)
+        return provider
+    
+    def invalidate(self, provider_name: Optional[str] = None) -> None:
+        """Drop one provider's shared instance, or all of them, after a config change."""
+        with self._lock:
+            if provider_name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(_provider_class(provider_name).__name__, None)
+
+
+provider_registry = ProviderRegistry()
+
+
+def get_shared_provider(provider: Union[str, AIProvider]) -> AIProvider:
+    """Resolve a provider name to its shared instance; instances pass through unchanged."""
+    if isinstance(provider, AIProvider):
+        return provider
+    return provider_registry.get(provider)
\ No newline at end of file
@@ -0,0 +1,330 @@
+"""
+Async HTTP API for the Lean AI Assistant.
+
+Exposes run_assistant and every PromptTemplates flow as JSON endpoints for
+service-to-service callers such as MES dashboards, with optional SSE
+streaming ("stream": true). All requests share one event loop and the async
+connection pools, so a single process keeps hundreds of answers in flight;
+beyond API_MAX_CONCURRENCY it sheds load with 503 instead of queueing. A
+client that disconnects cancels its request, upstream call included.
+
+Endpoints:
+    POST /v1/assistant              {"framework", "industry", "question", "provider"?, "stream"?, "priority"?}
+    POST /v1/templates/{template}   {"framework"?, "industry"?, "provider"?, "stream"?, "priority"?}
+    GET  /v1/templates              template names and the fields they need
+    GET  /healthz                   the process is up
+    GET  /readyz                    a provider is configured and there is capacity left (plus circuit states)
+    GET  /metrics                   Prometheus text (METRICS_ENABLED=true)
+
+Usage:
+    python api_server.py --port 8080
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+from typing import Any, AsyncIterator, ContextManager, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from ai_providers import AIProvider, ProviderError, ProviderTimeoutError, RateLimitError, get_shared_provider
+from cache import CachedProvider
+from circuit_breaker import CircuitOpenError, circuit_stats
+from config import (
+    API_HOST, API_PORT, API_MAX_CONCURRENCY, API_MAX_BODY_BYTES, DEFAULT_AI_PROVIDER,
+    RESPONSE_CACHE_ENABLED, WARM_STORE_ENABLED, HISTORY_ENABLED,
+)
+from history import HistoryProvider
+from http_pool import close_async_sessions
+from main import astream_assistant
+from metrics import metrics
+from scheduler import PRIORITIES, RequestShedError, scheduler_stats, scheduling
+from prompts import PromptTemplates
+from tokens import InputTooLongError
+from warm_store import WarmStoreProvider
+
+logger = logging.getLogger("lean_ai.api")
+
+# Template name -> the fields its prompt is built from
+TEMPLATES: Dict[str, List[str]] = {
+    name: list(inspect.signature(getattr(PromptTemplates, name)).parameters)
+    for name in vars(PromptTemplates) if not name.startswith("_")
+}
+
+
+class APIError(Exception):
+    """An error reported to the client as a JSON body with an HTTP status."""
+    
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+def _provider_error(exc: ProviderError) -> APIError:
+    """Map an upstream failure onto the status a caller should act on."""
+    if isinstance(exc, (RateLimitError, CircuitOpenError, RequestShedError)):
+        retry_after = str(max(1, int(exc.retry_after or 1)))
+        return APIError(503, str(exc), {"Retry-After": retry_after})
+    if isinstance(exc, ProviderTimeoutError):
+        return APIError(504, str(exc))
+    return APIError(502, str(exc))
+
+
+def _stream_error(request: web.Request, exc: Exception) -> Dict[str, Any]:
+    """Body of the error event for a stream that failed after its 200 status was sent."""
+    if isinstance(exc, ProviderError):
+        error = _provider_error(exc)
+        return {"error": error.message, "status": error.status}
+    logger.exception("Unhandled error while streaming %s", request.path)
+    return {"error": "Internal server error", "status": 500}
+
+
+def _sse_event(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+class AssistantAPI:
+    """Request handlers plus the concurrency limit they share."""
+    
+    def __init__(
+        self,
+        max_concurrency: int = API_MAX_CONCURRENCY,
+        max_body_bytes: int = API_MAX_BODY_BYTES,
+        default_provider: str = DEFAULT_AI_PROVIDER,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_body_bytes = max_body_bytes
+        self.default_provider = default_provider
+        self.draining = False
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._template_providers: Dict[str, Tuple[AIProvider, AIProvider]] = {}
+    
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=self.max_body_bytes, middlewares=[self._errors, self._shed])
+        app.router.add_post("/v1/assistant", self.assistant)
+        app.router.add_get("/v1/templates", self.list_templates)
+        app.router.add_post("/v1/templates/{template}", self.run_template)
+        app.router.add_get("/healthz", self.healthz)
+        app.router.add_get("/readyz", self.readyz)
+        app.router.add_get("/metrics", self.prometheus)
+        app.on_shutdown.append(self._drain)
+        app.on_cleanup.append(self._close)
+        return app
+    
+    @web.middleware
+    async def _errors(self, request: web.Request, handler) -> web.StreamResponse:
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else "unmatched"
+        try:
+            response = await handler(request)
+        except APIError as exc:
+            response = web.json_response({"error": exc.message}, status=exc.status, headers=exc.headers)
+        except ProviderError as exc:
+            error = _provider_error(exc)
+            response = web.json_response({"error": error.message}, status=error.status, headers=error.headers)
+        except web.HTTPException as exc:
+            # aiohttp's own errors (404, 405, 413 for oversized bodies) as JSON too
+            response = web.json_response({"error": exc.reason}, status=exc.status)
+        except Exception:
+            logger.exception("Unhandled error on %s", request.path)
+            response = web.json_response({"error": "Internal server error"}, status=500)
+        except asyncio.CancelledError:
+            metrics.api_requests.inc(route=route, status="499")  # The client closed the connection first
+            raise
+        metrics.api_requests.inc(route=route, status=str(response.status))
+        return response
+    
+    @web.middleware
+    async def _shed(self, request: web.Request, handler) -> web.StreamResponse:
+        """Refuse work beyond the concurrency limit rather than queueing it."""
+        if request.method != "POST":
+            return await handler(request)
+        if self._slots.locked():
+            raise APIError(503, "The assistant is at capacity. Please retry shortly.", {"Retry-After": "1"})
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                return await handler(request)
+            finally:
+                self.in_flight -= 1
+    
+    async def _body(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_length is not None and request.content_length > self.max_body_bytes:
+            raise APIError(413, f"Request body is larger than {self.max_body_bytes} bytes.")
+        try:
+            body = await request.json()
+        except web.HTTPRequestEntityTooLarge:
+            raise APIError(413, f"Request body is larger than {self.max_body_bytes} bytes.")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise APIError(400, "Request body must be a JSON object.")
+        if not isinstance(body, dict):
+            raise APIError(400, "Request body must be a JSON object.")
+        return body
+    
+    @staticmethod
+    def _fields(body: Dict[str, Any], names: List[str]) -> Dict[str, str]:
+        missing = [name for name in names if not isinstance(body.get(name), str) or not body[name].strip()]
+        if missing:
+            raise APIError(400, f"Missing or empty field(s): {', '.join(missing)}.")
+        return {name: body[name].strip() for name in names}
+    
+    def _provider_name(self, body: Dict[str, Any]) -> str:
+        provider = body.get("provider") or self.default_provider
+        if not isinstance(provider, str):
+            raise APIError(400, "Field 'provider' must be a string.")
+        return provider
+    
+    @staticmethod
+    def _scheduling(request: web.Request, body: Dict[str, Any]) -> ContextManager[None]:
+        """Priority class from the body and tenant from X-Tenant (or the client address)."""
+        priority = body.get("priority", "interactive")
+        if priority not in PRIORITIES:
+            raise APIError(400, f"Field 'priority' must be one of: {', '.join(PRIORITIES)}.")
+        return scheduling(priority, request.headers.get("X-Tenant") or request.remote or "api")
+    
+    def _shared_provider(self, name: str) -> AIProvider:
+        try:
+            return get_shared_provider(name)
+        except ValueError as exc:
+            raise APIError(400, str(exc))
+        except RuntimeError as exc:
+            # Missing API key for this provider
+            raise APIError(503, str(exc))
+    
+    def _template_provider(self, name: str) -> AIProvider:
+        """Shared provider behind the same history, warm store and response cache as the CLI."""
+        shared = self._shared_provider(name)
+        entry = self._template_providers.get(name)
+        if entry is None or entry[0] is not shared:
+            ai = shared
+            if HISTORY_ENABLED:
+                ai = HistoryProvider(ai)
+            if RESPONSE_CACHE_ENABLED:
+                ai = CachedProvider(ai)
+            if WARM_STORE_ENABLED:
+                ai = WarmStoreProvider(ai)
+            entry = self._template_providers[name] = (shared, ai)
+        return entry[1]
+    
+    async def _respond(self, request: web.Request, stream: bool, chunks: AsyncIterator[str]) -> web.StreamResponse:
+        """JSON with the whole answer, or SSE deltas when the client asked to stream."""
+        try:
+            if not stream:
+                return web.json_response({"response": "".join([chunk async for chunk in chunks])})
+            return await self._stream(request, chunks)
+        except InputTooLongError as exc:
+            raise APIError(413, str(exc))
+        finally:
+            await chunks.aclose()
+    
+    async def _stream(self, request: web.Request, chunks: AsyncIterator[str]) -> web.StreamResponse:
+        """SSE deltas; a failure after the headers were sent ends the stream with an error event."""
+        # Wait for the first delta so early failures still get a real status code
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        await response.prepare(request)
+        try:
+            if first:
+                await response.write(_sse_event({"delta": first}))
+            async for chunk in chunks:
+                await response.write(_sse_event({"delta": chunk}))
+            await response.write(_sse_event({}, event="done"))
+        except ConnectionResetError:
+            return response  # Client went away; closing the iterator stops the upstream stream
+        except Exception as exc:
+            await response.write(_sse_event(_stream_error(request, exc), event="error"))
+        await response.write_eof()
+        return response
+    
+    async def assistant(self, request: web.Request) -> web.StreamResponse:
+        body = await self._body(request)
+        fields = self._fields(body, ["framework", "industry", "question"])
+        provider = self._shared_provider(self._provider_name(body))
+        with self._scheduling(request, body):
+            chunks = astream_assistant(fields["framework"], fields["industry"], provider, fields["question"])
+            return await self._respond(request, bool(body.get("stream")), chunks)
+    
+    async def run_template(self, request: web.Request) -> web.StreamResponse:
+        name = request.match_info["template"]
+        if name not in TEMPLATES:
+            raise APIError(404, f"Unknown template '{name}'. Available: {', '.join(TEMPLATES)}")
+        body = await self._body(request)
+        fields = self._fields(body, TEMPLATES[name])
+        ai = self._template_provider(self._provider_name(body))
+        prompt = getattr(PromptTemplates, name)(**fields)
+        with self._scheduling(request, body):
+            return await self._respond(request, bool(body.get("stream")), ai.astream(prompt))
+    
+    async def list_templates(self, request: web.Request) -> web.Response:
+        return web.json_response({"templates": TEMPLATES})
+    
+    async def healthz(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+    
+    async def readyz(self, request: web.Request) -> web.Response:
+        """Ready while not shutting down, below capacity and with a usable default provider."""
+        reasons = []
+        if self.draining:
+            reasons.append("shutting down")
+        if self._slots.locked():
+            reasons.append("at capacity")
+        try:
+            get_shared_provider(self.default_provider)
+        except (RuntimeError, ValueError) as exc:
+            reasons.append(str(exc))
+        body = {
+            "ready": not reasons,
+            "reasons": reasons,
+            "in_flight": self.in_flight,
+            "capacity": self.max_concurrency,
+            # Informational: an open circuit is shared by every replica, so it does not fail readiness
+            "circuits": circuit_stats(),
+            "schedulers": scheduler_stats(),
+        }
+        return web.json_response(body, status=503 if reasons else 200)
+    
+    async def prometheus(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics.prometheus(), content_type="text/plain", charset="utf-8")
+    
+    async def _drain(self, app: web.Application) -> None:
+        # Fail readiness so load balancers stop routing here while in-flight requests finish
+        self.draining = True
+    
+    async def _close(self, app: web.Application) -> None:
+        await close_async_sessions()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Async HTTP API for the Lean AI Assistant.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--max-concurrency", type=int, default=API_MAX_CONCURRENCY,
+                        help="In-flight requests before answering 503")
+    parser.add_argument("--provider", default=DEFAULT_AI_PROVIDER, help="Provider when a request names none")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    api = AssistantAPI(max_concurrency=args.max_concurrency, default_provider=args.provider)
+    # Keep the accept backlog deep enough for bursts of new connections; a client that disconnects
+    # cancels its handler, which stops the upstream request instead of generating an unread answer
+    web.run_app(
+        api.build_app(), host=args.host, port=args.port, backlog=1024, access_log=None, handler_cancellation=True
+    )
+
+
+if __name__ == "__main__":
+    main()
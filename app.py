@@ -7,12 +7,43 @@ Created by: Saqeb Newaz
 
 import streamlit as st
 import os
-from dotenv import load_dotenv
-from main import run_assistant
-from config import FRAMEWORKS, INDUSTRY_EXAMPLES, APP_NAME, VERSION, AUTHOR
+import uuid
+from typing import Any, Dict, List
+from ai_providers import AIProvider, get_shared_provider, provider_config_key
+from history import HistoryProvider, HistoryStore, get_history_store
+from jobs import JobQueue, QueueFullError, get_job_queue
+from prompts import PromptTemplates
+from warm_store import WarmStoreProvider
+from config import (
+    FRAMEWORKS, INDUSTRY_EXAMPLES, APP_NAME, VERSION, AUTHOR, JOB_MAX_PER_SESSION, JOB_POLL_INTERVAL,
+    HISTORY_ENABLED,
+)
+
+
+@st.cache_resource(show_spinner=False)
+def load_provider(provider_name: str, config_key: str) -> AIProvider:
+    """Hold one provider per (name, configuration) across reruns and sessions."""
+    return get_shared_provider(provider_name)
+
+
+@st.cache_resource(show_spinner=False)
+def load_job_queue() -> JobQueue:
+    """Start the background workers once per server process."""
+    return get_job_queue()
+
+
+@st.cache_resource(show_spinner=False)
+def load_history_store() -> HistoryStore:
+    """Open the answer history once per server process."""
+    return get_history_store()
+
+
+def session_id() -> str:
+    """Id of this browser session, kept in the URL so a refresh stays the same scheduler tenant."""
+    if "session" not in st.query_params:
+        st.query_params["session"] = uuid.uuid4().hex
+    return st.query_params["session"]
 
-# Load environment variables
-load_dotenv()
 
 # Page configuration
 st.set_page_config(
@@ -58,7 +89,8 @@ with st.sidebar:
     # API Provider selection
     provider_options = {
         "OpenAI": "openai",
-        "ASI1 Mini": "asi1"
+        "ASI1 Mini": "asi1",
+        "Auto (fastest available)": "auto"
     }
     selected_provider = st.selectbox(
         "🤖 Choose AI Provider",
@@ -80,6 +112,22 @@ with st.sidebar:
         st.success("✅ ASI1 Mini API Key loaded")
     else:
         st.error("❌ ASI1 Mini API Key missing")
+    
+    # Past answers are found by keyword instead of being generated again
+    if HISTORY_ENABLED:
+        st.markdown("## 📚 Answer History")
+        history_query = st.text_input("Search past answers", placeholder="e.g. changeover kanban")
+        if history_query.strip():
+            matches = load_history_store().search(history_query, limit=10)
+            if not matches:
+                st.caption("No past answers match.")
+            for match in matches:
+                title = match["question"] or match["template"].replace("_", " ")
+                with st.expander(f"#{match['id']} {title[:60]}"):
+                    scope = f"{match['framework'] or 'All frameworks'} · {match['industry'] or 'Any industry'}"
+                    st.caption(f"{scope} · {match['provider']}")
+                    entry = load_history_store().get(match["id"])
+                    st.markdown(entry["response"] if entry else match["snippet"])
 
 # Main content
 col1, col2 = st.columns([2, 1])
@@ -123,6 +171,9 @@ with col2:
     
     **🏭 Industry:** {industry}
     """)
+    
+    st.markdown("## 📘 Framework Guide")
+    show_guide = st.button("Show framework guide", use_container_width=True)
 
 # Main action button
 if st.button("🚀 Run Assistant", type="primary", use_container_width=True):
@@ -132,25 +183,103 @@ if st.button("🚀 Run Assistant", type="primary", use_container_width=True):
             st.error("❌ OpenAI API key not found. Please set OPENAI_API_KEY in your .env file.")
         elif provider == "asi1" and not asi1_key:
             st.error("❌ ASI1 Mini API key not found. Please set ASI1_MINI_API_KEY in your .env file.")
+        elif provider == "auto" and not (openai_key or asi1_key):
+            st.error("❌ No API keys found. Please set OPENAI_API_KEY or ASI1_MINI_API_KEY in your .env file.")
         else:
-            with st.spinner("🤖 Thinking..."):
+            # Answers are generated by background workers; the job id in the URL
+            # brings them back after a rerun, refresh or reconnect
+            job_queue = load_job_queue()
+            job_ids = st.query_params.get_all("job")
+            active = [
+                job_id for job_id in job_ids
+                if (job_queue.store.get(job_id) or {}).get("status") in ("queued", "running")
+            ]
+            if len(active) >= JOB_MAX_PER_SESSION:
+                st.warning(f"⚠️ {len(active)} questions are still running. Please wait for one to finish.")
+            else:
                 try:
-                    output = run_assistant(framework, industry, provider.lower(), user_input)
-                    
-                    st.markdown("""
-                    <div class="response-container">
-                        <h3>💡 AI Response</h3>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    st.success("Response:")
-                    st.write(output)
-                    
+                    job_id = job_queue.submit(framework, industry, provider, user_input, session=session_id())
+                    st.query_params["job"] = [job_id] + job_ids
+                except QueueFullError as e:
+                    st.warning(f"⚠️ {e}")
                 except Exception as e:
                     st.error(f"❌ Error: {str(e)}")
     else:
         st.warning("⚠️ Please enter a question.")
 
+
+def show_job(job_queue: JobQueue, job: Dict[str, Any], job_ids: List[str]) -> None:
+    """Render one question with its answer so far, and the button to cancel or dismiss it."""
+    st.markdown(f"**❓ {job['question']}**  \n*{job['framework']} · {job['industry']}*")
+    if job["status"] == "queued":
+        st.info(f"⏳ Queued ({job_queue.store.position(job['id'])} ahead)")
+    elif job["status"] == "running":
+        st.markdown((job["output"] or "🤖 Thinking...") + "▌")
+    else:
+        # Keep whatever arrived before a provider error
+        if job["output"]:
+            st.markdown(job["output"])
+        if job["status"] == "failed":
+            st.error(f"❌ Error: {job['error']}")
+        elif job["status"] == "cancelled":
+            st.warning("⚠️ Cancelled")
+    
+    if job["status"] in ("queued", "running"):
+        if st.button("Cancel", key=f"cancel-{job['id']}"):
+            job_queue.cancel(job["id"])
+    elif st.button("Dismiss", key=f"dismiss-{job['id']}"):
+        st.query_params["job"] = [job_id for job_id in job_ids if job_id != job["id"]]
+        st.rerun(scope="fragment")
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_jobs():
+    """Render this session's questions, refreshing while answers stream in."""
+    job_queue = load_job_queue()
+    job_ids = st.query_params.get_all("job")
+    jobs = [job for job in map(job_queue.store.get, job_ids) if job is not None]
+    # Jobs no page polls any more are cancelled after JOB_ABANDON_AFTER
+    job_queue.watch(job["id"] for job in jobs)
+    if not jobs:
+        return
+    
+    st.markdown("""
+    <div class="response-container">
+        <h3>💡 AI Response</h3>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    for job in jobs:
+        show_job(job_queue, job, job_ids)
+        st.markdown("---")
+
+
+show_jobs()
+
+# Framework guide: served from the pre-generated warm store, live call as fallback
+if show_guide:
+    if (
+        (provider == "openai" and not openai_key)
+        or (provider == "asi1" and not asi1_key)
+        or (provider == "auto" and not (openai_key or asi1_key))
+    ):
+        st.error("❌ API key not found for the selected provider. Please check your .env file.")
+    else:
+        try:
+            guide_ai = load_provider(provider, provider_config_key(provider))
+            if HISTORY_ENABLED:
+                guide_ai = HistoryProvider(guide_ai, load_history_store())
+            guide_ai = WarmStoreProvider(guide_ai)
+            with st.spinner("📘 Loading framework guide..."):
+                guide = guide_ai.call(PromptTemplates.framework_guide(framework, industry))
+            st.markdown(f"### 📘 {framework} in {industry}")
+            st.markdown(guide)
+        except Exception as e:
+            st.error(f"❌ Error: {str(e)}")
+
 # Footer
 st.markdown("---")
-st.markdown(f"<div style='text-align: center; color: #666;'>Made with ❤️ by {AUTHOR} for the manufacturing community</div>", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown(
+    f"<div style='text-align: center; color: #666;'>Made with ❤️ by {AUTHOR} for the manufacturing community</div>",
+    unsafe_allow_html=True,
+)
\ No newline at end of file
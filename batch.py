@@ -0,0 +1,271 @@
+"""
+Bulk batch runner for pre-generating guidance from JSONL question files.
+
+Each input line is a JSON object with ``framework``, ``industry`` and
+``question`` (optionally ``id`` and ``provider``). Results are written to the
+output JSONL in input order while progress is checkpointed, so a killed run
+resumes where it stopped without re-paying completed rows. A row the provider
+rejects is written with its error, but once the provider is unavailable (down,
+circuit open or out of quota after retries) the run stops before that row, so
+resuming later runs it and everything after it.
+
+Usage:
+    python batch.py questions.jsonl answers.jsonl --concurrency 8
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, BinaryIO, Dict, Optional
+
+from ai_providers import ProviderError, get_shared_provider
+from circuit_breaker import CircuitOpenError
+from config import DEFAULT_AI_PROVIDER
+from http_pool import close_async_sessions
+from main import build_assistant_prompt
+from scheduler import RequestShedError, scheduling
+from tokens import count_tokens, fit_user_input
+
+
+def provider_unavailable(error: ProviderError) -> bool:
+    """Whether ``error`` says the provider cannot answer now, rather than that the row is bad."""
+    # Retryable errors reach the runner only once retries are exhausted
+    return error.retryable or isinstance(error, (CircuitOpenError, RequestShedError))
+
+
+class Checkpoint:
+    """Tracks how many input lines are fully written to the output file."""
+    
+    def __init__(self, path: str, input_path: str):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.next_line = 0
+        self.output_bytes = 0
+    
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("input") != self.input_path:
+            raise ValueError(f"Checkpoint {self.path} belongs to a different input file: {state.get('input')}")
+        self.next_line = state["next_line"]
+        self.output_bytes = state["output_bytes"]
+    
+    def save(self, next_line: int, output_bytes: int) -> None:
+        """Atomically persist progress."""
+        self.next_line = next_line
+        self.output_bytes = output_bytes
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"input": self.input_path, "next_line": next_line, "output_bytes": output_bytes}, f)
+        os.replace(tmp_path, self.path)
+
+
+class Throughput:
+    """Rolling rows/s and tokens/s report."""
+    
+    def __init__(self, report_every: float):
+        self.report_every = report_every
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.rows = 0
+        self.errors = 0
+        self.tokens = 0
+    
+    def record(self, result: Dict[str, Any]) -> None:
+        self.rows += 1
+        self.tokens += result.get("completion_tokens", 0)
+        if result.get("error"):
+            self.errors += 1
+        
+        now = time.monotonic()
+        if now - self.last_report >= self.report_every:
+            self.last_report = now
+            self.report()
+    
+    def report(self, final: bool = False) -> None:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        label = "done" if final else "progress"
+        print(
+            f"[{label}] rows={self.rows} errors={self.errors} "
+            f"rows/s={self.rows / elapsed:.2f} tokens/s={self.tokens / elapsed:.1f} "
+            f"elapsed={elapsed:.1f}s",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+class OrderedWriter:
+    """Writes finished rows in input order and checkpoints after each write."""
+    
+    def __init__(self, out: BinaryIO, checkpoint: Checkpoint, throughput: Throughput, window: int):
+        self.out = out
+        self.checkpoint = checkpoint
+        self.throughput = throughput
+        # Rows finished out of order wait here until earlier rows are written
+        self.window = asyncio.Semaphore(window)
+        self.finished: Dict[int, Optional[Dict[str, Any]]] = {}
+        self.next_line = checkpoint.next_line
+    
+    def finish(self, line_no: int, result: Optional[Dict[str, Any]]) -> None:
+        """Hand in the result of a row (None for a blank line) and write every row now in order."""
+        self.finished[line_no] = result
+        start = self.next_line
+        while self.next_line in self.finished:
+            row = self.finished.pop(self.next_line)
+            if row is not None:
+                self.out.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.throughput.record(row)
+            self.next_line += 1
+            self.window.release()
+        if self.next_line != start:
+            self.out.flush()
+            self.checkpoint.save(self.next_line, self.out.tell())
+
+
+class BatchRunner:
+    """Runs JSONL rows through the assistant with bounded concurrency."""
+    
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        provider: str = DEFAULT_AI_PROVIDER,
+        concurrency: int = 8,
+        checkpoint_path: Optional[str] = None,
+        report_every: float = 10.0,
+    ):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.provider = provider
+        self.concurrency = concurrency
+        self.checkpoint = Checkpoint(checkpoint_path or f"{output_path}.ckpt", input_path)
+        self.throughput = Throughput(report_every)
+        # The first row the provider could not answer, and why; the run stops before it
+        self.halted_at: Optional[int] = None
+        self.halt_error: Optional[ProviderError] = None
+    
+    async def _process(self, line_no: int, line: str) -> Dict[str, Any]:
+        """Run one input row and build its output record."""
+        result: Dict[str, Any] = {"line": line_no}
+        started = time.monotonic()
+        try:
+            row = json.loads(line)
+            result.update({
+                "id": row.get("id"),
+                "framework": row["framework"],
+                "industry": row["industry"],
+                "question": row["question"],
+            })
+            ai = get_shared_provider(row.get("provider") or self.provider)
+            question = fit_user_input(row["question"])
+            prompt = build_assistant_prompt(row["framework"], row["industry"], question)
+            response = await ai.acall(prompt)
+            result["response"] = response
+            result["completion_tokens"] = count_tokens(response)
+        except ProviderError as exc:
+            if provider_unavailable(exc):
+                raise
+            result["error"] = str(exc)
+        except (KeyError, ValueError, TypeError) as exc:
+            result["error"] = f"Invalid input row: {exc}"
+        except Exception as exc:
+            result["error"] = f"Error: {exc}"
+        result["latency_s"] = round(time.monotonic() - started, 3)
+        return result
+    
+    async def run(self) -> None:
+        """Stream the input file, keeping at most a small window of rows in memory.
+        
+        Raises the provider's error if it became unavailable; rows from the
+        first one it could not answer onwards are left for the next run.
+        """
+        self.checkpoint.load()
+        if self.checkpoint.next_line:
+            print(f"Resuming after {self.checkpoint.next_line} completed rows", file=sys.stderr)
+        
+        # Drop anything written after the last checkpoint; those rows are re-run
+        mode = "r+b" if os.path.exists(self.output_path) else "wb"
+        with open(self.output_path, mode) as out:
+            out.truncate(self.checkpoint.output_bytes)
+            out.seek(self.checkpoint.output_bytes)
+            # Bulk rows only use spare provider capacity; each input file shares it fairly with others
+            with scheduling("bulk", tenant=f"batch:{os.path.basename(self.input_path)}"):
+                await self._run(out)
+        await close_async_sessions()
+        self.throughput.report(final=True)
+        if self.halt_error is not None:
+            raise self.halt_error
+    
+    async def _work(self, in_flight: asyncio.Semaphore, writer: "OrderedWriter", line_no: int, line: str) -> None:
+        async with in_flight:
+            if self.halted_at is not None and line_no > self.halted_at:
+                return  # Would only be thrown away: nothing after the halted row is written
+            try:
+                result = await self._process(line_no, line)
+            except ProviderError as exc:
+                # Never written, so the writer and the checkpoint stop short of this row
+                if self.halted_at is None or line_no < self.halted_at:
+                    self.halted_at, self.halt_error = line_no, exc
+                writer.window.release()  # Wakes the reader if it waits for room, so it can stop
+                return
+        writer.finish(line_no, result)
+    
+    async def _run(self, out: BinaryIO) -> None:
+        in_flight = asyncio.Semaphore(self.concurrency)
+        writer = OrderedWriter(out, self.checkpoint, self.throughput, window=self.concurrency * 4)
+        tasks = set()
+        with open(self.input_path, "r", encoding="utf-8") as source:
+            for line_no, line in enumerate(source):
+                if line_no < self.checkpoint.next_line:
+                    continue
+                await writer.window.acquire()
+                if self.halted_at is not None:
+                    break
+                if not line.strip():
+                    writer.finish(line_no, None)
+                    continue
+                task = asyncio.ensure_future(self._work(in_flight, writer, line_no, line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            
+            if tasks:
+                await asyncio.gather(*tasks)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of Lean questions through the assistant.")
+    parser.add_argument("input", help="Input JSONL with framework, industry and question per line")
+    parser.add_argument("output", help="Output JSONL (appended to when resuming)")
+    parser.add_argument("--provider", default=DEFAULT_AI_PROVIDER, help="AI provider ('openai' or 'asi1')")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum in-flight requests")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.ckpt)")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between throughput reports")
+    args = parser.parse_args()
+    
+    runner = BatchRunner(
+        args.input,
+        args.output,
+        provider=args.provider,
+        concurrency=args.concurrency,
+        checkpoint_path=args.checkpoint,
+        report_every=args.report_every,
+    )
+    try:
+        asyncio.run(runner.run())
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; rerun the same command to resume from row {runner.checkpoint.next_line}.")
+        sys.exit(130)
+    except ProviderError as exc:
+        print(f"Stopped: {exc}\nRerun the same command to resume from row {runner.checkpoint.next_line}.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
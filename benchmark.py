@@ -0,0 +1,516 @@
+"""
+Benchmark suite for the Lean AI Assistant against a local mock provider.
+
+Starts mock_server.py in a subprocess, points OPENAI_API_URL / ASI1_MINI_API_URL
+at it and drives realistic workloads through the real code paths:
+
+    single  sequential run_assistant calls (interactive web requests)
+    stream  sequential stream_assistant calls, measuring time to first chunk
+    menu    LeanAIAssistant menu flows (two concurrent template calls each)
+    burst   high-concurrency arun_assistant bursts on one event loop
+    replay  recorded provider traffic (--cassette), re-run through run_assistant
+            at its recorded arrival times, with no mock server and no network
+
+Caches are disabled so every request reaches the provider. Results (p50/p95/p99
+latency, throughput, error rate, memory) are saved as JSON and can be compared
+against an earlier run to catch regressions.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --workload burst --burst-size 200 --tokens-per-second 100
+    python benchmark.py --compare benchmark_results/<earlier run>.json
+    python benchmark.py --cassette .cache/cassettes/traffic.jsonl.gz --speed 10
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+WORKLOADS = ("single", "stream", "menu", "burst")
+REPLAY_URL = "http://replay.invalid/v1/chat/completions"  # Never contacted: requests are served from the cassette
+RESULTS_DIR = "benchmark_results"
+
+# Metric -> which direction is worse
+COMPARED_METRICS = {
+    "p50_ms": "higher",
+    "p95_ms": "higher",
+    "p99_ms": "higher",
+    "ttfb_p50_ms": "higher",
+    "throughput_rps": "lower",
+    "error_rate": "higher",
+    "rss_mb": "higher",
+}
+
+QUESTIONS = [
+    "How can we reduce changeover time on line {i}?",
+    "What is the best way to cut scrap at workstation {i}?",
+    "How should we balance takt time across {i} operators?",
+    "Which KPIs should a team of {i} track for first-pass yield?",
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear-interpolated percentile (q in 0-100) of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def question(i: int) -> str:
+    """A distinct question per request so nothing is answered from a cache."""
+    return QUESTIONS[i % len(QUESTIONS)].format(i=i + 2)
+
+
+def rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class MockProcess:
+    """Runs mock_server.py in a child process so it does not share our GIL."""
+    
+    def __init__(self, args: argparse.Namespace):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        command = [
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py"),
+            "--port", str(self.port),
+            "--latency", str(args.latency),
+            "--jitter", str(args.jitter),
+            "--tokens-per-second", str(args.tokens_per_second),
+            "--completion-tokens", str(args.completion_tokens),
+            "--error-rate", str(args.error_rate),
+            "--error-status", str(args.error_status),
+        ]
+        if args.no_stream:
+            command.append("--no-stream")
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        self.url = f"http://127.0.0.1:{self.port}/v1/chat/completions"
+        self.process.stdout.readline()  # Wait for the listening banner
+    
+    def stats(self) -> Dict[str, int]:
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/stats", timeout=5) as response:
+            return json.load(response)
+    
+    def stop(self) -> None:
+        self.process.terminate()
+        self.process.wait(timeout=5)
+
+
+def configure_environment(url: str, keep_rate_limits: bool) -> None:
+    """Point both providers at the mock server (or replay URL); must run before importing app modules."""
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_API_URL": url,
+        "ASI1_MINI_API_KEY": "benchmark",
+        "ASI1_MINI_API_URL": url,
+        "RESPONSE_CACHE_ENABLED": "false",
+        "WARM_STORE_ENABLED": "false",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "REQUEST_COALESCING_ENABLED": "false",  # Bursts repeat prompts; measure every call
+        "CIRCUIT_BREAKER_ENABLED": "false",  # Injected errors would open it and skip calls
+        "SCHEDULER_ENABLED": "false",  # Bursts exceed the per-provider slot cap by design
+        "HISTORY_ENABLED": "false",
+    })
+    if not keep_rate_limits:
+        for name in ("OPENAI_REQUESTS_PER_MINUTE", "OPENAI_TOKENS_PER_MINUTE",
+                     "ASI1_REQUESTS_PER_MINUTE", "ASI1_TOKENS_PER_MINUTE"):
+            os.environ[name] = "0"
+
+
+def summarize(latencies: List[float], errors: int, wall: float, ttfb: Optional[List[float]] = None) -> Dict[str, Any]:
+    """Latency percentiles (ms), throughput and error rate for one workload."""
+    count = len(latencies)
+    summary: Dict[str, Any] = {
+        "requests": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(count / wall, 2) if wall else 0.0,
+        "mean_ms": round(1000 * sum(latencies) / count, 1) if count else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 1),
+        "p95_ms": round(1000 * percentile(latencies, 95), 1),
+        "p99_ms": round(1000 * percentile(latencies, 99), 1),
+        "max_ms": round(1000 * max(latencies), 1) if count else 0.0,
+    }
+    if ttfb is not None:
+        summary["ttfb_p50_ms"] = round(1000 * percentile(ttfb, 50), 1)
+        summary["ttfb_p95_ms"] = round(1000 * percentile(ttfb, 95), 1)
+    return summary
+
+
+def run_single(args: argparse.Namespace) -> Dict[str, Any]:
+    from config import FRAMEWORKS, INDUSTRY_EXAMPLES
+    from main import run_assistant
+    
+    frameworks = list(FRAMEWORKS.values())
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for i in range(args.requests):
+        begin = time.perf_counter()
+        response = run_assistant(
+            frameworks[i % len(frameworks)], INDUSTRY_EXAMPLES[i % len(INDUSTRY_EXAMPLES)], args.provider, question(i)
+        )
+        latencies.append(time.perf_counter() - begin)
+        errors += response.startswith("Error:")
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def run_stream(args: argparse.Namespace) -> Dict[str, Any]:
+    from ai_providers import ProviderError
+    from config import FRAMEWORKS, INDUSTRY_EXAMPLES
+    from main import stream_assistant
+    
+    frameworks = list(FRAMEWORKS.values())
+    latencies, ttfb, errors = [], [], 0
+    started = time.perf_counter()
+    for i in range(args.requests):
+        begin = time.perf_counter()
+        first = None
+        try:
+            for _ in stream_assistant(
+                frameworks[i % len(frameworks)], INDUSTRY_EXAMPLES[i % len(INDUSTRY_EXAMPLES)], args.provider, question(i)
+            ):
+                if first is None:
+                    first = time.perf_counter() - begin
+        except ProviderError:
+            errors += 1
+        latencies.append(time.perf_counter() - begin)
+        ttfb.append(first if first is not None else latencies[-1])
+    return summarize(latencies, errors, time.perf_counter() - started, ttfb)
+
+
+def run_menu(args: argparse.Namespace) -> Dict[str, Any]:
+    from config import FRAMEWORKS, INDUSTRY_EXAMPLES
+    from main import LeanAIAssistant
+    from prompts import PromptTemplates
+    
+    assistant = LeanAIAssistant(args.provider)
+    frameworks = list(FRAMEWORKS.values())
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    try:
+        for i in range(args.requests):
+            framework = frameworks[i % len(frameworks)]
+            industry = INDUSTRY_EXAMPLES[i % len(INDUSTRY_EXAMPLES)]
+            # Alternate the two follow-up views: implementation plan and AI tools
+            if i % 2 == 0:
+                prompts = [
+                    PromptTemplates.implementation_roadmap(framework, industry),
+                    PromptTemplates.kpi_metrics(framework, industry),
+                ]
+            else:
+                prompts = [
+                    PromptTemplates.ai_tools_recommendation(framework, industry),
+                    PromptTemplates.crisis_communication_integration(),
+                ]
+            begin = time.perf_counter()
+            sections = [assistant.section_result(future) for future in assistant.dispatch(prompts)]
+            latencies.append(time.perf_counter() - begin)
+            errors += any(section.startswith("❌") for section in sections)
+    finally:
+        assistant.executor.shutdown(wait=False)
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def run_burst(args: argparse.Namespace) -> Dict[str, Any]:
+    from config import FRAMEWORKS, INDUSTRY_EXAMPLES
+    from http_pool import close_async_sessions
+    from main import arun_assistant
+    
+    frameworks = list(FRAMEWORKS.values())
+    
+    async def timed(i: int) -> tuple:
+        begin = time.perf_counter()
+        response = await arun_assistant(
+            frameworks[i % len(frameworks)], INDUSTRY_EXAMPLES[i % len(INDUSTRY_EXAMPLES)], args.provider, question(i)
+        )
+        return time.perf_counter() - begin, response.startswith("Error:")
+    
+    async def bursts() -> list:
+        results = []
+        for burst in range(args.bursts):
+            offset = burst * args.burst_size
+            results += await asyncio.gather(*(timed(offset + i) for i in range(args.burst_size)))
+        await close_async_sessions()
+        return results
+    
+    started = time.perf_counter()
+    results = asyncio.run(bursts())
+    wall = time.perf_counter() - started
+    return summarize([latency for latency, _ in results], sum(failed for _, failed in results), wall)
+
+
+def _replay_selection(interactions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """The recorded requests to send again; recorded retries are left to the build under test."""
+    selected, retryable = [], set()
+    for interaction in interactions:
+        if interaction["key"] not in retryable:
+            selected.append(interaction)
+        status = interaction.get("status", 0)
+        if "error" in interaction or status in (408, 429) or status >= 500:
+            retryable.add(interaction["key"])
+        else:
+            retryable.discard(interaction["key"])
+    return selected
+
+
+def _time_to_first(chunks: Iterable[str], begin: float) -> Optional[float]:
+    """Drain a stream; seconds from ``begin`` to its first chunk."""
+    first = None
+    for _ in chunks:
+        if first is None:
+            first = time.perf_counter() - begin
+    return first
+
+
+def _replay_request(interaction: Dict[str, Any], provider: str) -> Tuple[float, Optional[float], bool]:
+    """Issue a recorded request again, through run_assistant when it came from there."""
+    from ai_providers import ProviderError, get_shared_provider
+    from main import run_assistant, stream_assistant
+    from prompts import PromptTemplates
+    
+    origin = interaction.get("origin") or {}
+    fields = origin.get("fields", {})
+    streamed = bool(interaction["request"].get("stream"))
+    begin = time.perf_counter()
+    first = None
+    failed = False
+    try:
+        if origin.get("template") == "build_assistant_prompt":
+            inputs = (fields["framework"], fields["industry"], provider, fields["user_input"])
+            if streamed:
+                first = _time_to_first(stream_assistant(*inputs), begin)
+            else:
+                failed = run_assistant(*inputs).startswith("Error:")
+        else:
+            build = getattr(PromptTemplates, origin.get("template", ""), None)
+            prompt = build(**fields) if build else interaction["request"]["messages"][-1]["content"]
+            ai = get_shared_provider(provider)
+            if streamed:
+                first = _time_to_first(ai.stream(prompt), begin)
+            else:
+                ai.call(prompt)
+    except ProviderError:
+        failed = True
+    return time.perf_counter() - begin, first, failed
+
+
+def run_replay(args: argparse.Namespace) -> Dict[str, Any]:
+    from ai_providers import get_shared_provider
+    from transport import Cassette
+    
+    interactions = sorted(Cassette(args.cassette).interactions(), key=lambda interaction: interaction["at"])
+    if not interactions:
+        raise SystemExit(f"No recorded requests in {args.cassette}")
+    providers = {get_shared_provider(name).display_name: name for name in ("openai", "asi1")}
+    requests_to_send = _replay_selection(interactions)
+    
+    first_arrival = requests_to_send[0]["at"]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.replay_workers) as executor:
+        futures = []
+        for interaction in requests_to_send:
+            offset = (interaction["at"] - first_arrival) / args.speed if args.speed > 0 else 0.0
+            remaining = started + offset - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+            provider = providers.get(interaction["provider"], args.provider)
+            futures.append(executor.submit(_replay_request, interaction, provider))
+        results = [future.result() for future in futures]
+    wall = time.perf_counter() - started
+    
+    latencies = [latency for latency, _, _ in results]
+    ttfb = [first if first is not None else latency for latency, first, _ in results]
+    return summarize(latencies, sum(failed for _, _, failed in results), wall, ttfb)
+
+
+RUNNERS: Dict[str, Callable[[argparse.Namespace], Dict[str, Any]]] = {
+    "single": run_single,
+    "stream": run_stream,
+    "menu": run_menu,
+    "burst": run_burst,
+    "replay": run_replay,
+}
+
+
+def server_stats(mock: Optional[MockProcess]) -> Dict[str, int]:
+    """Upstream requests and connections so far: from the mock server, or answered from the cassette."""
+    if mock is not None:
+        return mock.stats()
+    from transport import cassette_stats
+    
+    return {"requests": sum(stats["replayed"] for stats in cassette_stats().values()), "connections": 0}
+
+
+def run_workload(name: str, args: argparse.Namespace, mock: Optional[MockProcess]) -> Dict[str, Any]:
+    before = server_stats(mock)
+    if args.trace_memory:
+        tracemalloc.start()
+    result = RUNNERS[name](args)
+    if args.trace_memory:
+        result["heap_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+    result["rss_mb"] = round(rss_mb(), 1)
+    
+    after = server_stats(mock)
+    result["server_requests"] = after["requests"] - before["requests"]
+    result["server_connections"] = after["connections"] - before["connections"]
+    return result
+
+
+def print_results(workloads: Dict[str, Dict[str, Any]]) -> None:
+    header = (
+        f"{'workload':8} {'reqs':>6} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} "
+        f"{'calls':>6} {'conns':>6} {'rss MB':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for name, r in workloads.items():
+        print(
+            f"{name:8} {r['requests']:>6} {100 * r['error_rate']:>6.1f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+            f"{r['p99_ms']:>9.1f} {r['throughput_rps']:>8.2f} {r['server_requests']:>6} {r['server_connections']:>6} "
+            f"{r['rss_mb']:>8.1f}"
+        )
+        if "ttfb_p50_ms" in r:
+            print(f"{'':8} time to first chunk: p50 {r['ttfb_p50_ms']:.1f} ms, p95 {r['ttfb_p95_ms']:.1f} ms")
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print metric changes against a baseline run and return the regressions."""
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp')}):")
+    changed = sorted(
+        key for key, value in current["settings"].items()
+        if key != "workload" and baseline.get("settings", {}).get(key, value) != value
+    )
+    if changed:
+        print(f"  ⚠️ settings differ from the baseline ({', '.join(changed)}); numbers may not be comparable")
+    for name, result in current["workloads"].items():
+        base = baseline.get("workloads", {}).get(name)
+        if base is None:
+            continue
+        for metric, worse in COMPARED_METRICS.items():
+            if metric not in result or metric not in base:
+                continue
+            old, new = base[metric], result[metric]
+            change = (new - old) / old if old else 0.0
+            if metric == "error_rate":
+                regressed = new - old > 0.01
+            elif worse == "higher":
+                regressed = change > tolerance
+            else:
+                regressed = change < -tolerance
+            flag = "  ⚠️ regression" if regressed else ""
+            print(f"  {name:8} {metric:15} {old:>10} -> {new:>10} ({change:+.1%}){flag}")
+            if regressed:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the assistant against a local mock provider.")
+    parser.add_argument(
+        "--workload", action="append", choices=WORKLOADS + ("replay",),
+        help="Workload to run (default: all, or replay with --cassette)",
+    )
+    parser.add_argument("--provider", default="openai", help="AI provider ('openai' or 'asi1')")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per sequential workload")
+    parser.add_argument("--burst-size", type=int, default=100, help="Concurrent requests per burst")
+    parser.add_argument("--bursts", type=int, default=3, help="Number of bursts")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Mock latency std-dev in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Mock generation speed (0 = instant)")
+    parser.add_argument("--completion-tokens", type=int, default=100, help="Mock tokens per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of mock failures")
+    parser.add_argument("--no-stream", action="store_true", help="Mock answers stream requests with plain JSON")
+    parser.add_argument("--cassette", help="Replay this recorded traffic instead of running the mock server")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed-up (1 = recorded timing, 0 = no delays)")
+    parser.add_argument("--replay-workers", type=int, default=64, help="Most replayed requests in flight at once")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Keep the configured client rate limits")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report the Python heap peak (slower)")
+    parser.add_argument("--output", help=f"Result file (default: {RESULTS_DIR}/<timestamp>-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown before flagging")
+    args = parser.parse_args()
+    if args.cassette is None and "replay" in (args.workload or ()):
+        parser.error("the replay workload needs --cassette")
+    
+    mock = None if args.cassette else MockProcess(args)
+    try:
+        configure_environment(mock.url if mock else REPLAY_URL, args.keep_rate_limits)
+        if args.cassette:
+            os.environ.update({
+                "LLM_TRANSPORT": "replay",
+                "LLM_CASSETTE": args.cassette,
+                "LLM_REPLAY_SPEED": str(args.speed),
+            })
+        workloads = {}
+        for name in args.workload or (["replay"] if args.cassette else WORKLOADS):
+            print(f"Running {name}...", file=sys.stderr, flush=True)
+            workloads[name] = run_workload(name, args, mock)
+    finally:
+        if mock is not None:
+            mock.stop()
+    
+    commit = git_commit()
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    results = {
+        "commit": commit,
+        "timestamp": timestamp,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "workloads": workloads,
+    }
+    
+    print()
+    print_results(workloads)
+    
+    output = args.output or os.path.join(RESULTS_DIR, f"{timestamp}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {output}")
+    
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""
+Two-tier response cache for AI provider calls.
+
+An in-memory LRU sits in front of an on-disk SQLite store so that repeat
+prompts (every PromptTemplates prompt is a pure function of framework and
+industry) are answered without another LLM round trip.
+
+Created by: Saqeb Newaz
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from ai_providers import AIProvider, ProviderWrapper
+from config import (
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MEMORY_ENTRIES,
+)
+from metrics import metrics
+
+
+class ResponseCache:
+    """In-memory LRU backed by a size-bounded SQLite store, with TTL expiry."""
+    
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        memory_entries: int = RESPONSE_CACHE_MEMORY_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._db.commit()
+    
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+    
+    def _remember(self, key: str, response: str, created_at: float) -> None:
+        """Insert into the memory tier, evicting the least recently used entry."""
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for ``key``, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    metrics.cache_lookup("response", hit=True)
+                    return response
+                del self._memory[key]
+            
+            row = self._db.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._counters["misses"] += 1
+                metrics.cache_lookup("response", hit=False)
+                return None
+            
+            response, created_at = row
+            if self._expired(created_at, now):
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                self._counters["misses"] += 1
+                metrics.cache_lookup("response", hit=False)
+                return None
+            
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, response, created_at)
+            self._counters["disk_hits"] += 1
+            metrics.cache_lookup("response", hit=True)
+            return response
+    
+    def put(self, key: str, response: str) -> None:
+        """Store a response in both tiers and enforce the disk size bound."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            evicted = self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self._db.commit()
+            self._counters["writes"] += 1
+            self._counters["evictions"] += max(0, evicted)
+    
+    def purge_expired(self) -> int:
+        """Delete expired entries from disk and return how many were removed."""
+        if self.ttl <= 0:
+            return 0
+        with self._lock:
+            cutoff = time.time() - self.ttl
+            removed = self._db.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,)).rowcount
+            self._db.commit()
+            for key in [k for k, (_, created) in self._memory.items() if created < cutoff]:
+                del self._memory[key]
+            return removed
+    
+    def clear(self) -> None:
+        """Drop every cached response."""
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+    
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and the current size of each tier."""
+        with self._lock:
+            stats: Dict[str, float] = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+    
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class CachedProvider(ProviderWrapper):
+    """Provider wrapper that serves repeat requests from a ResponseCache."""
+    
+    def __init__(self, provider: AIProvider, cache: Optional[ResponseCache] = None):
+        super().__init__(provider)
+        self.cache = cache or get_response_cache()
+    
+    def call(self, prompt: str) -> str:
+        key = self.provider.request_fingerprint(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        # Provider errors raise, so only real answers reach the cache
+        response = self.provider.call(prompt)
+        self.cache.put(key, response)
+        return response
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        key = self.provider.request_fingerprint(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        for chunk in self.provider.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        
+        # Only reached when the stream completed without raising
+        if chunks:
+            self.cache.put(key, "".join(chunks))
+    
+    async def acall(self, prompt: str) -> str:
+        import asyncio  # Only async callers pay for the event loop machinery
+        
+        # SQLite reads and writes block, so they run on a worker thread rather than the event loop
+        key = self.provider.request_fingerprint(prompt)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached
+        
+        response = await self.provider.acall(prompt)
+        await asyncio.to_thread(self.cache.put, key, response)
+        return response
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        import asyncio
+        
+        key = self.provider.request_fingerprint(prompt)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        async for chunk in self.provider.astream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        
+        if chunks:
+            await asyncio.to_thread(self.cache.put, key, "".join(chunks))
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache, creating it on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""
+Cancellation of provider calls whose answer nobody will read.
+
+A CancelToken is created by whoever knows an answer has been abandoned: the
+CLI on Ctrl-C or a restart, the job queue when a job is cancelled or its page
+stops polling. The assistant entry points make it current for the provider
+calls they make (like ``scheduling()``, through a context variable) and the
+provider stack reacts: a queued request leaves the scheduler, a backoff or
+rate-limit wait ends, the socket of an in-flight request is shut down so the
+blocked read returns at once, and the call raises RequestCancelled. On the
+event loop the token cancels the task awaiting the call instead.
+
+    token = CancelToken()
+    with cancellable(token):
+        ai.call(prompt)      # token.cancel() from another thread aborts it
+
+Created by: Saqeb Newaz
+"""
+
+import contextlib
+import contextvars
+import sys
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, ContextManager, Dict, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class RequestCancelled(Exception):
+    """The call was cancelled before its answer was complete.
+    
+    Deliberately not a ProviderError: a cancelled call says nothing about the
+    provider, so it is not failed over, counted by a circuit breaker or shared
+    with callers that joined the same request.
+    """
+
+
+def is_cancellation(exc_type: type) -> bool:
+    """True for exceptions that end a call because its caller went away rather than because it failed."""
+    if issubclass(exc_type, (RequestCancelled, GeneratorExit, KeyboardInterrupt)):
+        return True
+    asyncio = sys.modules.get("asyncio")  # Only loaded if something already uses the event loop
+    return asyncio is not None and issubclass(exc_type, asyncio.CancelledError)
+
+
+class CancelToken:
+    """One-way, thread-safe cancellation signal with callbacks run when it fires."""
+    
+    def __init__(self):
+        self.reason = ""
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: Dict[int, Callable[[], Any]] = {}
+        self._next_id = 0
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+    
+    def cancel(self, reason: str = "Request cancelled") -> bool:
+        """Cancel and run the callbacks; False if the token was already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = list(self._callbacks.values()), {}
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass  # One failed abort must not keep the others from running
+        return True
+    
+    def on_cancel(self, callback: Callable[[], Any]) -> Callable[[], None]:
+        """Run ``callback`` once cancelled (at once if already); returns a function that unregisters it."""
+        with self._lock:
+            if not self._event.is_set():
+                key = self._next_id
+                self._next_id += 1
+                self._callbacks[key] = callback
+                return lambda: self._unregister(key)
+        callback()
+        return lambda: None
+    
+    def _unregister(self, key: int) -> None:
+        with self._lock:
+            self._callbacks.pop(key, None)
+    
+    @contextlib.contextmanager
+    def watching(self, callback: Callable[[], Any]) -> Iterator[None]:
+        """Run ``callback`` if the token is cancelled while inside the block."""
+        unregister = self.on_cancel(callback)
+        try:
+            yield
+        finally:
+            unregister()
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block up to ``timeout`` seconds; True as soon as the token is cancelled."""
+        return self._event.wait(timeout)
+    
+    def check(self) -> None:
+        """Raise RequestCancelled if the token was cancelled."""
+        if self._event.is_set():
+            raise RequestCancelled(self.reason)
+    
+    def child(self) -> "CancelToken":
+        """A token cancelled along with this one that can also be cancelled on its own."""
+        child = CancelToken()
+        child.on_cancel(self.on_cancel(lambda: child.cancel(self.reason)))
+        return child
+
+
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("lean_ai_cancel", default=None)
+
+
+@contextlib.contextmanager
+def cancellable(token: Optional[CancelToken]) -> Iterator[None]:
+    """Make ``token`` current for the provider calls made inside; None keeps the current one."""
+    if token is None:
+        yield
+        return
+    reset = _current.set(token)
+    try:
+        yield
+    finally:
+        _current.reset(reset)
+
+
+def current_token() -> Optional[CancelToken]:
+    """The token of the calling thread or task, if its caller can cancel it."""
+    return _current.get()
+
+
+def check_cancelled() -> None:
+    """Raise RequestCancelled if the current token was cancelled."""
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def on_cancel(callback: Callable[[], Any]) -> ContextManager[None]:
+    """Run ``callback`` if the current token is cancelled inside the block; a no-op without a token."""
+    token = _current.get()
+    return token.watching(callback) if token is not None else contextlib.nullcontext()
+
+
+def sleep(seconds: float) -> None:
+    """time.sleep() that ends early with RequestCancelled once the current token is cancelled."""
+    token = _current.get()
+    if token is None:
+        time.sleep(seconds)
+    elif token.wait(seconds):
+        raise RequestCancelled(token.reason)
+
+
+def iter_cancellable(chunks: Iterator[T], token: Optional[CancelToken]) -> Iterator[T]:
+    """Yield from ``chunks`` with ``token`` current while each chunk is produced.
+    
+    A context variable set around a ``yield`` would leak into the consumer, so
+    the token is set around each step of the inner generator instead.
+    """
+    if token is None:
+        yield from chunks
+        return
+    try:
+        while True:
+            with cancellable(token):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+async def await_cancellable(awaitable: Awaitable[T], token: Optional[CancelToken]) -> T:
+    """Await ``awaitable`` as its own task, cancelling it (RequestCancelled) when ``token`` fires."""
+    if token is None:
+        return await awaitable
+    import asyncio  # Only async callers pay for the event loop machinery
+    
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(awaitable)
+    
+    def cancel_task() -> None:
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            pass  # The loop has closed
+    
+    with token.watching(cancel_task):
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not token.cancelled:
+                raise  # Our own caller was cancelled
+    raise RequestCancelled(token.reason)
+
+
+async def aiter_cancellable(chunks: AsyncIterator[T], token: Optional[CancelToken]) -> AsyncIterator[T]:
+    """Async counterpart of iter_cancellable(): each chunk is awaited through await_cancellable()."""
+    if token is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+    try:
+        while True:
+            try:
+                chunk = await await_cancellable(chunks.__anext__(), token)
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,477 @@
+"""
+Chat-completions providers (OpenAI and ASI1 Mini) over pooled HTTP.
+
+Kept apart from ai_providers so that importing the provider interfaces stays
+cheap: this module, requests and the async HTTP stack load only when a
+provider is first instantiated through the registry. Requests go through the
+transport chosen by LLM_TRANSPORT: the live pools, or a recorder or player of
+cassettes (see transport.py). A call whose cancel token fires (see
+cancellation.py) stops where it is and raises RequestCancelled.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from abc import abstractmethod
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterator, List, Mapping, Optional, Tuple
+
+import requests
+
+from ai_providers import (
+    AIProvider, InvalidResponseError, ProviderConnectionError, ProviderError, ProviderHTTPError,
+    ProviderTimeoutError, RateLimitError,
+)
+from cancellation import RequestCancelled, check_cancelled, current_token, is_cancellation, sleep
+from circuit_breaker import CircuitBreaker, get_circuit_breaker
+from config import (
+    OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE,
+    ASI1_REQUESTS_PER_MINUTE, ASI1_TOKENS_PER_MINUTE, RETRY_MAX_ATTEMPTS, HTTP_CONNECT_TIMEOUT,
+)
+from http_pool import abort_on_cancel
+from metrics import CallRecorder, metrics
+from rate_limit import RateLimiter, backoff_delay, get_rate_limiter, parse_retry_after
+from prompts import build_messages
+from tokens import completion_budget, count_message_tokens, count_tokens, usage_log
+from transport import get_async_transport, get_transport, origin
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+def _async_errors() -> Tuple[type, ...]:
+    """Transport errors of the async client, which is only imported once it is used."""
+    import aiohttp
+    return (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def _async_timeout(read_timeout: float) -> "aiohttp.ClientTimeout":
+    import aiohttp
+    return aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=read_timeout)
+
+
+class ChatCompletionsProvider(AIProvider):
+    """Shared request/response handling for chat-completions style APIs."""
+    
+    display_name = "AI"
+    # Environment variables that configure an instance (see provider_config_key)
+    config_env: Tuple[str, ...] = ()
+    
+    api_key: str
+    api_url: str
+    transport: Any
+    rate_limiter: RateLimiter
+    breaker: CircuitBreaker
+    
+    def _headers(self) -> Dict[str, str]:
+        """Build request headers."""
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    @abstractmethod
+    def _payload(self, prompt: str) -> Dict[str, Any]:
+        """Build the chat-completions request body for a prompt."""
+        pass
+    
+    def _stream_payload(self, prompt: str) -> Dict[str, Any]:
+        payload = self._payload(prompt)
+        payload["stream"] = True
+        return payload
+    
+    def request_fingerprint(self, prompt: str) -> str:
+        """Key on provider, model, system prompt, prompt text and sampling parameters."""
+        key = json.dumps([self.display_name, self._payload(prompt)], sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+    
+    def _estimate_tokens(self, payload: Dict[str, Any]) -> int:
+        """Tokens a request counts against the quota: counted prompt tokens plus max_tokens."""
+        return count_message_tokens(payload.get("messages", [])) + int(payload.get("max_tokens", 0))
+    
+    def _http_error(self, status_code: int, reason: str, headers: Mapping[str, str], body: str) -> ProviderHTTPError:
+        message = f"Error contacting {self.display_name} API: {status_code} {reason}"
+        if body:
+            message += f" - {body[:300]}"
+        error_class = RateLimitError if status_code == 429 else ProviderHTTPError
+        return error_class(self.display_name, message, status_code, parse_retry_after(headers))
+    
+    def _connection_error(self, exc: Exception) -> ProviderConnectionError:
+        timed_out = isinstance(exc, (requests.Timeout, asyncio.TimeoutError))
+        error_class = ProviderTimeoutError if timed_out else ProviderConnectionError
+        return error_class(self.display_name, f"Error contacting {self.display_name} API: {exc}")
+    
+    def _broken(self, exc: Exception) -> ProviderConnectionError:
+        """A transport failure after the response started; it counts against the circuit breaker."""
+        error = self._connection_error(exc)
+        self.breaker.record_failure()
+        return error
+    
+    def _invalid_response(self, exc: Exception) -> InvalidResponseError:
+        return InvalidResponseError(self.display_name, f"Invalid response from {self.display_name} API: {exc}")
+    
+    def _settle_usage(
+        self, prompt: str, usage: Optional[Dict[str, Any]], reserved_tokens: int, record: CallRecorder
+    ) -> None:
+        """Settle the token reservation against reported usage and record the token counts."""
+        self.rate_limiter.settle(reserved_tokens, (usage or {}).get("total_tokens"))
+        record.usage(usage)
+        if usage:
+            usage_log.record(self.display_name, prompt, usage)
+    
+    def _parse_completion(self, prompt: str, data: Dict[str, Any], reserved_tokens: int, record: CallRecorder) -> str:
+        """Extract the reply from a non-streamed completion."""
+        self._settle_usage(prompt, data.get("usage"), reserved_tokens, record)
+        try:
+            return data["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as exc:
+            raise self._invalid_response(exc)
+    
+    def _should_retry(self, error: ProviderError, attempt: int) -> bool:
+        if isinstance(error, RateLimitError):
+            self.rate_limiter.on_rate_limited(error.retry_after)
+        retry = error.retryable and attempt < RETRY_MAX_ATTEMPTS
+        if retry:
+            metrics.retries.inc(provider=self.display_name, error=type(error).__name__)
+        return retry
+    
+    def _abandoned(self, prompt: str, payload: Dict[str, Any], reserved_tokens: int, received: str, answered: bool) -> None:
+        """Account for a call given up before its answer was complete.
+        
+        ``answered`` means the response had started, so the token reservation
+        is still open; requests aborted earlier are settled by _send().
+        """
+        generated = count_tokens(received)
+        if answered:
+            # The provider still bills the prompt and whatever it generated before the connection closed
+            self.rate_limiter.settle(reserved_tokens, reserved_tokens - int(payload.get("max_tokens", 0)) + generated)
+        budget = int(payload.get("max_tokens") or completion_budget(prompt))
+        metrics.cancellations.inc(provider=self.display_name, stage="streaming" if received else "waiting")
+        metrics.cancelled_tokens_saved.inc(max(0, budget - generated), provider=self.display_name)
+    
+    def _send(self, payload: Dict[str, Any], tokens: int, stream: bool = False) -> requests.Response:
+        """POST through the circuit breaker and rate limiter, retrying transient failures with backoff."""
+        kind = "stream" if stream else "call"
+        attempt = 0
+        while True:
+            attempt += 1
+            check_cancelled()
+            # Fails fast while the provider is known to be down, retries included
+            probe = self.breaker.allow()
+            try:
+                self.rate_limiter.acquire(tokens)
+            except BaseException:
+                self.breaker.release_probe(probe)  # Cancelled before anything was sent
+                raise
+            timeout = (self.transport.timeout[0], self.breaker.timeout(kind))
+            started = time.monotonic()
+            try:
+                response = self.transport.post(
+                    self.api_url, json=payload, headers=self._headers(), stream=stream, timeout=timeout
+                )
+            except requests.RequestException as exc:
+                token = current_token()
+                if token is not None and token.cancelled:
+                    # Aborted by the caller, not failed by the provider; only the prompt was billed
+                    self.rate_limiter.settle(tokens, tokens - int(payload.get("max_tokens", 0)))
+                    self.breaker.release_probe(probe)
+                    raise RequestCancelled(token.reason) from None
+                error: ProviderError = self._connection_error(exc)
+            else:
+                if response.status_code < 400:
+                    self.rate_limiter.on_success()
+                    self.breaker.record_success(time.monotonic() - started, kind)
+                    return response
+                error = self._http_error(response.status_code, response.reason, response.headers, response.text)
+                response.close()
+            
+            self.breaker.record(error, probe)
+            # Nothing was generated, so the attempt's reservation must not keep counting against the quota
+            self.rate_limiter.settle(tokens, 0)
+            if not self._should_retry(error, attempt):
+                raise error
+            sleep(backoff_delay(attempt, getattr(error, "retry_after", None)))
+    
+    async def _asend(self, payload: Dict[str, Any], tokens: int) -> "aiohttp.ClientResponse":
+        """Async counterpart of _send(); the caller must release the response."""
+        transport = get_async_transport(self.display_name, self.api_url)
+        kind = "stream" if payload.get("stream") else "call"
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = self.breaker.allow()
+            try:
+                await self.rate_limiter.acquire_async(tokens)
+            except BaseException:
+                self.breaker.release_probe(probe)
+                raise
+            timeout = _async_timeout(self.breaker.timeout(kind))
+            started = time.monotonic()
+            try:
+                response = await transport.post(self.api_url, json=payload, headers=self._headers(), timeout=timeout)
+                if response.status < 400:
+                    self.rate_limiter.on_success()
+                    self.breaker.record_success(time.monotonic() - started, kind)
+                    return response
+                try:
+                    body = await response.text()
+                finally:
+                    response.release()
+            except _async_errors() as exc:
+                error: ProviderError = self._connection_error(exc)
+            except asyncio.CancelledError:
+                self.rate_limiter.settle(tokens, tokens - int(payload.get("max_tokens", 0)))
+                self.breaker.release_probe(probe)
+                raise
+            else:
+                error = self._http_error(response.status, response.reason or "", response.headers, body)
+            
+            self.breaker.record(error, probe)
+            self.rate_limiter.settle(tokens, 0)
+            if not self._should_retry(error, attempt):
+                raise error
+            await asyncio.sleep(backoff_delay(attempt, getattr(error, "retry_after", None)))
+    
+    def call(self, prompt: str) -> str:
+        """Send prompt to the API and return the assistant's reply."""
+        with metrics.track_call(self.display_name, prompt, "call") as record:
+            payload = self._payload(prompt)
+            tokens = self._estimate_tokens(payload)
+            record.sent(payload)
+            try:
+                with origin(prompt):
+                    response = self._send(payload, tokens)
+            except BaseException as exc:
+                if is_cancellation(type(exc)):
+                    self._abandoned(prompt, payload, tokens, "", answered=False)
+                raise
+            record.first_byte()
+            try:
+                data = response.json()
+            except ValueError as exc:
+                raise self._invalid_response(exc)
+            record.received(len(response.content))
+            return self._parse_completion(prompt, data, tokens, record)
+    
+    def _read_events(
+        self, prompt: str, response: requests.Response, tokens: int, record: CallRecorder, received: List[str]
+    ) -> Iterator[str]:
+        """Yield the content deltas of an event-stream response, then settle its reported usage."""
+        if response.encoding is None:
+            response.encoding = "utf-8"
+        usage = None
+        lines = response.iter_lines(decode_unicode=True)
+        for line in lines:
+            check_cancelled()
+            done, content, usage = _parse_sse_line(line, usage)
+            if done:
+                break
+            if content:
+                record.first_byte()
+                record.received(len(content))
+                received.append(content)
+                yield content
+        # Read on to the end of the chunked body so the connection goes back to the pool
+        for _ in lines:
+            pass
+        check_cancelled()  # An aborted read can also look like the end of the stream
+        self._settle_usage(prompt, usage, tokens, record)
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Send prompt with ``stream: true`` and yield content deltas as they arrive."""
+        with metrics.track_call(self.display_name, prompt, "stream") as record:
+            payload = self._stream_payload(prompt)
+            tokens = self._estimate_tokens(payload)
+            record.sent(payload)
+            response: Optional[requests.Response] = None
+            received: List[str] = []
+            try:
+                with origin(prompt):
+                    response = self._send(payload, tokens, stream=True)
+                # A cancel while the stream is read shuts its socket down instead of waiting for the next delta
+                with response, abort_on_cancel(response):
+                    try:
+                        # Some deployments ignore "stream" and answer with a plain JSON body
+                        content_type = response.headers.get("Content-Type", "")
+                        if "text/event-stream" not in content_type:
+                            record.first_byte()
+                            yield self._parse_completion(prompt, response.json(), tokens, record)
+                            return
+                        yield from self._read_events(prompt, response, tokens, record, received)
+                    except requests.RequestException as exc:
+                        check_cancelled()
+                        raise self._broken(exc)
+                    except ValueError as exc:
+                        raise self._invalid_response(exc)
+            except BaseException as exc:
+                if is_cancellation(type(exc)):
+                    self._abandoned(prompt, payload, tokens, "".join(received), answered=response is not None)
+                raise
+    
+    async def acall(self, prompt: str) -> str:
+        """Send prompt on the event loop's non-blocking session and return the reply."""
+        with metrics.track_call(self.display_name, prompt, "acall") as record:
+            payload = self._payload(prompt)
+            tokens = self._estimate_tokens(payload)
+            record.sent(payload)
+            response: Optional["aiohttp.ClientResponse"] = None
+            try:
+                with origin(prompt):
+                    response = await self._asend(payload, tokens)
+                record.first_byte()
+                try:
+                    body = await response.read()
+                    data = json.loads(body)
+                except _async_errors() as exc:
+                    raise self._broken(exc)
+                except ValueError as exc:
+                    raise self._invalid_response(exc)
+                finally:
+                    response.release()
+            except BaseException as exc:
+                if is_cancellation(type(exc)):
+                    self._abandoned(prompt, payload, tokens, "", answered=response is not None)
+                raise
+            record.received(len(body))
+            return self._parse_completion(prompt, data, tokens, record)
+    
+    async def _aread_events(
+        self, prompt: str, response: "aiohttp.ClientResponse", tokens: int, record: CallRecorder, received: List[str]
+    ) -> AsyncIterator[str]:
+        """Async counterpart of _read_events()."""
+        usage = None
+        lines = response.content.__aiter__()
+        async for raw_line in lines:
+            done, content, usage = _parse_sse_line(raw_line.decode("utf-8").rstrip("\r\n"), usage)
+            if done:
+                break
+            if content:
+                record.first_byte()
+                record.received(len(content))
+                received.append(content)
+                yield content
+        # As in stream(): a body read to the end lets the connection be reused
+        async for _ in lines:
+            pass
+        self._settle_usage(prompt, usage, tokens, record)
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        """Async streaming counterpart of stream()."""
+        with metrics.track_call(self.display_name, prompt, "astream") as record:
+            payload = self._stream_payload(prompt)
+            tokens = self._estimate_tokens(payload)
+            record.sent(payload)
+            response: Optional["aiohttp.ClientResponse"] = None
+            received: List[str] = []
+            try:
+                with origin(prompt):
+                    response = await self._asend(payload, tokens)
+                try:
+                    if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                        record.first_byte()
+                        yield self._parse_completion(prompt, await response.json(content_type=None), tokens, record)
+                        return
+                    
+                    deltas = self._aread_events(prompt, response, tokens, record, received)
+                    try:
+                        async for content in deltas:
+                            yield content
+                    finally:
+                        await deltas.aclose()
+                except _async_errors() as exc:
+                    raise self._broken(exc)
+                except ValueError as exc:
+                    raise self._invalid_response(exc)
+                finally:
+                    # Releasing a response that was not read to the end (an error or a cancel) closes its connection
+                    response.release()
+            except BaseException as exc:
+                if is_cancellation(type(exc)):
+                    self._abandoned(prompt, payload, tokens, "".join(received), answered=response is not None)
+                raise
+
+
+def _parse_sse_line(line: str, usage: Optional[Dict[str, Any]] = None) -> Tuple[bool, Optional[str], Optional[Dict[str, Any]]]:
+    """Parse one server-sent event line into (stream finished, content delta, usage so far)."""
+    if not line or not line.startswith("data:"):
+        return False, None, usage
+    
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return True, None, usage
+    
+    event = json.loads(data)
+    # The usage block, when requested, arrives on the last event before [DONE]
+    usage = event.get("usage") or usage
+    choices = event.get("choices") or []
+    if not choices:
+        return False, None, usage
+    
+    return False, (choices[0].get("delta") or {}).get("content"), usage
+
+
+class ASI1MiniProvider(ChatCompletionsProvider):
+    """ASI1 Mini API provider."""
+    
+    display_name = "ASI1 Mini"
+    config_env = ("ASI1_MINI_API_KEY", "ASI1_MINI_API_URL")
+    
+    def __init__(self):
+        self.api_key = os.getenv("ASI1_MINI_API_KEY")
+        if not self.api_key:
+            raise RuntimeError("Please set your ASI1_MINI_API_KEY environment variable")
+        
+        self.api_url = os.getenv(
+            "ASI1_MINI_API_URL",
+            "https://asi1.ai/chat"
+        )
+        self.transport = get_transport(self.display_name, self.api_url)
+        self.rate_limiter = get_rate_limiter(self.display_name, ASI1_REQUESTS_PER_MINUTE, ASI1_TOKENS_PER_MINUTE)
+        self.breaker = get_circuit_breaker(self.display_name)
+    
+    def _payload(self, prompt: str) -> Dict[str, Any]:
+        """Build the ASI1 Mini request body."""
+        return {
+            "model": "asi1-mini",
+            "messages": build_messages(prompt),
+            "max_tokens": completion_budget(prompt)
+        }
+
+
+class OpenAIProvider(ChatCompletionsProvider):
+    """OpenAI ChatGPT-4o API provider."""
+    
+    display_name = "OpenAI"
+    config_env = ("OPENAI_API_KEY", "OPENAI_API_URL")
+    
+    def __init__(self):
+        self.api_key = os.getenv("OPENAI_API_KEY")
+        if not self.api_key:
+            raise RuntimeError("Please set your OPENAI_API_KEY environment variable")
+        
+        self.api_url = os.getenv(
+            "OPENAI_API_URL",
+            "https://api.openai.com/v1/chat/completions"
+        )
+        self.transport = get_transport(self.display_name, self.api_url)
+        self.rate_limiter = get_rate_limiter(self.display_name, OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE)
+        self.breaker = get_circuit_breaker(self.display_name)
+    
+    def _payload(self, prompt: str) -> Dict[str, Any]:
+        """Build the OpenAI ChatGPT-4o request body."""
+        return {
+            "model": "gpt-4o",
+            "messages": build_messages(prompt),
+            # Sized per template: shorter generations finish sooner and use less quota
+            "max_tokens": completion_budget(prompt),
+            "temperature": 0.7
+        }
+    
+    def _stream_payload(self, prompt: str) -> Dict[str, Any]:
+        """Ask for the usage block on the final stream event so tokens are accounted."""
+        payload = super()._stream_payload(prompt)
+        payload["stream_options"] = {"include_usage": True}
+        return payload
@@ -0,0 +1,220 @@
+"""
+Per-provider circuit breakers and adaptive request timeouts.
+
+Each provider gets a breaker that watches a rolling window of request
+outcomes. Once the share of failures (unreachable, timed out or 5xx) crosses
+the threshold the circuit opens and calls fail at once with CircuitOpenError
+instead of waiting out a timeout. After a cool-down one probe request is let
+through (half-open): success closes the circuit, failure opens it again. A
+bad or rate-limited request says nothing about the provider's health, so it
+leaves the state alone, and a probe that ends that way or is cancelled makes
+way for the next one.
+
+Read timeouts follow the provider's observed latency: a high percentile of
+recent successful requests times a safety factor, clamped between a floor and
+HTTP_READ_TIMEOUT, so a degraded provider is given up on long before the fixed
+timeout would fire.
+
+Created by: Saqeb Newaz
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from ai_providers import ProviderError
+from config import (
+    CIRCUIT_BREAKER_ENABLED, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_MIN_REQUESTS, CIRCUIT_WINDOW_SECONDS,
+    CIRCUIT_OPEN_SECONDS, ADAPTIVE_TIMEOUT_ENABLED, ADAPTIVE_TIMEOUT_PERCENTILE, ADAPTIVE_TIMEOUT_MULTIPLIER,
+    ADAPTIVE_TIMEOUT_MIN, HTTP_READ_TIMEOUT,
+)
+from health import ProviderHealth
+from metrics import metrics
+
+logger = logging.getLogger("lean_ai.circuit")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(ProviderError):
+    """The provider's circuit is open; the call was refused without contacting it."""
+    
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(provider, f"{provider} is unavailable (circuit open); retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+def trips_breaker(error: ProviderError) -> bool:
+    """Failures that say the provider is down, as opposed to a bad or rate-limited request."""
+    # Unreachable, timed out, 408 and 5xx are exactly the retryable errors except 429
+    return error.retryable and getattr(error, "status_code", None) != 429
+
+
+class CircuitBreaker:
+    """Closed / open / half-open state for one provider, plus its adaptive read timeout."""
+    
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = CIRCUIT_BREAKER_ENABLED,
+        failure_threshold: float = CIRCUIT_FAILURE_THRESHOLD,
+        min_requests: int = CIRCUIT_MIN_REQUESTS,
+        window_seconds: float = CIRCUIT_WINDOW_SECONDS,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        adaptive_timeout: bool = ADAPTIVE_TIMEOUT_ENABLED,
+        timeout_percentile: float = ADAPTIVE_TIMEOUT_PERCENTILE,
+        timeout_multiplier: float = ADAPTIVE_TIMEOUT_MULTIPLIER,
+        min_timeout: float = ADAPTIVE_TIMEOUT_MIN,
+        max_timeout: float = HTTP_READ_TIMEOUT,
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.failure_threshold = failure_threshold
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.adaptive_timeout = adaptive_timeout
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        
+        self.outcomes = ProviderHealth(window_seconds)
+        # Whole-answer latency and time to the first streamed byte differ by far too much to share a window
+        self.latency = {"call": ProviderHealth(max_samples=500), "stream": ProviderHealth(max_samples=500)}
+        
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+        self._counters = {"opened": 0, "rejected": 0, "probes": 0}
+    
+    def _transition(self, state: str) -> None:
+        """Move to ``state``; the caller holds the lock."""
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self._counters["opened"] += 1
+        if state != HALF_OPEN:
+            self._probe_started = None
+        if state == CLOSED:
+            # Start from a clean window so failures from before the outage cannot re-open it
+            self.outcomes = ProviderHealth(self.outcomes.window_seconds)
+        metrics.circuit_transitions.inc(provider=self.name, state=state)
+        log = logger.warning if state == OPEN else logger.info
+        log("%s circuit %s -> %s", self.name, previous, state)
+    
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets a probe through."""
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+    
+    def allow(self) -> Optional[float]:
+        """Raise CircuitOpenError unless a request may be sent now.
+        
+        Returns an id for the half-open probe if this request is it, else None;
+        pass it back to record() or release_probe().
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self.state == CLOSED:
+                return None
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                # One probe at a time; a probe that never reported back stops counting after a timeout
+                probe_expired = self._probe_started is not None and now - self._probe_started > self.max_timeout
+                if self._probe_started is None or probe_expired:
+                    self._probe_started = now
+                    self._counters["probes"] += 1
+                    return now
+            self._counters["rejected"] += 1
+            retry_after = self.retry_after()
+        metrics.circuit_rejections.inc(provider=self.name)
+        raise CircuitOpenError(self.name, retry_after)
+    
+    def record_success(self, latency: Optional[float] = None, kind: str = "call") -> None:
+        """The provider answered; ``latency`` feeds the adaptive timeout for ``kind`` requests."""
+        if latency is not None:
+            self.latency[kind].record(latency, ok=True)
+        if not self.enabled:
+            return
+        with self._lock:
+            self.outcomes.record(latency or 0.0, ok=True)
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED)
+    
+    def record_failure(self) -> None:
+        """The provider was unreachable, timed out or failed with a server error."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.outcomes.record(0.0, ok=False)
+            if self.state == HALF_OPEN:
+                self._transition(OPEN)
+            elif (
+                self.state == CLOSED
+                and self.outcomes.sample_count() >= self.min_requests
+                and self.outcomes.error_rate() >= self.failure_threshold
+            ):
+                self._transition(OPEN)
+    
+    def release_probe(self, probe: Optional[float]) -> None:
+        """The probe ``probe`` ended without an answer either way (cancelled, say): let the next one through."""
+        if probe is None:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN and self._probe_started == probe:
+                self._probe_started = None
+    
+    def record(self, error: ProviderError, probe: Optional[float] = None) -> None:
+        """Count a failed request against the breaker if it says the provider is down.
+        
+        Any other error (a bad or rate-limited request) leaves the state and the
+        failure window as they are; ``probe`` is released so another can be sent.
+        """
+        if trips_breaker(error):
+            self.record_failure()
+        else:
+            self.release_probe(probe)
+    
+    def timeout(self, kind: str = "call") -> float:
+        """Read timeout for the next ``kind`` request, from recent latency percentiles."""
+        if not self.adaptive_timeout:
+            return self.max_timeout
+        latency = self.latency[kind].percentile(self.timeout_percentile)
+        if latency is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, latency * self.timeout_multiplier))
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counters)
+            stats["state"] = self.state
+            stats["retry_after_s"] = round(self.retry_after(), 1) if self.state == OPEN else 0.0
+        stats["error_rate"] = round(self.outcomes.error_rate(), 3)
+        stats["requests"] = self.outcomes.sample_count()
+        stats["timeout_s"] = {kind: round(self.timeout(kind), 2) for kind in self.latency}
+        return stats
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Return the process-wide breaker for a provider, creating it on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            _breakers[name] = breaker
+        return breaker
+
+
+def circuit_stats() -> Dict[str, Dict[str, Any]]:
+    with _breakers_lock:
+        return {name: breaker.stats() for name, breaker in _breakers.items()}
@@ -0,0 +1,317 @@
+"""
+Single-flight coalescing of identical in-flight provider requests.
+
+When many sessions send the same request at once (a shift changeover, or the
+crisis communication prompt every AI tools view sends), only the first caller
+goes upstream. Everyone else with the same request fingerprint waits for that
+call and shares its answer or its error, from threads and asyncio tasks alike.
+Streams are shared too, among streaming callers only: late joiners replay the
+chunks received so far and then follow along. Shared requests run upstream on
+a worker (a pooled thread, or a task for asyncio callers) rather than on the
+first caller's own thread or task, and are cancelled only once every caller
+waiting for them has gone: a cancelled subscriber, the first one included, just
+stops waiting.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from ai_providers import AIProvider, ProviderConnectionError, ProviderWrapper
+from cancellation import (
+    CancelToken, RequestCancelled, await_cancellable, cancellable, check_cancelled, current_token, on_cancel,
+)
+from config import COALESCE_STREAM_WORKERS
+from metrics import metrics
+
+# Calls and streams of the same request never share a flight: each waits for a different thing
+FlightKey = Tuple[str, str]
+
+
+def _resolve(waiter: "asyncio.Future[None]") -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Flight:
+    """One upstream request in progress and the callers sharing it."""
+    
+    def __init__(self, key: FlightKey):
+        self.key = key
+        self.chunks: List[str] = []
+        # Full response text or the shared error; cancelled if the request was abandoned
+        self.result: Future = Future()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # The upstream request runs under this token, cancelled once nobody waits for it
+        self.token = CancelToken()
+        
+        self._cond = threading.Condition()
+        self._wakers: List[Callable[[], None]] = []
+        self.result.add_done_callback(lambda _: self._notify())
+    
+    def publish(self, chunk: str) -> None:
+        with self._cond:
+            self.chunks.append(chunk)
+        self._notify()
+    
+    def _notify(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+            wakers, self._wakers = self._wakers, []
+        for wake in wakers:
+            wake()
+    
+    def _changed(self, seen: int) -> bool:
+        return len(self.chunks) > seen or self.result.done()
+    
+    def wait(self, seen: int) -> None:
+        """Block until there are more than ``seen`` chunks or the request has finished.
+        
+        Raises RequestCancelled if the waiting caller is cancelled first.
+        """
+        with on_cancel(self._notify), self._cond:
+            while not self._changed(seen):
+                check_cancelled()
+                self._cond.wait()
+    
+    def wait_result(self) -> None:
+        """Block until the request has finished; RequestCancelled if the waiting caller is cancelled first."""
+        while not self.result.done():
+            self.wait(len(self.chunks))
+    
+    async def await_change(self, seen: int) -> None:
+        """Coroutine counterpart of wait(); never blocks the event loop."""
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        
+        def wake() -> None:
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:
+                pass  # The waiting loop has closed
+        
+        with self._cond:
+            if self._changed(seen):
+                return
+            self._wakers.append(wake)
+        await waiter
+    
+    async def await_result(self) -> None:
+        while not self.result.done():
+            await self.await_change(len(self.chunks))
+
+
+class CoalescingProvider(ProviderWrapper):
+    """Provider wrapper that lets identical concurrent requests share one upstream call."""
+    
+    def __init__(self, provider: AIProvider, stream_workers: int = COALESCE_STREAM_WORKERS):
+        super().__init__(provider)
+        self._flights: Dict[FlightKey, Flight] = {}
+        # Shared calls and streams run upstream on these threads, so they outlive any one subscriber
+        self._pumps = ThreadPoolExecutor(max_workers=stream_workers, thread_name_prefix="lean-ai-coalesce")
+        self._lock = threading.Lock()
+        self._counters = {"upstream": 0, "coalesced": 0}
+    
+    def _join(self, prompt: str, method: str) -> Tuple[Flight, bool]:
+        """Subscribe to the in-flight request for ``prompt``; True if the caller must start it."""
+        key = ("stream" if method.endswith("stream") else "call", self.provider.request_fingerprint(prompt))
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or flight.token.cancelled
+            if leader:
+                flight = self._flights[key] = Flight(key)
+                self._counters["upstream"] += 1
+            else:
+                self._counters["coalesced"] += 1
+            flight.subscribers += 1
+        if not leader:
+            metrics.coalesced.inc(provider=self.display_name, method=method)
+        return flight, leader
+    
+    def _leave(self, flight: Flight) -> None:
+        with self._lock:
+            flight.subscribers -= 1
+            orphaned = flight.subscribers == 0
+            abandoned = orphaned and flight.task is not None and not flight.task.done()
+        if orphaned and not flight.result.done():
+            flight.token.cancel()
+        if abandoned:
+            # Nobody is listening any more: stop the upstream stream on its own loop
+            try:
+                flight.task.get_loop().call_soon_threadsafe(flight.task.cancel)
+            except RuntimeError:
+                pass
+    
+    def _retire(self, flight: Flight) -> None:
+        """Stop handing out ``flight`` so new callers start afresh."""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+    
+    def _land(self, flight: Flight, response: Optional[str] = None, error: Optional[BaseException] = None) -> None:
+        """Release every subscriber of ``flight`` with the response or the error."""
+        self._retire(flight)
+        if error is None:
+            flight.result.set_result(response)
+        elif isinstance(error, Exception) and not isinstance(error, RequestCancelled):
+            flight.result.set_exception(error)
+        else:
+            self._abandon(flight)
+    
+    def _abandon(self, flight: Flight) -> None:
+        """Give up on ``flight`` without an answer; subscribers that saw nothing yet try again."""
+        self._retire(flight)
+        flight.result.cancel()
+    
+    def _retry(self, flight: Flight, seen: int) -> bool:
+        """For a stream subscriber after ``flight`` landed: whether to start over."""
+        if flight.result.cancelled():
+            if seen:
+                raise ProviderConnectionError(self.display_name, "The shared request was abandoned mid-stream.")
+            return True
+        flight.result.result()  # Raises the shared error
+        return False
+    
+    def _fly(self, flight: Flight, prompt: str) -> None:
+        """Make the upstream call for ``flight`` and land its answer or error."""
+        if flight.token.cancelled:
+            self._abandon(flight)  # Every subscriber left while it waited for a thread
+            return
+        try:
+            with cancellable(flight.token):
+                response = self.provider.call(prompt)
+        except BaseException as exc:
+            self._land(flight, error=exc)
+            return
+        self._land(flight, response)
+    
+    async def _afly(self, flight: Flight, prompt: str) -> None:
+        try:
+            response = await self.provider.acall(prompt)
+        except BaseException as exc:
+            self._land(flight, error=exc)
+            if not isinstance(exc, Exception):
+                raise
+            return
+        self._land(flight, response)
+    
+    def call(self, prompt: str) -> str:
+        while True:
+            flight, leader = self._join(prompt, "call")
+            try:
+                if leader:
+                    self._pumps.submit(contextvars.copy_context().run, self._fly, flight, prompt)
+                flight.wait_result()
+            finally:
+                self._leave(flight)
+            if not flight.result.cancelled():
+                return flight.result.result()
+    
+    async def acall(self, prompt: str) -> str:
+        while True:
+            flight, leader = self._join(prompt, "acall")
+            try:
+                if leader:
+                    self._start_task(flight, self._afly(flight, prompt))
+                # The event loop cancels the task; a cancel token set by a blocking caller aborts the wait too
+                await await_cancellable(flight.await_result(), current_token())
+            finally:
+                self._leave(flight)
+            if not flight.result.cancelled():
+                return flight.result.result()
+    
+    def _start_task(self, flight: Flight, upstream: Awaitable[None]) -> None:
+        """Run ``upstream`` as the flight's own task, outside any one subscriber's cancel token."""
+        with cancellable(flight.token):
+            flight.task = asyncio.ensure_future(upstream)
+        # A task cancelled before it started never lands the flight itself
+        flight.task.add_done_callback(lambda _: self._abandon(flight))
+    
+    def _pump(self, flight: Flight, prompt: str) -> None:
+        """Read the upstream stream into ``flight`` until it ends or nobody is listening."""
+        if flight.token.cancelled:
+            self._abandon(flight)  # Every subscriber left while it waited for a thread
+            return
+        chunks = self.provider.stream(prompt)
+        try:
+            with cancellable(flight.token):
+                for chunk in chunks:
+                    if flight.subscribers == 0:
+                        chunks.close()
+                        self._abandon(flight)
+                        return
+                    flight.publish(chunk)
+        except BaseException as exc:
+            self._land(flight, error=exc)
+            return
+        self._land(flight, "".join(flight.chunks))
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        while True:
+            flight, leader = self._join(prompt, "stream")
+            seen = 0
+            try:
+                if leader:
+                    self._pumps.submit(contextvars.copy_context().run, self._pump, flight, prompt)
+                while True:
+                    flight.wait(seen)
+                    chunks = flight.chunks[seen:]
+                    if not chunks and flight.result.done():
+                        break
+                    seen += len(chunks)
+                    yield from chunks
+            finally:
+                self._leave(flight)
+            if not self._retry(flight, seen):
+                return
+    
+    async def _apump(self, flight: Flight, prompt: str) -> None:
+        chunks = self.provider.astream(prompt)
+        try:
+            async for chunk in chunks:
+                if flight.subscribers == 0:
+                    await chunks.aclose()
+                    self._abandon(flight)
+                    return
+                flight.publish(chunk)
+        except BaseException as exc:
+            self._land(flight, error=exc)
+            if not isinstance(exc, Exception):
+                raise
+            return
+        self._land(flight, "".join(flight.chunks))
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        while True:
+            flight, leader = self._join(prompt, "astream")
+            seen = 0
+            try:
+                if leader:
+                    self._start_task(flight, self._apump(flight, prompt))
+                token = current_token()
+                while True:
+                    await await_cancellable(flight.await_change(seen), token)
+                    chunks = flight.chunks[seen:]
+                    if not chunks and flight.result.done():
+                        break
+                    seen += len(chunks)
+                    for chunk in chunks:
+                        yield chunk
+            finally:
+                self._leave(flight)
+            if not self._retry(flight, seen):
+                return
+    
+    def coalescing_stats(self) -> Dict[str, Any]:
+        """Upstream requests made, calls that joined one instead, and requests in flight."""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counters)
+            stats["in_flight"] = len(self._flights)
+        total = stats["upstream"] + stats["coalesced"]
+        stats["saved_ratio"] = round(stats["coalesced"] / total, 3) if total else 0.0
+        return stats
@@ -7,6 +7,45 @@ Created by: Saqeb Newaz
 import os
 from typing import Dict, List
 
+_env_loaded = False
+
+
+def _find_env_file() -> str:
+    """The nearest .env at or above this directory, as python-dotenv finds it; "" if there is none."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return ""
+        directory = parent
+
+
+def load_env() -> None:
+    """Load environment variables from the .env file, once per process.
+    
+    ENV_FILE names the file to load ("" for none). python-dotenv is only
+    imported when there is a file to read, so a deployment that sets its
+    environment directly never pays for it at startup.
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    path = os.environ.get("ENV_FILE")
+    if path is None:
+        path = _find_env_file()
+    if path:
+        from dotenv import load_dotenv
+        
+        load_dotenv(path)
+
+
+# Settings below are read from the environment, so load .env first
+load_env()
+
 # Supported frameworks
 FRAMEWORKS: Dict[str, str] = {
     '1': 'Toyota Production System (TPS)',
@@ -27,6 +66,152 @@ INDUSTRY_EXAMPLES: List[str] = [
 # Default AI provider (can be overridden by environment variable)
 DEFAULT_AI_PROVIDER = os.getenv("AI_PROVIDER", "openai")
 
+# HTTP connection pool settings (shared per provider base URL)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_KEEPALIVE = os.getenv("HTTP_KEEPALIVE", "true").lower() in ("1", "true", "yes")
+HTTP_KEEPALIVE_IDLE = int(os.getenv("HTTP_KEEPALIVE_IDLE", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "100"))
+
+# Response cache settings (memory LRU in front of a SQLite store)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(".cache", "responses.sqlite3"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "256"))
+
+# Pre-generated template answers, served before any live call
+WARM_STORE_ENABLED = os.getenv("WARM_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+WARM_STORE_PATH = os.getenv("WARM_STORE_PATH", os.path.join("artifacts", "warm_store.sqlite3"))
+
+# Semantic cache for near-duplicate free-form questions
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", os.path.join(".cache", "semantic_index"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.82"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "500"))
+SEMANTIC_CACHE_DIMENSIONS = int(os.getenv("SEMANTIC_CACHE_DIMENSIONS", "4096"))
+
+# Client-side rate limits per provider (0 = no limit until the first HTTP 429)
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "30000"))
+ASI1_REQUESTS_PER_MINUTE = int(os.getenv("ASI1_REQUESTS_PER_MINUTE", "0"))
+ASI1_TOKENS_PER_MINUTE = int(os.getenv("ASI1_TOKENS_PER_MINUTE", "0"))
+
+# Retry policy for rate-limited, overloaded or unreachable providers
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+
+# Completion budgets (max_tokens) per PromptTemplates method, overridable as
+# COMPLETION_BUDGETS="kpi_metrics=500,implementation_roadmap=1600"
+COMPLETION_BUDGETS: Dict[str, int] = {
+    "framework_comparison": 900,
+    "framework_guide": 1200,
+    "implementation_roadmap": 1800,
+    "kpi_metrics": 600,
+    "ai_tools_recommendation": 1100,
+    "crisis_communication_integration": 800,
+    "build_assistant_prompt": 1200,
+}
+for _entry in filter(None, os.getenv("COMPLETION_BUDGETS", "").split(",")):
+    _template, _, _budget = _entry.partition("=")
+    COMPLETION_BUDGETS[_template.strip()] = int(_budget)
+DEFAULT_COMPLETION_BUDGET = int(os.getenv("DEFAULT_COMPLETION_BUDGET", "2000"))
+
+# Longest accepted user question; longer input is trimmed ("trim") or refused ("reject")
+MAX_USER_INPUT_TOKENS = int(os.getenv("MAX_USER_INPUT_TOKENS", "1000"))
+USER_INPUT_OVERFLOW = os.getenv("USER_INPUT_OVERFLOW", "trim").lower()
+
+# Reported token usage per call, for tuning budgets (python tokens.py report)
+TOKEN_USAGE_LOG = os.getenv("TOKEN_USAGE_LOG", os.path.join(".cache", "token_usage.jsonl"))
+# Size at which the usage log is rotated to <log>.1 (the previous rotation is dropped)
+TOKEN_USAGE_LOG_MAX_BYTES = int(os.getenv("TOKEN_USAGE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Per-provider circuit breaker: fail fast while a provider is down, probe for recovery
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+CIRCUIT_FAILURE_THRESHOLD = float(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "0.5"))
+CIRCUIT_MIN_REQUESTS = int(os.getenv("CIRCUIT_MIN_REQUESTS", "5"))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+# Read timeouts from observed latency (percentile x multiplier, between the minimum and HTTP_READ_TIMEOUT)
+ADAPTIVE_TIMEOUT_ENABLED = os.getenv("ADAPTIVE_TIMEOUT_ENABLED", "true").lower() in ("1", "true", "yes")
+ADAPTIVE_TIMEOUT_PERCENTILE = float(os.getenv("ADAPTIVE_TIMEOUT_PERCENTILE", "99"))
+ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "2.0"))
+ADAPTIVE_TIMEOUT_MIN = float(os.getenv("ADAPTIVE_TIMEOUT_MIN", "10"))
+
+# Provider HTTP transport: "live", "record" (live traffic saved to the cassette) or "replay" (served from it, offline)
+LLM_TRANSPORT = os.getenv("LLM_TRANSPORT", "live").lower()
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", os.path.join(".cache", "cassettes", "traffic.jsonl.gz"))
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1.0"))  # 1 = recorded timing, 10 = ten times faster, 0 = no delays
+# "exact" matches the request body; "loose" matches template and fields, ignoring prompt wording and max_tokens
+LLM_REPLAY_MATCH = os.getenv("LLM_REPLAY_MATCH", "exact").lower()
+
+# Latency-aware routing for the "auto" provider
+ROUTING_PROVIDERS = [name.strip() for name in os.getenv("ROUTING_PROVIDERS", "openai,asi1").split(",") if name.strip()]
+ROUTING_HEDGE_ENABLED = os.getenv("ROUTING_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+ROUTING_HEDGE_PERCENTILE = float(os.getenv("ROUTING_HEDGE_PERCENTILE", "95"))
+ROUTING_HEDGE_MIN_DELAY = float(os.getenv("ROUTING_HEDGE_MIN_DELAY", "2.0"))
+ROUTING_HEDGE_BUDGET = float(os.getenv("ROUTING_HEDGE_BUDGET", "0.1"))
+# Threads for duplicate requests only; the first request of every call runs on the caller's thread
+ROUTING_HEDGE_WORKERS = int(os.getenv("ROUTING_HEDGE_WORKERS", "16"))
+ROUTING_WINDOW_SECONDS = float(os.getenv("ROUTING_WINDOW_SECONDS", "300"))
+ROUTING_ERROR_PENALTY = float(os.getenv("ROUTING_ERROR_PENALTY", "10"))
+
+# Background job queue for the web app
+JOBS_PATH = os.getenv("JOBS_PATH", os.path.join(".cache", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "200"))  # 0 = unbounded
+JOB_MAX_PER_SESSION = int(os.getenv("JOB_MAX_PER_SESSION", "3"))
+JOB_FLUSH_INTERVAL = float(os.getenv("JOB_FLUSH_INTERVAL", "0.5"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+# Running jobs are marked alive this often, so they never look stale; keep it well under JOB_STALE_SECONDS
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "30"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+# Cancel jobs no page has polled for this many seconds (the tab was closed); 0 = never
+JOB_ABANDON_AFTER = float(os.getenv("JOB_ABANDON_AFTER", "120"))
+
+# Answer history with full-text search (python history.py search ...)
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() in ("1", "true", "yes")
+HISTORY_PATH = os.getenv("HISTORY_PATH", os.path.join(".cache", "history.sqlite3"))
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "365"))  # 0 = keep forever
+HISTORY_MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", "50000"))  # 0 = unbounded
+
+# HTTP API server (python api_server.py)
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "256"))
+API_MAX_BODY_BYTES = int(os.getenv("API_MAX_BODY_BYTES", str(64 * 1024)))
+
+# Priority scheduling of provider calls (interactive > normal > bulk, fair per tenant)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "64"))  # Per provider
+SCHEDULER_BULK_SHARE = float(os.getenv("SCHEDULER_BULK_SHARE", "0.5"))  # Of the slots bulk work may fill
+# Longest wait for a slot before a request is shed (0 = wait as long as it takes)
+SCHEDULER_MAX_WAIT: Dict[str, float] = {
+    "interactive": float(os.getenv("SCHEDULER_MAX_WAIT_INTERACTIVE", "20")),
+    "normal": float(os.getenv("SCHEDULER_MAX_WAIT_NORMAL", "60")),
+    "bulk": float(os.getenv("SCHEDULER_MAX_WAIT_BULK", "0")),
+}
+
+# Identical concurrent requests share one upstream call
+REQUEST_COALESCING_ENABLED = os.getenv("REQUEST_COALESCING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Threads running shared calls and streams upstream; beyond the scheduler's limit they would only queue there
+COALESCE_STREAM_WORKERS = int(os.getenv("COALESCE_STREAM_WORKERS", str(SCHEDULER_MAX_CONCURRENCY)))
+
+# Metrics for provider calls and caches (no overhead when disabled)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_EXPORT_PATH = os.getenv("METRICS_EXPORT_PATH", "")
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "60"))
+
+# Maximum concurrent provider calls for multi-section menu views
+ASSISTANT_MAX_WORKERS = int(os.getenv("ASSISTANT_MAX_WORKERS", "4"))
+
+# CLI follow-ups generated while the guide is read: "implementation" (menu option 1 only), "all" or "off"
+PREFETCH_POLICY = os.getenv("PREFETCH_POLICY", "implementation").lower()
+
 # Application settings
 APP_NAME = "Next-Gen Lean AI Assistant"
 VERSION = "2.0.0"
@@ -0,0 +1,72 @@
+"""
+Rolling latency and error samples for one provider.
+
+Routing ranks providers by these samples, and each circuit breaker keeps its
+failure window and the latency behind its adaptive timeouts in them.
+
+Created by: Saqeb Newaz
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import ROUTING_WINDOW_SECONDS, ROUTING_ERROR_PENALTY
+
+
+class ProviderHealth:
+    """Rolling latency and error samples for one provider."""
+    
+    min_samples = 5
+    
+    def __init__(self, window_seconds: float = ROUTING_WINDOW_SECONDS, max_samples: int = 200):
+        self.window_seconds = window_seconds
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+    
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, ok))
+    
+    def _recent(self) -> List[Tuple[float, float, bool]]:
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return list(self._samples)
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency percentile of successful calls, or None without enough data."""
+        latencies = sorted(latency for _, latency, ok in self._recent() if ok)
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q / 100.0))]
+    
+    def sample_count(self) -> int:
+        return len(self._recent())
+    
+    def error_rate(self) -> float:
+        samples = self._recent()
+        return sum(not ok for _, _, ok in samples) / len(samples) if samples else 0.0
+    
+    def score(self, error_penalty: float = ROUTING_ERROR_PENALTY) -> float:
+        """Expected cost in seconds: median latency plus a penalty per failure.
+        
+        Providers without enough recent samples score 0 so they get tried
+        again, which lets a recovered provider win traffic back.
+        """
+        median = self.percentile(50)
+        if median is None:
+            return 0.0
+        return median + self.error_rate() * error_penalty
+    
+    def stats(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "samples": self.sample_count(),
+            "p50_s": round(p50, 3) if p50 is not None else None,
+            "p95_s": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate(), 3),
+            "score": round(self.score(), 3),
+        }
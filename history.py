@@ -0,0 +1,389 @@
+"""
+Persistent answer history with full-text search.
+
+Every fresh answer from run_assistant and the LeanAIAssistant menu flows is
+appended to a SQLite table together with its prompt, framework, industry,
+provider and latency. An FTS5 index over the question, answer and context
+makes finding last week's guidance a millisecond keyword search instead of
+another LLM call. Old answers are removed by age and count, and compaction
+drops duplicate answers and rebuilds the index.
+
+Usage:
+    python history.py search "kanban changeover" --framework "Toyota Production System (TPS)"
+    python history.py show <id>
+    python history.py recent --limit 20
+    python history.py export history.jsonl
+    python history.py compact
+    python history.py stats
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from ai_providers import AIProvider, ProviderWrapper
+from config import HISTORY_PATH, HISTORY_RETENTION_DAYS, HISTORY_MAX_ENTRIES
+
+# Retention is enforced every this many recorded answers, not on every insert
+RETENTION_CHECK_EVERY = 100
+
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query matching every word (prefix match on the last)."""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+class HistoryStore:
+    """Append-only SQLite table of answers with an FTS5 keyword index."""
+    
+    def __init__(
+        self,
+        path: str = HISTORY_PATH,
+        retention_days: float = HISTORY_RETENTION_DAYS,
+        max_entries: int = HISTORY_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._since_retention = 0
+        
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " created_at REAL NOT NULL,"
+            " template TEXT NOT NULL,"
+            " provider TEXT NOT NULL,"
+            " framework TEXT NOT NULL DEFAULT '',"
+            " industry TEXT NOT NULL DEFAULT '',"
+            " question TEXT NOT NULL DEFAULT '',"
+            " prompt TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " latency_s REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_created ON answers (created_at)")
+        # External-content index: the text lives once, in answers; triggers keep the index in step
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS answers_fts USING fts5("
+            " question, response, framework, industry, template,"
+            " content='answers', content_rowid='id', tokenize='porter unicode61')"
+        )
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS answers_ai AFTER INSERT ON answers BEGIN"
+            " INSERT INTO answers_fts (rowid, question, response, framework, industry, template)"
+            " VALUES (new.id, new.question, new.response, new.framework, new.industry, new.template);"
+            " END"
+        )
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS answers_ad AFTER DELETE ON answers BEGIN"
+            " INSERT INTO answers_fts (answers_fts, rowid, question, response, framework, industry, template)"
+            " VALUES ('delete', old.id, old.question, old.response, old.framework, old.industry, old.template);"
+            " END"
+        )
+        self._db.commit()
+    
+    def record(
+        self,
+        prompt: str,
+        response: str,
+        provider: str,
+        latency_s: float,
+        template: str = "custom",
+        framework: str = "",
+        industry: str = "",
+        question: str = "",
+    ) -> int:
+        """Append one answer and return its id."""
+        with self._lock:
+            entry_id = self._db.execute(
+                "INSERT INTO answers"
+                " (created_at, template, provider, framework, industry, question, prompt, response, latency_s)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), template, provider, framework, industry, question, prompt, response, latency_s),
+            ).lastrowid
+            self._db.commit()
+            self._since_retention += 1
+            due = self._since_retention >= RETENTION_CHECK_EVERY
+        if due:
+            self.enforce_retention()
+        return entry_id
+    
+    def search(
+        self,
+        text: str,
+        limit: int = 20,
+        framework: Optional[str] = None,
+        industry: Optional[str] = None,
+        provider: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Best keyword matches first, each with a highlighted snippet of the answer."""
+        query = fts_query(text)
+        if not query:
+            return []
+        sql = (
+            "SELECT a.id, a.created_at, a.template, a.provider, a.framework, a.industry, a.question,"
+            " a.latency_s, snippet(answers_fts, 1, '**', '**', ' … ', 24) AS snippet"
+            " FROM answers_fts JOIN answers a ON a.id = answers_fts.rowid"
+            " WHERE answers_fts MATCH ?"
+        )
+        params: List[Any] = [query]
+        for column, value in (("framework", framework), ("industry", industry), ("provider", provider)):
+            if value:
+                sql += f" AND a.{column} = ?"
+                params.append(value)
+        sql += " ORDER BY bm25(answers_fts, 4.0, 1.0, 2.0, 2.0, 1.0) LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+    
+    def get(self, entry_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM answers WHERE id = ?", (entry_id,)).fetchone()
+        return dict(row) if row is not None else None
+    
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most recent answers first, without the full prompt and response."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, created_at, template, provider, framework, industry, question, latency_s"
+                " FROM answers ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def iter_all(self, since: float = 0.0) -> Iterator[Dict[str, Any]]:
+        """Every answer created at or after ``since``, oldest first."""
+        last_id = 0
+        while True:
+            # Read in pages so a long export never holds the lock for long
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT * FROM answers WHERE id > ? AND created_at >= ? ORDER BY id LIMIT 500",
+                    (last_id, since),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last_id = rows[-1]["id"]
+    
+    def export(self, path: str, since: float = 0.0) -> int:
+        """Write answers as JSON lines (``-`` for stdout) and return how many were written."""
+        count = 0
+        out = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+        try:
+            for entry in self.iter_all(since):
+                out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return count
+    
+    def enforce_retention(self) -> int:
+        """Delete answers older than the retention period or beyond the entry limit."""
+        with self._lock:
+            removed = 0
+            if self.retention_days > 0:
+                cutoff = time.time() - self.retention_days * 24 * 3600
+                removed += self._db.execute("DELETE FROM answers WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_entries > 0:
+                removed += self._db.execute(
+                    "DELETE FROM answers WHERE id IN ("
+                    " SELECT id FROM answers ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+            self._db.commit()
+            self._since_retention = 0
+            return removed
+    
+    def compact(self) -> Dict[str, int]:
+        """Apply retention, keep only the newest of identical answers, and rebuild the files."""
+        removed = self.enforce_retention()
+        with self._lock:
+            duplicates = self._db.execute(
+                "DELETE FROM answers WHERE id NOT IN ("
+                " SELECT MAX(id) FROM answers GROUP BY provider, prompt, response)"
+            ).rowcount
+            self._db.execute("INSERT INTO answers_fts (answers_fts) VALUES ('optimize')")
+            self._db.commit()
+            self._db.execute("VACUUM")
+        return {"expired": removed, "duplicates": duplicates}
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*) AS entries, MIN(created_at) AS oldest, MAX(created_at) AS newest,"
+                " AVG(latency_s) AS mean_latency_s, SUM(LENGTH(response)) AS response_chars FROM answers"
+            ).fetchone()
+        stats = dict(row)
+        if self.path != ":memory:" and os.path.exists(self.path):
+            stats["file_bytes"] = os.path.getsize(self.path)
+        return stats
+    
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class HistoryProvider(ProviderWrapper):
+    """Provider wrapper that records every completed answer in a HistoryStore."""
+    
+    def __init__(self, provider: AIProvider, store: Optional[HistoryStore] = None):
+        super().__init__(provider)
+        self.store = store or get_history_store()
+    
+    def _record(self, prompt: str, response: str, started: float) -> None:
+        if not response:
+            return
+        fields = getattr(prompt, "fields", {})
+        try:
+            self.store.record(
+                str(prompt),
+                response,
+                self.display_name,
+                time.monotonic() - started,
+                template=getattr(prompt, "template", "custom"),
+                framework=fields.get("framework", ""),
+                industry=fields.get("industry", ""),
+                question=fields.get("user_input", ""),
+            )
+        except sqlite3.Error:
+            pass  # History is best effort; never lose the answer over it
+    
+    def call(self, prompt: str) -> str:
+        started = time.monotonic()
+        response = self.provider.call(prompt)
+        self._record(prompt, response, started)
+        return response
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        started = time.monotonic()
+        chunks = []
+        for chunk in self.provider.stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        # Only reached when the stream completed without raising
+        self._record(prompt, "".join(chunks), started)
+    
+    async def acall(self, prompt: str) -> str:
+        import asyncio  # Only async callers pay for the event loop machinery
+        
+        started = time.monotonic()
+        response = await self.provider.acall(prompt)
+        # The SQLite write and FTS update block, so they run on a worker thread rather than the event loop
+        await asyncio.to_thread(self._record, prompt, response, started)
+        return response
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        import asyncio
+        
+        started = time.monotonic()
+        chunks = []
+        async for chunk in self.provider.astream(prompt):
+            chunks.append(chunk)
+            yield chunk
+        await asyncio.to_thread(self._record, prompt, "".join(chunks), started)
+
+
+_default_store: Optional[HistoryStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """Return the process-wide history store, creating it on first use."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = HistoryStore()
+        return _default_store
+
+
+def _timestamp(created_at: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(created_at))
+
+
+def _title(entry: Dict[str, Any]) -> str:
+    """One-line description of an answer: the question, or the template and its context."""
+    if entry["question"]:
+        return entry["question"]
+    context = ", ".join(filter(None, (entry["framework"], entry["industry"])))
+    return f"{entry['template']} ({context})" if context else entry["template"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search and maintain the answer history.")
+    parser.add_argument("--path", default=HISTORY_PATH, help="History database path")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    search_parser = subparsers.add_parser("search", help="Keyword search over questions and answers")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=10)
+    search_parser.add_argument("--framework")
+    search_parser.add_argument("--industry")
+    search_parser.add_argument("--provider")
+    show_parser = subparsers.add_parser("show", help="Print one answer in full")
+    show_parser.add_argument("id", type=int)
+    recent_parser = subparsers.add_parser("recent", help="Most recent answers")
+    recent_parser.add_argument("--limit", type=int, default=20)
+    export_parser = subparsers.add_parser("export", help="Write every answer as JSON lines")
+    export_parser.add_argument("output", help="Output file, or - for stdout")
+    export_parser.add_argument("--days", type=float, default=0, help="Only the last N days (0 = everything)")
+    subparsers.add_parser("compact", help="Apply retention, drop duplicates and rebuild the index")
+    subparsers.add_parser("stats", help="Entry count, age range and file size")
+    args = parser.parse_args()
+    
+    store = HistoryStore(args.path)
+    if args.command == "search":
+        started = time.perf_counter()
+        results = store.search(args.query, args.limit, args.framework, args.industry, args.provider)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for entry in results:
+            print(f"#{entry['id']}  {_timestamp(entry['created_at'])}  {entry['provider']:6}  {_title(entry)[:70]}")
+            print(f"    {entry['snippet']}")
+        print(f"{len(results)} matches in {elapsed_ms:.1f} ms")
+    elif args.command == "show":
+        entry = store.get(args.id)
+        if entry is None:
+            print(f"No answer #{args.id}")
+            sys.exit(1)
+        print(f"#{entry['id']}  {_timestamp(entry['created_at'])}  {entry['provider']}  {entry['latency_s']:.1f}s")
+        print(_title(entry))
+        print("=" * 60)
+        print(entry["response"])
+    elif args.command == "recent":
+        for entry in store.recent(args.limit):
+            print(f"#{entry['id']}  {_timestamp(entry['created_at'])}  {entry['provider']:6}  {_title(entry)[:70]}")
+    elif args.command == "export":
+        since = time.time() - args.days * 24 * 3600 if args.days > 0 else 0.0
+        count = store.export(args.output, since)
+        print(f"Exported {count} answers", file=sys.stderr)
+    elif args.command == "compact":
+        removed = store.compact()
+        print(f"Removed {removed['expired']} expired and {removed['duplicates']} duplicate answers")
+    else:
+        for name, value in store.stats().items():
+            print(f"{name:16} {value}")
+
+
+if __name__ == "__main__":
+    main()
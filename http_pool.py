@@ -0,0 +1,289 @@
+"""
+Shared HTTP connection pools for AI provider calls.
+
+One keep-alive session is kept per provider base URL so repeated prompts reuse
+the same TCP/TLS connection instead of paying a new handshake every time.
+Requests made while a cancel token is current (see cancellation.py) shut
+their socket down when it fires, so a blocked read ends at once.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import contextlib
+import socket
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from cancellation import on_cancel
+from config import (
+    HTTP_POOL_SIZE,
+    HTTP_KEEPALIVE,
+    HTTP_KEEPALIVE_IDLE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    ASYNC_HTTP_MAX_CONNECTIONS,
+)
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+def _keepalive_socket_options(idle: int) -> list:
+    """Build TCP keep-alive socket options supported by this platform."""
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+    elif hasattr(socket, "TCP_KEEPALIVE"):  # macOS
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle))
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 3)))
+    return options
+
+
+def abort_connection(conn: Any) -> None:
+    """Shut down the socket of an urllib3 connection so a read blocked on it returns at once."""
+    sock = getattr(conn, "sock", None)
+    if sock is None:
+        return
+    try:
+        # socket.socket's own shutdown: SSLSocket's would also drop TLS state the reading thread still uses
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    except (OSError, TypeError):
+        pass  # Already closed, or not a plain socket (TLS through a proxy)
+
+
+def abort_on_cancel(response: requests.Response) -> ContextManager[None]:
+    """While inside, cancelling the current token aborts the connection ``response`` streams from."""
+    conn = getattr(response.raw, "connection", None)
+    if conn is None:
+        return contextlib.nullcontext()  # Body already read, or not from a socket (replayed)
+    return on_cancel(lambda: abort_connection(conn))
+
+
+class _CountedConnection:
+    """Connection mixin reporting every socket it opens, reconnects of a pooled connection included."""
+    
+    on_connect: Optional[Callable[[], None]] = None
+    
+    def connect(self) -> None:
+        super().connect()
+        if self.on_connect is not None:
+            self.on_connect()
+
+
+class CountedHTTPConnection(_CountedConnection, HTTPConnection):
+    pass
+
+
+class CountedHTTPSConnection(_CountedConnection, HTTPSConnection):
+    pass
+
+
+class _CancellableRequests:
+    """Connection pool mixin: a cancel while waiting for the response headers aborts the request.
+    
+    It also counts the sockets its connections open, which is what keep-alive
+    is meant to save; urllib3's own num_connections misses reconnects.
+    """
+    
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.sockets_opened = 0
+        self._sockets_lock = threading.Lock()
+    
+    def _count_socket(self) -> None:
+        with self._sockets_lock:
+            self.sockets_opened += 1
+    
+    def _new_conn(self) -> Any:
+        conn = super()._new_conn()
+        conn.on_connect = self._count_socket
+        return conn
+    
+    def _make_request(self, conn: Any, *args: Any, **kwargs: Any) -> Any:
+        with on_cancel(lambda: abort_connection(conn)):
+            return super()._make_request(conn, *args, **kwargs)
+
+
+class CancellableHTTPConnectionPool(_CancellableRequests, HTTPConnectionPool):
+    ConnectionCls = CountedHTTPConnection
+
+
+class CancellableHTTPSConnectionPool(_CancellableRequests, HTTPSConnectionPool):
+    ConnectionCls = CountedHTTPSConnection
+
+
+class PoolAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools can be aborted through a cancel token and count their sockets."""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CancellableHTTPConnectionPool,
+            "https": CancellableHTTPSConnectionPool,
+        }
+
+
+class KeepAliveAdapter(PoolAdapter):
+    """PoolAdapter that enables TCP keep-alive on pooled connections."""
+    
+    def __init__(self, keepalive_idle: int, **kwargs):
+        self.keepalive_idle = keepalive_idle
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = (
+            HTTPConnection.default_socket_options
+            + _keepalive_socket_options(self.keepalive_idle)
+        )
+        super().init_poolmanager(*args, **kwargs)
+
+
+class ConnectionPool:
+    """Thread-safe keep-alive session bound to a single provider base URL."""
+    
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = HTTP_POOL_SIZE,
+        keepalive: bool = HTTP_KEEPALIVE,
+        keepalive_idle: int = HTTP_KEEPALIVE_IDLE,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+    ):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        
+        if keepalive:
+            self.adapter = KeepAliveAdapter(
+                keepalive_idle,
+                pool_connections=1,
+                pool_maxsize=pool_size,
+                pool_block=True,
+            )
+        else:
+            self.adapter = PoolAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        
+        self.session = requests.Session()
+        self.session.mount(base_url, self.adapter)
+        if not keepalive:
+            self.session.headers["Connection"] = "close"
+    
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """POST through the pooled session, applying the pool timeouts by default."""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+    
+    def stats(self) -> Dict[str, int]:
+        """Return connection reuse statistics for this pool."""
+        opened = 0
+        requests_sent = 0
+        idle = 0
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            opened += getattr(pool, "sockets_opened", pool.num_connections)
+            requests_sent += pool.num_requests
+            if pool.pool is not None:
+                # The queue is pre-filled with None placeholders for connections not yet made
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None and conn.sock is not None)
+        return {
+            "requests": requests_sent,
+            "connections_opened": opened,
+            "connections_reused": max(0, requests_sent - opened),
+            "idle_connections": idle,
+            "pool_size": self.pool_size,
+        }
+    
+    def close(self) -> None:
+        """Close the session and all pooled connections."""
+        self.session.close()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def base_url_of(url: str) -> str:
+    """Reduce a full endpoint URL to its scheme://host[:port]/ base."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+def get_pool(url: str) -> ConnectionPool:
+    """Return the process-wide connection pool for the base URL of ``url``."""
+    base_url = base_url_of(url)
+    pool = _pools.get(base_url)
+    if pool is not None:
+        return pool
+    
+    with _pools_lock:
+        pool = _pools.get(base_url)
+        if pool is None:
+            pool = ConnectionPool(base_url)
+            _pools[base_url] = pool
+        return pool
+
+
+def pool_stats(url: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    """Return statistics for every pool, or only the pool serving ``url``."""
+    with _pools_lock:
+        pools = dict(_pools)
+    if url is not None:
+        base_url = base_url_of(url)
+        pools = {base_url: pools[base_url]} if base_url in pools else {}
+    return {base_url: pool.stats() for base_url, pool in pools.items()}
+
+
+def close_pools() -> None:
+    """Close and forget every pool (e.g. after changing pool settings)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+# aiohttp sessions are bound to the event loop that created them, so async
+# pools are kept per loop and per base URL.
+_async_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, aiohttp.ClientSession]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_async_session(url: str) -> "aiohttp.ClientSession":
+    """Return the running loop's non-blocking session for the base URL of ``url``."""
+    import aiohttp  # Heavy; sync-only processes such as the CLI never load it
+    
+    loop = asyncio.get_running_loop()
+    base_url = base_url_of(url)
+    sessions = _async_sessions.setdefault(loop, {})
+    session = sessions.get(base_url)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=ASYNC_HTTP_MAX_CONNECTIONS,
+            limit_per_host=ASYNC_HTTP_MAX_CONNECTIONS,
+            keepalive_timeout=HTTP_KEEPALIVE_IDLE if HTTP_KEEPALIVE else None,
+            force_close=not HTTP_KEEPALIVE,
+        )
+        timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        sessions[base_url] = session
+    return session
+
+
+async def close_async_sessions() -> None:
+    """Close the running loop's async sessions; call before the loop shuts down."""
+    sessions = _async_sessions.pop(asyncio.get_running_loop(), {})
+    for session in sessions.values():
+        await session.close()
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+Cold-start import budget for the command-line entry points.
+
+Imports each entry module in a fresh interpreter with ``-X importtime`` and
+fails if the import takes longer than its budget, or if it pulls in a module
+that should only load on demand (the HTTP clients, NumPy, tiktoken, the
+provider implementations). Run in CI so cold start stays fast as providers
+and features are added.
+
+Usage:
+    python import_budget.py
+    python import_budget.py --runs 9 --scale 2.0
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Loaded by the registry or by the feature that needs them, never at import time
+ON_DEMAND = ("chat_providers", "requests", "aiohttp", "asyncio", "numpy", "tiktoken", "semantic_cache", "dotenv")
+
+# Entry module -> (import budget in milliseconds, modules it must not import)
+BUDGETS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    "main": (120.0, ON_DEMAND),
+    "jobs": (60.0, ON_DEMAND + ("main",)),
+    "tokens": (60.0, ON_DEMAND),
+}
+
+
+def measure(module: str) -> Tuple[float, List[str]]:
+    """Import ``module`` in a fresh interpreter: (cumulative ms, every module imported)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        # As deployed with the environment set directly, whether or not this checkout has a .env
+        env=dict(os.environ, ENV_FILE=""),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    
+    cumulative = 0.0
+    imported = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        imported.append(name.strip())
+        # Nested imports are indented; the entry module is the unindented line
+        if name.rstrip() == f" {module}":
+            cumulative = int(total) / 1000.0
+    return cumulative, imported
+
+
+def check(runs: int, scale: float) -> bool:
+    ok = True
+    for module, (budget_ms, forbidden) in BUDGETS.items():
+        samples = []
+        imported: List[str] = []
+        for _ in range(runs):
+            elapsed, imported = measure(module)
+            samples.append(elapsed)
+        median = statistics.median(samples)
+        limit = budget_ms * scale
+        eager = sorted(name for name in forbidden if name in imported)
+        passed = median <= limit and not eager
+        ok = ok and passed
+        
+        status = "ok" if passed else "FAIL"
+        print(f"{module:12} {median:7.1f} ms (budget {limit:.0f} ms)  {status}")
+        if eager:
+            print(f"{'':12} imports on-demand modules at startup: {', '.join(eager)}")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check cold-start import time of the entry points.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module (median is used)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget, e.g. for slow CI runners")
+    args = parser.parse_args()
+    sys.exit(0 if check(args.runs, args.scale) else 1)
+
+
+if __name__ == "__main__":
+    main()
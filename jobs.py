@@ -0,0 +1,395 @@
+"""
+Persistent background job queue for assistant questions.
+
+Submitting a question stores a job in SQLite and returns its id at once. A
+pool of worker threads runs queued jobs through stream_assistant and saves the
+answer as it streams in, so the web app only polls by job id: answers survive
+reruns, page refreshes and reconnects, a session can queue several questions,
+and no Streamlit script thread waits on a provider. Jobs left running by a
+stopped process are picked up again once they go stale; a heartbeat keeps
+the jobs a live process is running fresh, even before their first chunk. Each
+session is its own scheduler tenant, so one busy tab cannot starve another.
+Cancelling a job aborts its provider request at once, and a job no page has
+shown for JOB_ABANDON_AFTER seconds is cancelled as abandoned.
+
+Usage:
+    python jobs.py list
+    python jobs.py show <job id>
+    python jobs.py purge
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+from cancellation import CancelToken, RequestCancelled
+from config import (
+    JOBS_PATH, JOB_WORKERS, JOB_MAX_PENDING, JOB_FLUSH_INTERVAL, JOB_STALE_SECONDS, JOB_RETENTION, JOB_ABANDON_AFTER,
+    JOB_HEARTBEAT_INTERVAL,
+)
+
+PENDING = ("queued", "running")
+# Tenant of jobs submitted without a session
+DEFAULT_SESSION = "web"
+
+
+class QueueFullError(RuntimeError):
+    """Too many jobs are waiting; the caller should try again later."""
+
+
+class JobStore:
+    """SQLite table of jobs with their status and (partial) answer."""
+    
+    def __init__(self, path: str = JOBS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " provider TEXT NOT NULL,"
+            " session TEXT NOT NULL DEFAULT 'web',"
+            " framework TEXT NOT NULL,"
+            " industry TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " output TEXT NOT NULL DEFAULT '',"
+            " error TEXT,"
+            " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " updated_at REAL NOT NULL,"
+            " finished_at REAL)"
+        )
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "session" not in columns:
+            # Job databases written before jobs had a session
+            self._db.execute(f"ALTER TABLE jobs ADD COLUMN session TEXT NOT NULL DEFAULT '{DEFAULT_SESSION}'")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.commit()
+    
+    def submit(
+        self,
+        framework: str,
+        industry: str,
+        provider: str,
+        question: str,
+        session: str = DEFAULT_SESSION,
+        max_pending: int = JOB_MAX_PENDING,
+    ) -> str:
+        """Queue a question for ``session`` and return its job id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            pending = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", PENDING
+            ).fetchone()[0]
+            if max_pending > 0 and pending >= max_pending:
+                raise QueueFullError(f"{pending} questions are already waiting. Please try again in a minute.")
+            self._db.execute(
+                "INSERT INTO jobs (id, status, provider, session, framework, industry, question, created_at, updated_at)"
+                " VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, provider, session, framework, industry, question, now, now),
+            )
+            self._db.commit()
+        return job_id
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+    
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs first."""
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+    
+    def position(self, job_id: str) -> int:
+        """Number of queued jobs ahead of ``job_id``."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+                " AND created_at < (SELECT created_at FROM jobs WHERE id = ?)",
+                (job_id,),
+            ).fetchone()[0]
+    
+    def claim(self, stale_seconds: float = JOB_STALE_SECONDS) -> Optional[Dict[str, Any]]:
+        """Mark the oldest queued job as running and return it, or None if the queue is empty."""
+        now = time.time()
+        with self._lock:
+            # Jobs whose worker stopped reporting (a killed process) go back in the queue
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', output = '', updated_at = ?"
+                " WHERE status = 'running' AND updated_at < ?",
+                (now, now - stale_seconds),
+            )
+            while True:
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    self._db.commit()
+                    return None
+                # Guarded by status so a worker in another process cannot claim it twice
+                claimed = self._db.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, updated_at = ?"
+                    " WHERE id = ? AND status = 'queued'",
+                    (now, now, row["id"]),
+                ).rowcount
+                self._db.commit()
+                if claimed:
+                    return dict(self._db.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+    
+    def touch(self, job_ids: Iterable[str]) -> None:
+        """Mark running jobs as alive so claim() does not hand them out again."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE status = 'running' AND id IN ({', '.join('?' * len(job_ids))})",
+                (time.time(), *job_ids),
+            )
+            self._db.commit()
+    
+    def update_output(self, job_id: str, output: str) -> bool:
+        """Save the answer so far; returns False if the job should stop."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET output = ?, updated_at = ? WHERE id = ?", (output, time.time(), job_id)
+            )
+            self._db.commit()
+            row = self._db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and not row["cancel_requested"]
+    
+    def finish(self, job_id: str, output: str, status: str = "done", error: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, output = ?, error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                (status, output, error, now, now, job_id),
+            )
+            self._db.commit()
+    
+    def cancel(self, job_id: str) -> None:
+        """Cancel a queued job now, or ask the worker running it to stop."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ?, finished_at = ? WHERE id = ? AND status = 'queued'",
+                (now, now, job_id),
+            )
+            self._db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+            self._db.commit()
+    
+    def purge(self, retention: float = JOB_RETENTION) -> int:
+        """Delete finished jobs older than ``retention`` seconds and return how many were removed."""
+        with self._lock:
+            removed = self._db.execute(
+                "DELETE FROM jobs WHERE status NOT IN (?, ?) AND finished_at < ?", (*PENDING, time.time() - retention)
+            ).rowcount
+            self._db.commit()
+        return removed
+    
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class JobQueue:
+    """Worker threads that run queued jobs through the assistant."""
+    
+    def __init__(
+        self,
+        store: Optional[JobStore] = None,
+        workers: int = JOB_WORKERS,
+        flush_interval: float = JOB_FLUSH_INTERVAL,
+        abandon_after: float = JOB_ABANDON_AFTER,
+        heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL,
+    ):
+        self.store = store or JobStore()
+        self.workers = workers
+        self.flush_interval = flush_interval
+        self.abandon_after = abandon_after
+        self.heartbeat_interval = heartbeat_interval
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._reaper: Optional[threading.Thread] = None
+        self._heartbeat: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Job id -> cancel token, for the jobs this process is running
+        self._running: Dict[str, CancelToken] = {}
+        # Job id -> when a page last showed it
+        self._watched: Dict[str, float] = {}
+    
+    def start(self) -> "JobQueue":
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work, name=f"lean-ai-job-{len(self._threads)}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="lean-ai-job-reaper", daemon=True)
+                self._reaper.start()
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name="lean-ai-job-heartbeat", daemon=True)
+                self._heartbeat.start()
+        return self
+    
+    def submit(self, framework: str, industry: str, provider: str, question: str, session: str = DEFAULT_SESSION) -> str:
+        """Queue a question for ``session`` and return its job id immediately."""
+        job_id = self.store.submit(framework, industry, provider, question, session=session)
+        self._wakeup.set()
+        return job_id
+    
+    def cancel(self, job_id: str, reason: str = "Cancelled by the user") -> None:
+        """Cancel a job: a queued one never runs, a running one stops its provider request at once."""
+        self.store.cancel(job_id)
+        with self._lock:
+            token = self._running.get(job_id)
+        if token is not None:
+            token.cancel(reason)
+    
+    def watch(self, job_ids: Iterable[str]) -> None:
+        """Note that a page is showing these jobs; call on every poll."""
+        if self.abandon_after <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for job_id in job_ids:
+                self._watched[job_id] = now
+    
+    def _reap(self) -> None:
+        """Cancel jobs whose page went away, and running jobs cancelled from another process."""
+        while True:
+            time.sleep(1.0)
+            cutoff = time.monotonic() - self.abandon_after
+            with self._lock:
+                abandoned = [job_id for job_id, seen in self._watched.items() if seen < cutoff]
+                for job_id in abandoned:
+                    del self._watched[job_id]
+                running = dict(self._running)
+            for job_id in abandoned:
+                # A no-op for jobs that already finished
+                self.cancel(job_id, reason="Nobody is watching this job any more")
+            for job_id, token in running.items():
+                job = self.store.get(job_id)
+                if job is not None and job["cancel_requested"]:
+                    token.cancel("Cancelled by the user")
+    
+    def _beat(self) -> None:
+        """Keep the running jobs fresh while they wait for a slot or their first chunk."""
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                running = list(self._running)
+            self.store.touch(running)
+    
+    def _work(self) -> None:
+        while True:
+            job = self.store.claim()
+            if job is None:
+                # Also polls, so jobs submitted by other processes get picked up
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            self.run(job)
+    
+    def run(self, job: Dict[str, Any]) -> None:
+        """Run one claimed job, saving the answer every ``flush_interval`` seconds."""
+        # main imports the provider stack; workers only need it once a job arrives
+        from main import stream_assistant
+        from scheduler import scheduling
+        
+        token = CancelToken()
+        with self._lock:
+            self._running[job["id"]] = token
+        output = ""
+        last_flush = time.monotonic()
+        chunks = stream_assistant(job["framework"], job["industry"], job["provider"], job["question"], cancel=token)
+        try:
+            # Someone is watching the page: interactive, and each session takes its turn with the others
+            with scheduling("interactive", tenant=job["session"]):
+                for chunk in chunks:
+                    output += chunk
+                    if time.monotonic() - last_flush >= self.flush_interval:
+                        last_flush = time.monotonic()
+                        if not self.store.update_output(job["id"], output):
+                            chunks.close()
+                            self.store.finish(job["id"], output, status="cancelled")
+                            return
+        except RequestCancelled:
+            self.store.finish(job["id"], output, status="cancelled")
+            return
+        except Exception as exc:
+            # Keep whatever arrived before the error
+            self.store.finish(job["id"], output, status="failed", error=str(exc))
+            return
+        finally:
+            with self._lock:
+                del self._running[job["id"]]
+        self.store.finish(job["id"], output)
+
+
+_default_queue: Optional[JobQueue] = None
+_default_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue with its workers running."""
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = JobQueue()
+            _default_queue.store.purge()
+        return _default_queue.start()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect the background job queue.")
+    parser.add_argument("--path", default=JOBS_PATH, help="Job database path")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    list_parser = subparsers.add_parser("list", help="Most recent jobs")
+    list_parser.add_argument("--limit", type=int, default=20)
+    show_parser = subparsers.add_parser("show", help="Status and answer of one job")
+    show_parser.add_argument("job_id")
+    subparsers.add_parser("purge", help="Delete finished jobs past JOB_RETENTION")
+    args = parser.parse_args()
+    
+    store = JobStore(args.path)
+    if args.command == "list":
+        for job in store.list(args.limit):
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job["created_at"]))
+            print(f"{job['id']}  {created}  {job['status']:9}  {job['provider']:6}  {job['question'][:60]}")
+    elif args.command == "show":
+        job = store.get(args.job_id)
+        if job is None:
+            print(f"No job {args.job_id}")
+            sys.exit(1)
+        print(f"Status: {job['status']}")
+        print(f"Question: {job['question']} ({job['framework']}, {job['industry']})")
+        if job["error"]:
+            print(f"Error: {job['error']}")
+        print(job["output"])
+    else:
+        print(f"Removed {store.purge()} finished jobs")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,92 +5,347 @@ A comprehensive tool for Lean manufacturing framework guidance and implementatio
 Created by: Saqeb Newaz
 """
 
-from ai_providers import get_ai_provider
-from config import FRAMEWORKS, INDUSTRY_EXAMPLES, DEFAULT_AI_PROVIDER, APP_NAME, VERSION
-from prompts import PromptTemplates
-from typing import Optional
+from ai_providers import AIProvider, PROVIDER_CLASSES, get_shared_provider
+from cache import CachedProvider
+from cancellation import CancelToken, aiter_cancellable, await_cancellable, cancellable, iter_cancellable
+from warm_store import WarmStoreProvider
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
+from config import (
+    FRAMEWORKS, INDUSTRY_EXAMPLES, DEFAULT_AI_PROVIDER, APP_NAME, VERSION,
+    RESPONSE_CACHE_ENABLED, WARM_STORE_ENABLED, SEMANTIC_CACHE_ENABLED, HISTORY_ENABLED, ASSISTANT_MAX_WORKERS,
+    PREFETCH_POLICY,
+)
+from metrics import metrics
+from prompts import PromptTemplates, prompt_context, template
+from scheduler import scheduling
+from tokens import fit_user_input
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+# Follow-up menu option -> the prompts it shows; all are fixed once framework and industry are known
+FOLLOW_UPS: Dict[str, Callable[[str, str], List[str]]] = {
+    "implementation": lambda framework, industry: [
+        PromptTemplates.implementation_roadmap(framework, industry),
+        PromptTemplates.kpi_metrics(framework, industry),
+    ],
+    "ai_tools": lambda framework, industry: [
+        PromptTemplates.ai_tools_recommendation(framework, industry),
+        PromptTemplates.crisis_communication_integration(),
+    ],
+}
 
-def run_assistant(framework: str, industry: str, provider: str, user_input: str) -> str:
+# PREFETCH_POLICY -> follow-up options generated in the background while the guide is read
+PREFETCH_POLICIES: Dict[str, Tuple[str, ...]] = {
+    "off": (),
+    "implementation": ("implementation",),
+    "all": ("implementation", "ai_tools"),
+}
+
+
+@template
+def build_assistant_prompt(framework: str, industry: str, user_input: str) -> str:
+    """Build the prompt used by the web interface for a free-form question."""
+    # Map framework name to choice number
+    framework_mapping = {
+        "Toyota Production System (TPS)": "1",
+        "Ford Production System (FPS)": "2", 
+        "Stellantis Production Way (SPW)": "3",
+        "Lean Six Sigma (LSS)": "4"
+    }
+    
+    framework_choice = framework_mapping.get(framework, "1")
+    
+    # Generate appropriate prompt based on framework choice; fixed instructions
+    # come first and the question last so requests share a cacheable prefix
+    if framework_choice in FRAMEWORKS:
+        framework_name = FRAMEWORKS[framework_choice]
+        # Create a custom prompt that incorporates the user's question
+        return (
+            "As an expert Lean manufacturing consultant specializing in the framework and industry below, "
+            "please provide detailed guidance on the question below.\n"
+            "Please structure your response to include:\n"
+            "1. Direct answer to the question\n"
+            "2. Principles of the framework that apply\n"
+            "3. Industry-specific implementation considerations\n"
+            "4. Practical next steps\n"
+            "Keep the response comprehensive but actionable."
+            + prompt_context(framework=framework_name, industry=industry, question=user_input)
+        )
+    
+    # Fallback prompt
+    return (
+        "As a Lean manufacturing expert, please help with the question below for the industry below.\n"
+        "Provide practical, actionable advice based on Lean principles."
+        + prompt_context(industry=industry, question=user_input)
+    )
+
+
+def _similar_answer(ai: AIProvider, framework: str, industry: str, user_input: str) -> Optional[str]:
+    """Return a stored answer to a near-identical earlier question, if any."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    # NumPy loads with the cache on the first free-form question, not at startup
+    from semantic_cache import SemanticCache, get_semantic_cache
+    
+    hit = get_semantic_cache().lookup(SemanticCache.scope(ai.display_name, framework, industry), user_input)
+    return hit[0] if hit else None
+
+
+def _remember_answer(ai: AIProvider, framework: str, industry: str, user_input: str, response: str) -> None:
+    if SEMANTIC_CACHE_ENABLED:
+        from semantic_cache import SemanticCache, get_semantic_cache
+        
+        get_semantic_cache().add(SemanticCache.scope(ai.display_name, framework, industry), user_input, response)
+
+
+def _recorded(ai: AIProvider) -> AIProvider:
+    """Wrap ``ai`` so fresh answers are kept in the searchable history."""
+    if not HISTORY_ENABLED:
+        return ai
+    from history import HistoryProvider
+    
+    return HistoryProvider(ai)
+
+
+def run_assistant(
+    framework: str, industry: str, provider: Union[str, AIProvider], user_input: str, cancel: Optional[CancelToken] = None
+) -> str:
     """
     Callable function for web interface integration.
     
     Args:
         framework: Selected Lean framework name
         industry: Selected industry
-        provider: AI provider ('openai' or 'asi1')
+        provider: AI provider ('openai' or 'asi1') or a shared provider instance
         user_input: User's question or input
+        cancel: Token that aborts the provider call when cancelled from another thread
     
     Returns:
         AI response as string
     """
     try:
-        # Initialize AI provider
-        ai = get_ai_provider(provider)
-        
-        # Map framework name to choice number
-        framework_mapping = {
-            "Toyota Production System (TPS)": "1",
-            "Ford Production System (FPS)": "2", 
-            "Stellantis Production Way (SPW)": "3",
-            "Lean Six Sigma (LSS)": "4"
-        }
-        
-        framework_choice = framework_mapping.get(framework, "1")
-        
-        # Generate appropriate prompt based on framework choice
-        if framework_choice in FRAMEWORKS:
-            framework_name = FRAMEWORKS[framework_choice]
-            # Create a custom prompt that incorporates the user's question
-            prompt = f"""
-            As an expert Lean manufacturing consultant specializing in {framework_name} for the {industry} industry, 
-            please provide detailed guidance on the following question:
+        with metrics.track_assistant("run_assistant"):
+            # Trim (or refuse) an oversized question before any work is done
+            user_input = fit_user_input(user_input)
             
-            {user_input}
+            # Reuse the process-wide provider instance
+            ai = get_shared_provider(provider)
             
-            Please structure your response to include:
-            1. Direct answer to the question
-            2. {framework_name} principles that apply
-            3. Industry-specific implementation considerations for {industry}
-            4. Practical next steps
+            # Near-duplicate questions skip the LLM entirely
+            cached = _similar_answer(ai, framework, industry, user_input)
+            if cached is not None:
+                return cached
             
-            Keep the response comprehensive but actionable.
-            """
-        else:
-            # Fallback prompt
-            prompt = f"""
-            As a Lean manufacturing expert, please help with this question for the {industry} industry:
+            prompt = build_assistant_prompt(framework, industry, user_input)
             
-            {user_input}
+            # Get AI response
+            with cancellable(cancel):
+                response = _recorded(ai).call(prompt)
+            _remember_answer(ai, framework, industry, user_input, response)
+            return response
+    
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+async def arun_assistant(
+    framework: str, industry: str, provider: Union[str, AIProvider], user_input: str, cancel: Optional[CancelToken] = None
+) -> str:
+    """
+    Async variant of run_assistant for event-loop based callers.
+    
+    Many of these can be in flight on one loop; they share the loop's
+    non-blocking connection pool instead of holding a thread each.
+    
+    Args:
+        framework: Selected Lean framework name
+        industry: Selected industry
+        provider: AI provider ('openai' or 'asi1') or a shared provider instance
+        user_input: User's question or input
+        cancel: Token that cancels the provider call, from any thread
+    
+    Returns:
+        AI response as string
+    """
+    import asyncio  # Only async callers pay for the event loop machinery
+    
+    try:
+        with metrics.track_assistant("arun_assistant"):
+            user_input = fit_user_input(user_input)
+            ai = get_shared_provider(provider)
+            # The similarity search and the index save block, so they run on a worker thread
+            cached = await asyncio.to_thread(_similar_answer, ai, framework, industry, user_input)
+            if cached is not None:
+                return cached
             
-            Provide practical, actionable advice based on Lean principles.
-            """
-        
-        # Get AI response
-        response = ai.call(prompt)
-        return response
-        
+            prompt = build_assistant_prompt(framework, industry, user_input)
+            response = await await_cancellable(_recorded(ai).acall(prompt), cancel)
+            await asyncio.to_thread(_remember_answer, ai, framework, industry, user_input, response)
+            return response
+    
     except Exception as e:
         return f"Error: {str(e)}"
 
 
+def stream_assistant(
+    framework: str, industry: str, provider: Union[str, AIProvider], user_input: str, cancel: Optional[CancelToken] = None
+) -> Iterator[str]:
+    """
+    Streaming variant of run_assistant for incremental rendering.
+    
+    Args:
+        framework: Selected Lean framework name
+        industry: Selected industry
+        provider: AI provider ('openai' or 'asi1') or a shared provider instance
+        user_input: User's question or input
+        cancel: Token that closes the upstream stream when cancelled from another thread
+    
+    Yields:
+        Response content deltas as they arrive
+    
+    Raises:
+        InputTooLongError: if user_input is over the token limit and trimming is disabled
+        ProviderError: if the provider fails, possibly after some deltas were yielded
+        RequestCancelled: if ``cancel`` was cancelled before the answer was complete
+    """
+    with metrics.track_assistant("stream_assistant"):
+        user_input = fit_user_input(user_input)
+        ai = get_shared_provider(provider)
+        cached = _similar_answer(ai, framework, industry, user_input)
+        if cached is not None:
+            yield cached
+            return
+        
+        prompt = build_assistant_prompt(framework, industry, user_input)
+        chunks = []
+        for chunk in iter_cancellable(_recorded(ai).stream(prompt), cancel):
+            chunks.append(chunk)
+            yield chunk
+        _remember_answer(ai, framework, industry, user_input, "".join(chunks))
+
+
+async def astream_assistant(
+    framework: str, industry: str, provider: Union[str, AIProvider], user_input: str, cancel: Optional[CancelToken] = None
+) -> AsyncIterator[str]:
+    """
+    Async variant of stream_assistant for event-loop based callers.
+    
+    Yields:
+        Response content deltas as they arrive
+    
+    Raises:
+        InputTooLongError: if user_input is over the token limit and trimming is disabled
+        ProviderError: if the provider fails, possibly after some deltas were yielded
+        RequestCancelled: if ``cancel`` was cancelled before the answer was complete
+    """
+    import asyncio
+    
+    with metrics.track_assistant("astream_assistant"):
+        user_input = fit_user_input(user_input)
+        ai = get_shared_provider(provider)
+        cached = await asyncio.to_thread(_similar_answer, ai, framework, industry, user_input)
+        if cached is not None:
+            yield cached
+            return
+        
+        prompt = build_assistant_prompt(framework, industry, user_input)
+        chunks = []
+        async for chunk in aiter_cancellable(_recorded(ai).astream(prompt), cancel):
+            chunks.append(chunk)
+            yield chunk
+        await asyncio.to_thread(_remember_answer, ai, framework, industry, user_input, "".join(chunks))
+
+
 class LeanAIAssistant:
     """Main application class for the Lean AI Assistant."""
     
     def __init__(self, ai_provider: str = DEFAULT_AI_PROVIDER):
         """Initialize the assistant with specified AI provider."""
+        # A mistyped setting fails here, before any provider is built
+        if PREFETCH_POLICY not in PREFETCH_POLICIES:
+            raise ValueError(f"Unknown PREFETCH_POLICY '{PREFETCH_POLICY}'. Available: {', '.join(PREFETCH_POLICIES)}")
+        
         try:
-            self.ai = get_ai_provider(ai_provider)
+            self.ai = get_shared_provider(ai_provider)
             self.provider_name = ai_provider
         except Exception as e:
             print(f"⚠️ Error initializing AI provider '{ai_provider}': {e}")
             print("Falling back to ASI1 Mini provider...")
             try:
-                self.ai = get_ai_provider("asi1")
+                self.ai = get_shared_provider("asi1")
                 self.provider_name = "asi1"
             except Exception as fallback_error:
                 print(f"❌ Fallback failed: {fallback_error}")
                 raise RuntimeError("No AI provider available. Please check your API keys.")
+        
+        # Innermost, so only answers actually generated are added to the history
+        self.ai = _recorded(self.ai)
+        
+        # Template prompts depend only on framework and industry, so repeat them from cache
+        if RESPONSE_CACHE_ENABLED:
+            self.ai = CachedProvider(self.ai)
+        
+        # Pre-generated answers (python warm_store.py generate) are served before the cache
+        if WARM_STORE_ENABLED:
+            self.ai = WarmStoreProvider(self.ai)
+        
+        # Bounded pool for independent follow-up calls that can run side by side
+        self.executor = ThreadPoolExecutor(max_workers=ASSISTANT_MAX_WORKERS, thread_name_prefix="lean-ai")
+        
+        # Follow-up prompt -> its answer, requested before the user picked it
+        self.prefetched: Dict[str, Future] = {}
+        self.prefetch_options = PREFETCH_POLICIES[PREFETCH_POLICY]
+        
+        # Cancelled on Ctrl-C so requests in flight stop instead of finishing unread
+        self.cancel_token = CancelToken()
+        self.prefetch_token = self.cancel_token.child()
+    
+    def _call(self, prompt: str, token: CancelToken) -> str:
+        with cancellable(token):
+            return self.ai.call(prompt)
+    
+    def submit(self, prompt: str, token: CancelToken) -> Future:
+        """Call the provider on the pool, in the caller's context and cancellable through ``token``."""
+        return self.executor.submit(contextvars.copy_context().run, self._call, prompt, token)
+    
+    def dispatch(self, prompts: List[str]) -> List[Future]:
+        """Send independent prompts concurrently; futures keep the input order."""
+        futures = []
+        for prompt in prompts:
+            future = self.prefetched.pop(prompt, None)
+            if future is None or future.cancelled() or (future.done() and future.exception() is not None):
+                # Not prefetched, or the prefetch failed: ask again now
+                future = self.submit(prompt, self.cancel_token)
+            else:
+                metrics.prefetches.inc(result="used")
+            futures.append(future)
+        return futures
+    
+    def prefetch_follow_ups(self, framework: str, industry: str) -> None:
+        """Start the follow-up sections in the background while the user reads the guide."""
+        self.cancel_prefetch()
+        self.prefetch_token = self.cancel_token.child()
+        # Speculative work yields to requests someone is actually waiting for
+        with scheduling("normal"):
+            for option in self.prefetch_options:
+                for prompt in FOLLOW_UPS[option](framework, industry):
+                    if prompt not in self.prefetched:
+                        self.prefetched[prompt] = self.submit(prompt, self.prefetch_token)
+    
+    def cancel_prefetch(self) -> None:
+        """Drop prefetched follow-ups: those not yet started are never sent, those in flight are aborted."""
+        for future in self.prefetched.values():
+            metrics.prefetches.inc(result="cancelled" if future.cancel() or not future.done() else "unused")
+        self.prefetch_token.cancel("Follow-up no longer needed")
+        self.prefetched.clear()
+    
+    @staticmethod
+    def section_result(future: Future) -> str:
+        """Wait for one section, reporting a failure without losing the other sections."""
+        try:
+            return future.result()
+        except Exception as e:
+            return f"❌ Could not generate this section: {e}"
     
     def display_welcome(self) -> None:
         """Display welcome message and app info."""
@@ -132,13 +387,23 @@ class LeanAIAssistant:
         else:
             raise ValueError("Invalid framework selection")
     
-    def display_response(self, response: str, industry: str) -> None:
-        """Display AI response with formatting."""
+    def display_response(self, response: Union[str, Iterable[str]], industry: str) -> str:
+        """Display AI response with formatting, printing streamed chunks as they arrive."""
         print("\n" + "=" * 60)
         header = f"💡 YOUR {industry.upper()} LEAN ROADMAP"
         print(header)
         print("=" * 60)
-        print(response)
+        
+        if isinstance(response, str):
+            print(response)
+            return response
+        
+        chunks = []
+        for chunk in response:
+            chunks.append(chunk)
+            print(chunk, end="", flush=True)
+        print()
+        return "".join(chunks)
     
     def handle_follow_up(self, framework: Optional[str], industry: str) -> bool:
         """Handle follow-up interactions. Returns True to continue, False to restart."""
@@ -167,22 +432,17 @@ class LeanAIAssistant:
         """Display implementation roadmap and KPIs."""
         print("\n🚀 Generating custom implementation plan...")
         
-        # Get implementation roadmap
-        roadmap_prompt = PromptTemplates.implementation_roadmap(framework, industry)
-        roadmap = self.ai.call(roadmap_prompt)
+        # Request the roadmap and KPIs together; they do not depend on each other
+        roadmap, kpis = self.dispatch(FOLLOW_UPS["implementation"](framework, industry))
         
         print("\n" + "=" * 60)
         print("📝 CUSTOM IMPLEMENTATION ROADMAP")
         print("=" * 60)
-        print(roadmap)
-        
-        # Get KPIs
-        kpi_prompt = PromptTemplates.kpi_metrics(framework, industry)
-        kpis = self.ai.call(kpi_prompt)
+        print(self.section_result(roadmap))
         
         print("\n🎯 KEY PERFORMANCE INDICATORS")
         print("=" * 40)
-        print(kpis)
+        print(self.section_result(kpis))
         
         input("\nPress Enter to continue...")
     
@@ -190,22 +450,17 @@ class LeanAIAssistant:
         """Display AI tools recommendations and crisis communication integration."""
         print("\n🤖 Curating AI solutions...")
         
-        # Get AI tools recommendations
-        tools_prompt = PromptTemplates.ai_tools_recommendation(framework, industry)
-        tools = self.ai.call(tools_prompt)
+        # Request tool recommendations and crisis communication integration together
+        tools, crisis_info = self.dispatch(FOLLOW_UPS["ai_tools"](framework, industry))
         
         print("\n" + "=" * 60)
         print("🛠️ AI TOOLKIT FOR LEAN IMPLEMENTATION")
         print("=" * 60)
-        print(tools)
-        
-        # Get crisis communication integration
-        crisis_prompt = PromptTemplates.crisis_communication_integration()
-        crisis_info = self.ai.call(crisis_prompt)
+        print(self.section_result(tools))
         
         print("\n🚨 CRISIS COMMUNICATION INTEGRATION")
         print("=" * 45)
-        print(crisis_info)
+        print(self.section_result(crisis_info))
         
         input("\nPress Enter to continue...")
     
@@ -225,12 +480,13 @@ class LeanAIAssistant:
                 
                 print("\n🤖 Analyzing your selection...")
                 
-                # Process selection and get AI response
+                # Process selection and stream the AI response as it arrives
                 selected_framework, prompt = self.process_framework_selection(framework_choice, industry)
-                response = self.ai.call(prompt)
+                self.display_response(self.ai.stream(prompt), industry)
                 
-                # Display response
-                self.display_response(response, industry)
+                # The follow-up answers depend only on this selection, so start them while the guide is read
+                if selected_framework:
+                    self.prefetch_follow_ups(selected_framework, industry)
                 
                 # Handle follow-up interactions
                 while True:
@@ -239,8 +495,10 @@ class LeanAIAssistant:
                     
                     # Continue follow-up loop
                     continue
-                
+            
             except KeyboardInterrupt:
+                # Follow-ups still being generated on the pool would otherwise run to completion unread
+                self.cancel_token.cancel("Interrupted")
                 print("\n\n👋 Thank you for using the Lean AI Assistant by Saqeb Newaz!")
                 break
             except ValueError as e:
@@ -250,6 +508,9 @@ class LeanAIAssistant:
                 print(f"\n❌ An error occurred: {e}")
                 print("Please try again or contact support.")
                 continue
+            finally:
+                # Restarting or leaving: follow-ups prefetched for this selection are no longer needed
+                self.cancel_prefetch()
 
 
 def main():
@@ -260,6 +521,11 @@ def main():
     provider = DEFAULT_AI_PROVIDER
     if len(sys.argv) > 1:
         provider = sys.argv[1]
+    if provider in ("-h", "--help"):
+        # Answered before any provider is built, so it never loads the HTTP stack
+        print(f"Usage: python main.py [{'|'.join(PROVIDER_CLASSES)}]")
+        print(f"Starts the {APP_NAME} CLI with the given AI provider (default: {DEFAULT_AI_PROVIDER}).")
+        return
     
     try:
         assistant = LeanAIAssistant(provider)
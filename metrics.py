@@ -0,0 +1,339 @@
+"""
+In-process metrics for provider calls, caches and assistant entry points.
+
+Counters and histograms are labelled by provider, PromptTemplates method and
+call method, and can be exported as Prometheus text or appended as JSON lines.
+With METRICS_ENABLED off every recording call returns immediately.
+
+Usage:
+    from metrics import metrics
+    print(metrics.prometheus())
+    metrics.write_jsonl("metrics.jsonl")
+
+Created by: Saqeb Newaz
+"""
+
+import atexit
+import json
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from cancellation import is_cancellation
+from config import METRICS_ENABLED, METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (50, 100, 200, 400, 600, 800, 1200, 1600, 2000, 4000)
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    escaped = ((name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels)
+    pairs = [f'{name}="{value}"' for name, value in escaped]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labelled series."""
+    
+    kind = "counter"
+    
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.series: Dict[Labels, float] = {}
+    
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if not self.registry.enabled:
+            return
+        key = _labels(labels)
+        with self.registry.lock:
+            self.series[key] = self.series.get(key, 0.0) + amount
+    
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        return [(self.name, labels, value) for labels, value in self.series.items()]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labelled series."""
+    
+    kind = "histogram"
+    
+    def __init__(self, registry: "MetricsRegistry", name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.series: Dict[Labels, List[float]] = {}
+    
+    def observe(self, value: float, **labels: Any) -> None:
+        if not self.registry.enabled:
+            return
+        key = _labels(labels)
+        with self.registry.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+    
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        samples = []
+        for labels, series in self.series.items():
+            for bound, count in zip(self.buckets, series):
+                samples.append((f"{self.name}_bucket", labels + (("le", repr(bound)),), count))
+            samples.append((f"{self.name}_bucket", labels + (("le", "+Inf"),), series[-2]))
+            samples.append((f"{self.name}_sum", labels, series[-1]))
+            samples.append((f"{self.name}_count", labels, series[-2]))
+        return samples
+    
+    def summary(self, labels: Labels) -> Dict[str, float]:
+        series = self.series[labels]
+        count = series[-2]
+        return {"count": count, "sum": round(series[-1], 6), "mean": round(series[-1] / count, 6) if count else 0.0}
+
+
+class CallRecorder:
+    """Collects the measurements of one provider call and records them on exit."""
+    
+    def __init__(self, registry: "MetricsRegistry", provider: str, template: str, method: str):
+        self.registry = registry
+        self.labels = {"provider": provider, "template": template, "method": method}
+        self.started = time.perf_counter()
+        self.first_byte_at: Optional[float] = None
+        self.response_bytes = 0
+    
+    def __enter__(self) -> "CallRecorder":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            outcome = "ok"
+        elif is_cancellation(exc_type):
+            outcome = "cancelled"  # Cancelled, or the consumer stopped reading a stream
+        else:
+            outcome = "error"
+            self.registry.errors.inc(error=exc_type.__name__, **self.labels)
+        self.registry.requests.inc(outcome=outcome, **self.labels)
+        self.registry.request_duration.observe(time.perf_counter() - self.started, **self.labels)
+        if self.response_bytes:
+            self.registry.response_bytes.inc(self.response_bytes, provider=self.labels["provider"])
+    
+    def sent(self, payload: Dict[str, Any]) -> None:
+        size = len(json.dumps(payload).encode("utf-8"))
+        self.registry.request_bytes.inc(size, provider=self.labels["provider"])
+    
+    def first_byte(self) -> None:
+        """Mark the response headers (or first stream delta) as received."""
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+            self.registry.time_to_first_byte.observe(self.first_byte_at - self.started, **self.labels)
+    
+    def received(self, size: int) -> None:
+        self.response_bytes += size
+    
+    def usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        """Record the token counts from a chat-completions ``usage`` block."""
+        if not usage:
+            return
+        labels = {"provider": self.labels["provider"], "template": self.labels["template"]}
+        self.registry.prompt_tokens.inc(usage.get("prompt_tokens") or 0, **labels)
+        self.registry.completion_tokens.inc(usage.get("completion_tokens") or 0, **labels)
+        self.registry.completion_length.observe(usage.get("completion_tokens") or 0, **labels)
+
+
+class EntryRecorder:
+    """Times one assistant entry point call (run_assistant and friends)."""
+    
+    def __init__(self, registry: "MetricsRegistry", entry: str):
+        self.registry = registry
+        self.entry = entry
+        self.started = time.perf_counter()
+    
+    def __enter__(self) -> "EntryRecorder":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        outcome = "ok" if exc_type is None else "cancelled" if is_cancellation(exc_type) else "error"
+        self.registry.assistant_requests.inc(entry=self.entry, outcome=outcome)
+        self.registry.assistant_duration.observe(time.perf_counter() - self.started, entry=self.entry)
+
+
+class _NullRecorder:
+    """Stand-in used while metrics are disabled; every method is a no-op."""
+    
+    def __enter__(self) -> "_NullRecorder":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+    
+    def sent(self, payload: Dict[str, Any]) -> None:
+        pass
+    
+    def first_byte(self) -> None:
+        pass
+    
+    def received(self, size: int) -> None:
+        pass
+    
+    def usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        pass
+
+
+_NULL_RECORDER = _NullRecorder()
+
+
+class MetricsRegistry:
+    """All metrics of the process, with Prometheus and JSON-lines export."""
+    
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self._metrics: List[Any] = []
+        
+        self.requests = self.counter("llm_requests_total", "Provider calls by outcome (ok, error, cancelled)")
+        self.errors = self.counter("llm_errors_total", "Failed provider calls by exception type")
+        self.retries = self.counter("llm_retries_total", "Provider requests retried after a transient failure")
+        self.request_duration = self.histogram("llm_request_duration_seconds", "Provider call latency")
+        self.time_to_first_byte = self.histogram(
+            "llm_time_to_first_byte_seconds", "Time until response headers or the first stream delta"
+        )
+        self.request_bytes = self.counter("llm_request_bytes_total", "JSON request body bytes sent")
+        self.response_bytes = self.counter("llm_response_bytes_total", "Response body or content bytes received")
+        self.prompt_tokens = self.counter("llm_prompt_tokens_total", "Prompt tokens reported by the provider")
+        self.completion_tokens = self.counter("llm_completion_tokens_total", "Completion tokens reported by the provider")
+        self.completion_length = self.histogram(
+            "llm_completion_length_tokens", "Completion tokens per call, for sizing template budgets", TOKEN_BUCKETS
+        )
+        self.routed = self.counter("llm_routed_requests_total", "Auto-routed requests by chosen provider")
+        self.hedges = self.counter("llm_hedged_requests_total", "Hedged requests by provider that answered first")
+        self.coalesced = self.counter(
+            "llm_coalesced_requests_total", "Calls answered by an identical request already in flight"
+        )
+        self.circuit_transitions = self.counter(
+            "llm_circuit_transitions_total", "Circuit breaker state changes by provider and new state"
+        )
+        self.circuit_rejections = self.counter(
+            "llm_circuit_rejections_total", "Calls refused without contacting the provider (circuit open)"
+        )
+        self.scheduler_wait = self.histogram(
+            "llm_scheduler_wait_seconds", "Time queued for a provider slot, by provider and priority"
+        )
+        self.scheduler_shed = self.counter(
+            "llm_scheduler_shed_total", "Requests dropped after waiting too long for a provider slot"
+        )
+        self.cancellations = self.counter(
+            "llm_cancelled_total",
+            "Provider calls cancelled before the answer was complete, by stage (queued, waiting, streaming)",
+        )
+        self.cancelled_tokens_saved = self.counter(
+            "llm_cancelled_tokens_saved_total", "Estimated completion tokens not generated because the call was cancelled"
+        )
+        self.cache_lookups = self.counter("cache_lookups_total", "Cache lookups by cache and result (hit, miss)")
+        self.api_requests = self.counter("api_requests_total", "HTTP API requests by route and status code")
+        self.assistant_requests = self.counter("assistant_requests_total", "Assistant entry point calls by outcome")
+        self.assistant_duration = self.histogram("assistant_duration_seconds", "Assistant entry point latency")
+        self.prefetches = self.counter(
+            "assistant_prefetch_total", "Speculative CLI follow-up requests by outcome (used, unused, cancelled)"
+        )
+    
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(self, name, help_text)
+        self._metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(self, name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+    
+    def track_call(self, provider: str, prompt: str, method: str):
+        """Recorder for one provider call; a shared no-op object while disabled."""
+        if not self.enabled:
+            return _NULL_RECORDER
+        return CallRecorder(self, provider, getattr(prompt, "template", "custom"), method)
+    
+    def track_assistant(self, entry: str):
+        """Recorder for one assistant entry point call; a no-op object while disabled."""
+        if not self.enabled:
+            return _NULL_RECORDER
+        return EntryRecorder(self, entry)
+    
+    def cache_lookup(self, cache: str, hit: bool) -> None:
+        self.cache_lookups.inc(cache=cache, result="hit" if hit else "miss")
+    
+    def cache_hit_ratios(self) -> Dict[str, float]:
+        totals: Dict[str, List[float]] = {}
+        with self.lock:
+            for labels, value in self.cache_lookups.series.items():
+                label_map = dict(labels)
+                bucket = totals.setdefault(label_map["cache"], [0.0, 0.0])
+                bucket[0 if label_map["result"] == "hit" else 1] += value
+        return {cache: round(hits / (hits + misses), 4) for cache, (hits, misses) in totals.items() if hits + misses}
+    
+    def prometheus(self) -> str:
+        """Render every series in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for metric in self._metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        lines.append("# HELP cache_hit_ratio Share of cache lookups that were hits")
+        lines.append("# TYPE cache_hit_ratio gauge")
+        for cache, ratio in self.cache_hit_ratios().items():
+            lines.append(f'cache_hit_ratio{{cache="{cache}"}} {ratio:g}')
+        return "\n".join(lines) + "\n"
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """All series as plain data: counters as values, histograms as count/sum/mean."""
+        snapshot: Dict[str, Any] = {"timestamp": time.time()}
+        with self.lock:
+            for metric in self._metrics:
+                if isinstance(metric, Histogram):
+                    series = [dict(labels, **metric.summary(labels)) for labels in metric.series]
+                else:
+                    series = [dict(labels, value=value) for labels, value in metric.series.items()]
+                if series:
+                    snapshot[metric.name] = series
+        snapshot["cache_hit_ratio"] = self.cache_hit_ratios()
+        return snapshot
+    
+    def write_jsonl(self, path: str) -> None:
+        """Append one snapshot line to a JSON-lines file."""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+    
+    def reset(self) -> None:
+        with self.lock:
+            for metric in self._metrics:
+                metric.series.clear()
+    
+    def start_export(self, path: str, interval: float) -> None:
+        """Append a snapshot every ``interval`` seconds and once more at exit."""
+        def export_loop() -> None:
+            while True:
+                time.sleep(interval)
+                self.write_jsonl(path)
+        
+        if interval > 0:
+            threading.Thread(target=export_loop, name="metrics-export", daemon=True).start()
+        atexit.register(self.write_jsonl, path)
+
+
+metrics = MetricsRegistry()
+
+if METRICS_ENABLED and METRICS_EXPORT_PATH:
+    metrics.start_export(METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL)
@@ -0,0 +1,208 @@
+"""
+Local stand-in for a chat-completions API, used by the benchmark suite.
+
+Serves OpenAI-compatible responses (plain JSON or SSE streaming) with
+configurable latency, tokens-per-second, error rate and streaming behaviour.
+Point the app at it with OPENAI_API_URL / ASI1_MINI_API_URL.
+
+Usage:
+    python mock_server.py --port 8765 --latency 0.3 --tokens-per-second 80
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+WORDS = (
+    "kaizen kanban jidoka heijunka muda mura muri andon poka-yoke gemba takt "
+    "value stream flow pull standard work 5S SMED OEE cycle time throughput"
+).split()
+
+
+class MockSettings:
+    """Behaviour knobs for the mock server."""
+    
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.05,
+        tokens_per_second: float = 0.0,
+        completion_tokens: int = 200,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        retry_after: float = 1.0,
+        streaming: bool = True,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after  # Sent with 429s; 0 = no Retry-After header
+        self.streaming = streaming
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"connections": 0, "requests": 0, "errors": 0, "streams": 0}
+    
+    def incr(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+    
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+
+class ChatCompletionsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockServer"
+    
+    def setup(self) -> None:
+        super().setup()
+        self.server.stats.incr("connections")
+    
+    def log_message(self, format: str, *args) -> None:
+        pass  # Keep benchmark output clean
+    
+    def _send_json(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+    
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(200, {"status": "ok"})
+    
+    def do_POST(self) -> None:
+        settings = self.server.settings
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.stats.incr("requests")
+        
+        time.sleep(max(0.0, random.gauss(settings.latency, settings.jitter)))
+        
+        if random.random() < settings.error_rate:
+            self.server.stats.incr("errors")
+            headers = None
+            if settings.error_status == 429 and settings.retry_after:
+                headers = {"Retry-After": f"{settings.retry_after:g}"}
+            self._send_json(settings.error_status, {"error": {"message": "mock failure"}}, headers)
+            return
+        
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 4
+        max_tokens = request.get("max_tokens") or settings.completion_tokens
+        tokens = [random.choice(WORDS) + " " for _ in range(min(settings.completion_tokens, max_tokens))]
+        delay = 1.0 / settings.tokens_per_second if settings.tokens_per_second else 0.0
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        
+        if not (request.get("stream") and settings.streaming):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                "id": "mock",
+                "object": "chat.completion",
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+        
+        self.server.stats.incr("streams")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(delay)
+                event = {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class MockServer(ThreadingHTTPServer):
+    """Threaded mock chat-completions server."""
+    
+    daemon_threads = True
+    request_queue_size = 1024  # Bursts open many connections at once
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, settings: Optional[MockSettings] = None):
+        super().__init__((host, port), ChatCompletionsHandler)
+        self.settings = settings or MockSettings()
+        self.stats = MockStats()
+    
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+    
+    def start(self) -> "MockServer":
+        """Serve in a background thread (for in-process use)."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock chat-completions server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Std-dev of the latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Generation speed (0 = instant)")
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with 429s (0 = none)")
+    parser.add_argument("--no-stream", action="store_true", help="Ignore stream=true and answer with JSON")
+    args = parser.parse_args()
+    
+    settings = MockSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        streaming=not args.no_stream,
+    )
+    server = MockServer(args.host, args.port, settings)
+    print(f"Mock chat-completions server listening on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
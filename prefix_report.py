@@ -0,0 +1,80 @@
+"""
+Prompt prefix report: how much of each request is a shared, cacheable prefix.
+
+Renders every PromptTemplates method (and the free-form question prompt) over
+sample inputs, builds the chat messages each would send, and prints the
+prefix the renders of each template share. Fails if a template puts variable
+text before its context block, which would stop providers from caching the
+fixed instructions. Run after editing templates.
+
+Usage:
+    python prefix_report.py
+
+Created by: Saqeb Newaz
+"""
+
+import json
+import os
+import sys
+from typing import Dict, List
+
+from config import FRAMEWORKS, INDUSTRY_EXAMPLES
+from main import build_assistant_prompt
+from prompts import CONTEXT_HEADING, build_messages
+from tokens import count_tokens
+from warm_store import template_matrix
+
+# OpenAI only caches prompts of at least this many tokens
+PROVIDER_CACHE_MIN_TOKENS = 1024
+
+
+def sample_prompts() -> Dict[str, List[str]]:
+    """Render every template (and the free-form question prompt) over sample inputs."""
+    samples: Dict[str, List[str]] = {}
+    for entry in template_matrix():
+        if entry.industry in (None, *INDUSTRY_EXAMPLES[:3]):
+            samples.setdefault(entry.template, []).append(entry.prompt())
+    questions = ["How can I reduce waste on my assembly line?", "What KPIs should our  night shift track?\n\n"]
+    samples["build_assistant_prompt"] = [
+        build_assistant_prompt(framework, industry, question)
+        for framework in FRAMEWORKS.values() for industry in INDUSTRY_EXAMPLES[:2] for question in questions
+    ]
+    return samples
+
+
+def prefix_report(samples: Dict[str, List[str]]) -> bool:
+    """Print how much of each template's request is a shared, cacheable prefix.
+    
+    Returns False if any template puts variable text before its context block.
+    """
+    ok = True
+    all_requests = []
+    print(f"{'template':34} {'renders':>7} {'prefix tok':>10} {'total tok':>10} {'shared':>7}")
+    for name, prompts in samples.items():
+        requests = [json.dumps(build_messages(prompt), ensure_ascii=False) for prompt in prompts]
+        all_requests += requests
+        prefix = os.path.commonprefix(requests) if len(requests) > 1 else requests[0]
+        prefix_tokens = count_tokens(prefix)
+        total_tokens = sum(count_tokens(request) for request in requests) / len(requests)
+        # The first divergence must fall inside the context block at the end
+        context_starts = min(request.find(CONTEXT_HEADING) for request in requests)
+        status = "" if len(requests) == 1 or len(prefix) >= context_starts else "  ❌ variable text before the context"
+        ok = ok and not status
+        print(
+            f"{name:34} {len(requests):>7} {prefix_tokens:>10} {total_tokens:>10.0f} "
+            f"{prefix_tokens / total_tokens:>7.0%}{status}"
+        )
+    
+    shared = count_tokens(os.path.commonprefix(all_requests))
+    print(f"\nPrefix shared by every request: {shared} tokens (system prompt)")
+    if shared < PROVIDER_CACHE_MIN_TOKENS:
+        print(f"Note: providers such as OpenAI only cache prefixes of {PROVIDER_CACHE_MIN_TOKENS}+ tokens")
+    return ok
+
+
+def main() -> None:
+    sys.exit(0 if prefix_report(sample_prompts()) else 1)
+
+
+if __name__ == "__main__":
+    main()
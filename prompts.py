@@ -4,43 +4,112 @@ Prompt templates for different types of AI interactions.
 Created by: Saqeb Newaz
 """
 
-from typing import Optional
+import functools
+import inspect
+from typing import Callable, Dict, List, Optional
+
+# Identical on every request for both providers, so it forms a cacheable prefix
+SYSTEM_PROMPT = (
+    "You are an expert Lean manufacturing consultant with deep knowledge of TPS, FPS, SPW, and Lean Six Sigma "
+    "frameworks. Provide practical, actionable advice for factory floor optimization. Created by Saqeb Newaz."
+)
+
+
+def normalize_whitespace(text: str) -> str:
+    """Strip trailing spaces and collapse runs of blank lines so equal content is byte-identical."""
+    lines = [line.rstrip() for line in text.strip().splitlines()]
+    normalized: List[str] = []
+    for line in lines:
+        if line or (normalized and normalized[-1]):
+            normalized.append(line)
+    return "\n".join(normalized)
+
+
+CONTEXT_HEADING = "Request details:"
+
+
+def prompt_context(**fields: str) -> str:
+    """The variable part of a prompt, always appended last under CONTEXT_HEADING."""
+    lines = [f"{name.replace('_', ' ').capitalize()}: {normalize_whitespace(value)}" for name, value in fields.items()]
+    return "\n\n" + CONTEXT_HEADING + "\n" + "\n".join(lines)
+
+
+def build_messages(prompt: str) -> List[Dict[str, str]]:
+    """Chat messages for a prompt: the shared system prompt, then the prompt itself."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+class TemplatePrompt(str):
+    """A rendered prompt that remembers which template produced it, and from which fields."""
+    
+    template = "custom"
+    fields: Dict[str, str] = {}
+    
+    def __new__(cls, text: str, template: str, fields: Optional[Dict[str, str]] = None) -> "TemplatePrompt":
+        prompt = super().__new__(cls, text)
+        prompt.template = template
+        prompt.fields = fields or {}
+        return prompt
+
+
+def template(method: Callable[..., str]) -> Callable[..., TemplatePrompt]:
+    """Tag a template method's output with the method name and its arguments."""
+    signature = inspect.signature(method)
+    
+    @functools.wraps(method)
+    def render(*args, **kwargs) -> TemplatePrompt:
+        fields = dict(signature.bind(*args, **kwargs).arguments)
+        return TemplatePrompt(method(*args, **kwargs), method.__name__, fields)
+    return render
 
 
 class PromptTemplates:
-    """Collection of prompt templates for the Lean AI Assistant."""
+    """Collection of prompt templates for the Lean AI Assistant.
+    
+    Every template starts with its fixed instructions and ends with
+    prompt_context(), so requests for the same template share a byte-identical
+    prefix that providers can cache.
+    """
     
     @staticmethod
+    @template
     def framework_comparison(industry: str) -> str:
         """Generate prompt for comparing all frameworks."""
         return (
-            f"Compare Toyota Production System (TPS), Ford Production System (FPS), "
-            f"Stellantis Production Way (SPW), and Lean Six Sigma highlighting:\n"
-            f"- Core principles and differences\n"
-            f"- Best-fit industries (especially {industry})\n"
-            f"- AI integration opportunities\n"
-            f"- Real-world Canadian examples where relevant\n"
-            f"Structure: Concise comparison table then 2-sentence summary per framework."
+            "Compare Toyota Production System (TPS), Ford Production System (FPS), "
+            "Stellantis Production Way (SPW), and Lean Six Sigma highlighting:\n"
+            "- Core principles and differences\n"
+            "- Best-fit industries (especially the industry below)\n"
+            "- AI integration opportunities\n"
+            "- Real-world Canadian examples where relevant\n"
+            "Structure: Concise comparison table then 2-sentence summary per framework."
+            + prompt_context(industry=industry)
         )
     
     @staticmethod
+    @template
     def framework_guide(framework: str, industry: str) -> str:
         """Generate prompt for interactive framework guide."""
         return (
-            f"Create interactive guide for {framework} in the {industry} industry covering:\n"
-            f"1. Core principles (max 3 key concepts)\n"
-            f"2. Industry-specific implementation roadmap\n"
-            f"3. AI integration opportunities (reference Toyota/HBR examples)\n"
-            f"4. Canadian case study example\n"
-            f"5. Interactive options: 'Dive deeper into [concept]', 'See simulation', 'Compare frameworks'\n"
-            f"Format: Conversational tone with emoji section breaks 🇨🇦"
+            "Create interactive guide for the framework in the industry below covering:\n"
+            "1. Core principles (max 3 key concepts)\n"
+            "2. Industry-specific implementation roadmap\n"
+            "3. AI integration opportunities (reference Toyota/HBR examples)\n"
+            "4. Canadian case study example\n"
+            "5. Interactive options: 'Dive deeper into [concept]', 'See simulation', 'Compare frameworks'\n"
+            "Format: Conversational tone with emoji section breaks 🇨🇦"
+            + prompt_context(framework=framework, industry=industry)
         )
     
     @staticmethod
+    @template
     def implementation_roadmap(framework: str, industry: str) -> str:
         """Generate prompt for 6-month implementation roadmap."""
         return (
-            f"Create a 6-month implementation roadmap for {framework} in the {industry} industry with Canadian context:\n"
+            "Create a 6-month implementation roadmap for the framework in the industry below with Canadian context:\n"
             "1. **Phase 1: Assessment (Month 1)**\n"
             "   - Current state value stream mapping\n"
             "   - Waste identification (7+1 wastes)\n"
@@ -61,21 +130,25 @@ class PromptTemplates:
             "- Supply chain considerations\n"
             "- Labor regulations\n"
             "- Climate impact mitigation"
+            + prompt_context(framework=framework, industry=industry)
         )
     
     @staticmethod
+    @template
     def kpi_metrics(framework: str, industry: str) -> str:
         """Generate prompt for SMART KPIs."""
         return (
-            f"Create 5 SMART KPIs for {framework} implementation in Canadian {industry} "
-            f"sector with AI integration targets. Include baseline, target, and measurement frequency."
+            "Create 5 SMART KPIs for implementing the framework below in the Canadian sector below "
+            "with AI integration targets. Include baseline, target, and measurement frequency."
+            + prompt_context(framework=framework, industry=industry)
         )
     
     @staticmethod
+    @template
     def ai_tools_recommendation(framework: str, industry: str) -> str:
         """Generate prompt for AI tools recommendation."""
         return (
-            f"Recommend AI tools for {framework} implementation in {industry} with Canadian availability:\n"
+            "Recommend AI tools for implementing the framework in the industry below with Canadian availability:\n"
             "1. **Predictive Maintenance** (2 tools with pricing)\n"
             "2. **Quality Control** (2 computer vision solutions)\n"
             "3. **Supply Chain Optimization** (1 Canadian-specific platform)\n"
@@ -85,9 +158,11 @@ class PromptTemplates:
             "- Integration requirements\n"
             "- ROI case study summary\n"
             "- Free trial information"
+            + prompt_context(framework=framework, industry=industry)
         )
     
     @staticmethod
+    @template
     def crisis_communication_integration() -> str:
         """Generate prompt for crisis communication features."""
         return (
@@ -96,4 +171,4 @@ class PromptTemplates:
             "2. Emergency Operations protocols\n"
             "3. Business crisis communication templates\n"
             "Show how these interface with Lean AI systems for manufacturing environments."
-        )
\ No newline at end of file
+        )
@@ -0,0 +1,219 @@
+"""
+Client-side rate limiting and retry backoff for AI provider calls.
+
+Each provider gets one RateLimiter shared by every thread and coroutine in the
+process. It holds token buckets for requests-per-minute and tokens-per-minute
+and adapts its rate when the provider answers HTTP 429.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Mapping, Optional
+
+from cancellation import RequestCancelled, sleep
+from config import RETRY_BASE_DELAY, RETRY_MAX_DELAY
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate_per_minute``.
+
+    Callers reserve capacity up front and are told how long to wait, which
+    lets blocking threads and asyncio tasks share the same bucket.
+    """
+    
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        self.updated = now
+        self.available = min(self.capacity, self.available + elapsed * self.rate_per_minute / 60.0)
+    
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` tokens and return the seconds to wait before using them."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.available -= amount
+            if self.available >= 0:
+                return 0.0
+            return -self.available * 60.0 / self.rate_per_minute
+    
+    def refund(self, amount: float) -> None:
+        """Return over-reserved tokens (may be negative to charge more)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.available = min(self.capacity, self.available + amount)
+    
+    def set_rate(self, rate_per_minute: float) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate_per_minute = rate_per_minute
+            self.capacity = rate_per_minute
+            self.available = min(self.available, self.capacity)
+    
+    def drain_for(self, seconds: float) -> None:
+        """Block new reservations for roughly ``seconds`` (used for Retry-After)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.available = min(self.available, -seconds * self.rate_per_minute / 60.0)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one provider.
+
+    A limit of 0 means unlimited. On a 429 the effective rate is cut
+    multiplicatively and then recovers additively with each success, so
+    throughput settles just below the real quota. If no request limit was
+    configured, one is derived from the observed request rate at the first 429.
+    """
+    
+    decrease_factor = 0.7
+    increase_step = 0.02
+    min_scale = 0.1
+    
+    def __init__(self, name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.name = name
+        self.configured_rpm = requests_per_minute
+        self.configured_tpm = tokens_per_minute
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.scale = 1.0
+        
+        self._lock = threading.Lock()
+        self._recent: Deque[float] = deque(maxlen=10000)
+        self._counters = {"requests": 0, "rate_limited": 0, "waited_seconds": 0.0}
+    
+    def reserve(self, tokens: float = 0) -> float:
+        """Reserve one request and ``tokens`` tokens; return the seconds to wait."""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        
+        now = time.monotonic()
+        with self._lock:
+            self._recent.append(now + wait)
+            self._counters["requests"] += 1
+            self._counters["waited_seconds"] += wait
+        return wait
+    
+    def acquire(self, tokens: float = 0) -> None:
+        """Blocking acquire for threads; the wait ends early if the caller is cancelled."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            try:
+                sleep(wait)
+            except RequestCancelled:
+                self.settle(tokens, 0)  # Never sent
+                raise
+    
+    async def acquire_async(self, tokens: float = 0) -> None:
+        """Non-blocking acquire for coroutines; a cancelled wait returns its reservation."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.settle(tokens, 0)  # Never sent
+                raise
+    
+    def settle(self, reserved_tokens: float, used_tokens: Optional[float]) -> None:
+        """Reconcile a token reservation with the usage reported by the provider."""
+        if self.tokens is not None and used_tokens is not None:
+            self.tokens.refund(reserved_tokens - used_tokens)
+    
+    def _observed_rpm(self) -> float:
+        cutoff = time.monotonic() - 60.0
+        with self._lock:
+            while self._recent and self._recent[0] < cutoff:
+                self._recent.popleft()
+            return float(len(self._recent))
+    
+    def _apply_scale(self) -> None:
+        if self.requests is not None:
+            self.requests.set_rate(max(1.0, self.configured_rpm * self.scale))
+        if self.tokens is not None:
+            self.tokens.set_rate(max(1.0, self.configured_tpm * self.scale))
+    
+    def on_success(self) -> None:
+        """Additive increase back toward the configured limits."""
+        if self.scale >= 1.0:
+            return
+        with self._lock:
+            self.scale = min(1.0, self.scale + self.increase_step)
+            self._apply_scale()
+    
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """Multiplicative decrease after HTTP 429, pausing for Retry-After if given."""
+        observed = self._observed_rpm()
+        with self._lock:
+            self._counters["rate_limited"] += 1
+            if self.requests is None:
+                # No configured limit: start just under the rate that triggered the 429
+                self.configured_rpm = max(1.0, observed * 0.9)
+                self.requests = TokenBucket(self.configured_rpm)
+            self.scale = max(self.min_scale, self.scale * self.decrease_factor)
+            self._apply_scale()
+            if retry_after:
+                self.requests.drain_for(retry_after)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counters)
+            stats["scale"] = round(self.scale, 3)
+            stats["requests_per_minute"] = self.requests.rate_per_minute if self.requests else None
+            stats["tokens_per_minute"] = self.tokens.rate_per_minute if self.tokens else None
+        return stats
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0) -> RateLimiter:
+    """Return the process-wide limiter for a provider, creating it on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(name, requests_per_minute, tokens_per_minute)
+            _limiters[name] = limiter
+        return limiter
+
+
+def rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        return {name: limiter.stats() for name, limiter in _limiters.items()}
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+    return delay
\ No newline at end of file
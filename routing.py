@@ -0,0 +1,363 @@
+"""
+Latency-aware routing across providers with hedged requests.
+
+RoutingProvider (provider name "auto") keeps a rolling window of latency and
+errors per provider and sends each request to the healthiest one. If the
+answer has not arrived after that provider's usual p95 latency, a duplicate is
+sent to the next provider; the first answer wins and the slower request is
+cancelled. Hedging is capped at a share of all requests so cost stays bounded.
+The first request runs on the caller's thread; only duplicates use a pool.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from ai_providers import AIProvider, ProviderError, get_shared_provider
+from cancellation import CancelToken, RequestCancelled, cancellable, current_token
+from config import (
+    ROUTING_PROVIDERS, ROUTING_HEDGE_ENABLED, ROUTING_HEDGE_PERCENTILE, ROUTING_HEDGE_MIN_DELAY,
+    ROUTING_HEDGE_BUDGET, ROUTING_HEDGE_WORKERS,
+)
+from health import ProviderHealth
+from metrics import metrics
+
+
+class RoutingProvider(AIProvider):
+    """Sends each request to the healthiest provider, hedging slow ones."""
+    
+    display_name = "Auto"
+    # Member providers are scheduled on their own
+    direct = False
+    # Routing follows the provider list and every member's configuration
+    config_env = (
+        "ROUTING_PROVIDERS", "OPENAI_API_KEY", "OPENAI_API_URL", "ASI1_MINI_API_KEY", "ASI1_MINI_API_URL",
+    )
+    
+    def __init__(
+        self,
+        providers: Optional[List[AIProvider]] = None,
+        hedge: bool = ROUTING_HEDGE_ENABLED,
+        hedge_percentile: float = ROUTING_HEDGE_PERCENTILE,
+        hedge_min_delay: float = ROUTING_HEDGE_MIN_DELAY,
+        hedge_budget: float = ROUTING_HEDGE_BUDGET,
+        hedge_workers: int = ROUTING_HEDGE_WORKERS,
+    ):
+        if providers is None:
+            providers = []
+            for name in ROUTING_PROVIDERS:
+                try:
+                    providers.append(get_shared_provider(name))
+                except RuntimeError:
+                    continue  # Missing API key: route between the others
+        if not providers:
+            raise RuntimeError("No providers available for routing. Please check your API keys.")
+        
+        self.providers = providers
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self.health = {provider.display_name: ProviderHealth() for provider in providers}
+        # Only duplicates run here (at most hedge_budget of requests); first requests use the caller's thread
+        self.executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="lean-ai-hedge")
+        
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0}
+    
+    def ranked(self) -> List[AIProvider]:
+        """Providers ordered healthiest first (ties keep the configured order)."""
+        return sorted(self.providers, key=lambda provider: self.health[provider.display_name].score())
+    
+    def request_fingerprint(self, prompt: str) -> str:
+        """Stable across routing decisions, but apart from every member's own key.
+        
+        An answer cached for "auto" may come from any member, so it must not be
+        served to callers that asked one provider by name.
+        """
+        key = json.dumps(["auto"] + [provider.request_fingerprint(prompt) for provider in self.providers])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+    
+    def hedge_delay(self, provider: AIProvider) -> float:
+        """Wait this long for ``provider`` before sending a duplicate elsewhere."""
+        latency = self.health[provider.display_name].percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, latency or 0.0)
+    
+    def _start(self) -> List[AIProvider]:
+        with self._lock:
+            self._counters["requests"] += 1
+        ranked = self.ranked()
+        metrics.routed.inc(provider=ranked[0].display_name)
+        return ranked
+    
+    def _take_hedge(self, ranked: List[AIProvider]) -> bool:
+        """Whether a duplicate may be sent, keeping hedges within the budget."""
+        if not self.hedge or len(ranked) < 2:
+            return False
+        with self._lock:
+            if self._counters["hedged"] > self.hedge_budget * self._counters["requests"]:
+                return False
+            self._counters["hedged"] += 1
+            return True
+    
+    def _hedge_result(self, winner: AIProvider, primary: AIProvider) -> None:
+        won = winner is not primary
+        if won:
+            with self._lock:
+                self._counters["hedge_wins"] += 1
+        metrics.hedges.inc(provider=winner.display_name, result="hedge_won" if won else "primary_won")
+    
+    def _failed_over(self) -> None:
+        with self._lock:
+            self._counters["failovers"] += 1
+    
+    def _lost_race(self, provider: AIProvider, started: float) -> None:
+        """A request aborted because the other one answered first took at least this long."""
+        self.health[provider.display_name].record(time.monotonic() - started, ok=True)
+    
+    def _timed_call(self, provider: AIProvider, prompt: str) -> str:
+        """Call ``provider`` and record its latency; a cancelled call says nothing about it and is not recorded."""
+        health = self.health[provider.display_name]
+        started = time.monotonic()
+        try:
+            response = provider.call(prompt)
+        except ProviderError:
+            health.record(time.monotonic() - started, ok=False)
+            raise
+        health.record(time.monotonic() - started, ok=True)
+        return response
+    
+    def _hedged_call(self, token: CancelToken, provider: AIProvider, prompt: str) -> str:
+        with cancellable(token):
+            return self._timed_call(provider, prompt)
+    
+    def _call_with_failover(self, providers: List[AIProvider], prompt: str) -> str:
+        error: Optional[ProviderError] = None
+        for provider in providers:
+            if error is not None:
+                self._failed_over()
+            try:
+                return self._timed_call(provider, prompt)
+            except ProviderError as exc:
+                error = exc
+        raise error
+    
+    def call(self, prompt: str) -> str:
+        ranked = self._start()
+        if not self.hedge or len(ranked) < 2:
+            return self._call_with_failover(ranked, prompt)
+        return _HedgedCall(self, ranked, prompt).run()
+    
+    async def _timed_acall(self, provider: AIProvider, prompt: str) -> str:
+        health = self.health[provider.display_name]
+        started = time.monotonic()
+        try:
+            response = await provider.acall(prompt)
+        except ProviderError:
+            health.record(time.monotonic() - started, ok=False)
+            raise
+        health.record(time.monotonic() - started, ok=True)
+        return response
+    
+    async def _acall_with_failover(self, providers: List[AIProvider], prompt: str) -> str:
+        error: Optional[ProviderError] = None
+        for provider in providers:
+            if error is not None:
+                self._failed_over()
+            try:
+                return await self._timed_acall(provider, prompt)
+            except ProviderError as exc:
+                error = exc
+        raise error
+    
+    async def _arace(self, tasks: Dict["asyncio.Future[str]", Tuple[AIProvider, float]], primary: AIProvider) -> str:
+        """The answer of whichever hedged request succeeds first; the last error if none does."""
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                exc = task.exception()
+                if exc is None:
+                    for other in pending:
+                        self._lost_race(*tasks[other])
+                    self._hedge_result(tasks[task][0], primary)
+                    return task.result()
+                if not isinstance(exc, ProviderError):
+                    raise exc
+                error = exc
+        raise error
+    
+    async def acall(self, prompt: str) -> str:
+        ranked = self._start()
+        primary = ranked[0]
+        if not self.hedge or len(ranked) < 2:
+            return await self._acall_with_failover(ranked, prompt)
+        
+        first = asyncio.ensure_future(self._timed_acall(primary, prompt))
+        tasks = {first: (primary, time.monotonic())}
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(primary))
+            if done:
+                try:
+                    return first.result()
+                except ProviderError:
+                    self._failed_over()
+                    return await self._acall_with_failover(ranked[1:], prompt)
+            
+            if not self._take_hedge(ranked):
+                return await first
+            
+            tasks[asyncio.ensure_future(self._timed_acall(ranked[1], prompt))] = (ranked[1], time.monotonic())
+            return await self._arace(tasks, primary)
+        finally:
+            # Cancel the losing request (or both, if our caller was cancelled)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Stream from the healthiest provider, failing over if it errors before the first chunk."""
+        error: Optional[ProviderError] = None
+        for provider in self._start():
+            if error is not None:
+                self._failed_over()
+            health = self.health[provider.display_name]
+            started = time.monotonic()
+            received = False
+            try:
+                for chunk in provider.stream(prompt):
+                    received = True
+                    yield chunk
+            except ProviderError as exc:
+                health.record(time.monotonic() - started, ok=False)
+                if received:
+                    raise
+                error = exc
+                continue
+            health.record(time.monotonic() - started, ok=True)
+            return
+        raise error
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        error: Optional[ProviderError] = None
+        for provider in self._start():
+            if error is not None:
+                self._failed_over()
+            health = self.health[provider.display_name]
+            started = time.monotonic()
+            received = False
+            try:
+                async for chunk in provider.astream(prompt):
+                    received = True
+                    yield chunk
+            except ProviderError as exc:
+                health.record(time.monotonic() - started, ok=False)
+                if received:
+                    raise
+                error = exc
+                continue
+            health.record(time.monotonic() - started, ok=True)
+            return
+        raise error
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counters)
+        stats["providers"] = {name: health.stats() for name, health in self.health.items()}
+        return stats
+
+
+class _HedgedCall:
+    """One blocking call: the first request on the caller's thread, a duplicate on the pool if it is slow.
+    
+    The duplicate is started by a timer once the first request has run for the
+    provider's hedge delay. Whichever answers first wins; the other request's
+    token is cancelled, which aborts its socket.
+    """
+    
+    def __init__(self, router: RoutingProvider, ranked: List[AIProvider], prompt: str):
+        self.router = router
+        self.primary, self.secondary = ranked[0], ranked[1]
+        self.ranked = ranked
+        self.prompt = prompt
+        self.parent = current_token()
+        self.token = self._child_token()
+        self.hedge: Optional[Future] = None
+        self.hedge_token: Optional[CancelToken] = None
+        self.hedge_started = 0.0
+        self.finished = False
+        self._lock = threading.Lock()
+    
+    def _child_token(self) -> CancelToken:
+        return self.parent.child() if self.parent is not None else CancelToken()
+    
+    def _start_hedge(self) -> None:
+        with self._lock:
+            if self.finished or not self.router._take_hedge(self.ranked):
+                return
+            self.hedge_token = self._child_token()
+            self.hedge_started = time.monotonic()
+            # The timer runs in the caller's context, so the duplicate keeps the request's scheduling priority
+            self.hedge = self.router.executor.submit(
+                contextvars.copy_context().run, self.router._hedged_call, self.hedge_token, self.secondary, self.prompt
+            )
+        self.hedge.add_done_callback(self._hedge_done)
+    
+    def _hedge_done(self, hedge: Future) -> None:
+        if not hedge.cancelled() and hedge.exception() is None:
+            self.token.cancel("Lost the hedge race")
+    
+    def _finish(self) -> Optional[Future]:
+        """Stop a duplicate from being started; return the one already running, if any."""
+        with self._lock:
+            self.finished = True
+            return self.hedge
+    
+    def run(self) -> str:
+        timer = threading.Timer(self.router.hedge_delay(self.primary), contextvars.copy_context().run, (self._start_hedge,))
+        timer.daemon = True
+        started = time.monotonic()
+        timer.start()
+        try:
+            with cancellable(self.token):
+                response = self.router._timed_call(self.primary, self.prompt)
+        except RequestCancelled:
+            hedge = self._finish()
+            if hedge is None or self.parent is not None and self.parent.cancelled:
+                raise  # Our caller cancelled
+            # Aborted because the duplicate answered first
+            self.router._lost_race(self.primary, started)
+            self.router._hedge_result(self.secondary, self.primary)
+            return hedge.result()
+        except ProviderError:
+            hedge = self._finish()
+            if hedge is None:
+                self.router._failed_over()
+                return self.router._call_with_failover(self.ranked[1:], self.prompt)
+            response = hedge.result()  # Raises the duplicate's error if it failed too
+            self.router._hedge_result(self.secondary, self.primary)
+            return response
+        except BaseException:
+            hedge = self._finish()
+            if hedge is not None:
+                self.hedge_token.cancel()
+            raise
+        finally:
+            timer.cancel()
+        
+        hedge = self._finish()
+        if hedge is not None:
+            # Abort the losing duplicate; it still feeds its provider's health
+            hedge.cancel()
+            self.hedge_token.cancel("Lost the hedge race")
+            self.router._lost_race(self.secondary, self.hedge_started)
+            self.router._hedge_result(self.primary, self.primary)
+        return response
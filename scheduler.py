@@ -0,0 +1,307 @@
+"""
+Priority scheduling of provider calls across interactive and bulk work.
+
+Every upstream provider gets a Scheduler with a fixed number of concurrent
+request slots. Callers queue by priority class (interactive before normal
+before bulk) and, within a class, take turns per tenant, so one busy user or
+batch file cannot crowd out the others. Bulk work may only fill part of the
+slots, which keeps room for interactive requests arriving while a batch runs.
+Requests that wait past their class's deadline are shed with
+RequestShedError instead of answering a user who has long given up.
+
+The priority and tenant of the current request travel in context variables;
+entry points set them with ``scheduling()``:
+
+    with scheduling("bulk", tenant="warm_store"):
+        ai.call(prompt)
+
+Created by: Saqeb Newaz
+"""
+
+import contextlib
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from ai_providers import AIProvider, ProviderError, ProviderWrapper
+from cancellation import RequestCancelled, current_token, is_cancellation, on_cancel
+from config import SCHEDULER_MAX_CONCURRENCY, SCHEDULER_BULK_SHARE, SCHEDULER_MAX_WAIT
+from metrics import metrics
+
+# Highest priority first
+PRIORITIES = ("interactive", "normal", "bulk")
+DEFAULT_PRIORITY = "interactive"
+DEFAULT_TENANT = "default"
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("lean_ai_priority", default=DEFAULT_PRIORITY)
+_tenant: contextvars.ContextVar[str] = contextvars.ContextVar("lean_ai_tenant", default=DEFAULT_TENANT)
+
+
+class RequestShedError(ProviderError):
+    """The request waited too long for a provider slot and was dropped."""
+    
+    def __init__(self, provider: str, priority: str, waited: float):
+        super().__init__(provider, f"{provider} is busy; {priority} request dropped after waiting {waited:.1f}s.")
+        self.priority = priority
+        self.retry_after = 1.0
+
+
+@contextlib.contextmanager
+def scheduling(priority: Optional[str] = None, tenant: Optional[str] = None) -> Iterator[None]:
+    """Run the enclosed provider calls with the given priority class and tenant."""
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}'. Available: {', '.join(PRIORITIES)}")
+    tokens = []
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    if tenant is not None:
+        tokens.append((_tenant, _tenant.set(tenant)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def current_scheduling() -> Tuple[str, str]:
+    """(priority, tenant) of the calling thread or task."""
+    return _priority.get(), _tenant.get()
+
+
+def _resolve(waiter: Any) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class _Waiter:
+    """A request queued for a slot; woken from whichever thread frees one."""
+    
+    def __init__(self, priority: str, tenant: str):
+        self.priority = priority
+        self.tenant = tenant
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.event = threading.Event()
+        self.wake: Optional[Callable[[], None]] = None
+    
+    def grant(self) -> None:
+        self.granted = True
+        self.event.set()
+        if self.wake is not None:
+            self.wake()
+
+
+class Scheduler:
+    """Concurrency slots for one provider, handed out by priority and per-tenant turns."""
+    
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = SCHEDULER_MAX_CONCURRENCY,
+        bulk_share: float = SCHEDULER_BULK_SHARE,
+        max_wait: Optional[Dict[str, float]] = None,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.limits = {priority: max_concurrency for priority in PRIORITIES}
+        self.limits["bulk"] = max(1, int(max_concurrency * bulk_share))
+        self.max_wait = dict(max_wait or SCHEDULER_MAX_WAIT)
+        
+        self.running = {priority: 0 for priority in PRIORITIES}
+        # Per class: tenant -> its waiters; tenants are served round-robin in insertion order
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {priority: OrderedDict() for priority in PRIORITIES}
+        self._lock = threading.Lock()
+        self._counters = {"admitted": 0, "queued": 0, "shed": 0}
+    
+    def _next(self, priority: str) -> Optional[_Waiter]:
+        """Pop the first waiter of the tenant whose turn it is."""
+        queue = self._queues[priority]
+        if not queue:
+            return None
+        tenant, waiters = queue.popitem(last=False)
+        waiter = waiters.popleft()
+        if waiters:
+            queue[tenant] = waiters  # Back of the line for this tenant's next request
+        return waiter
+    
+    def _dispatch(self) -> None:
+        """Hand free slots to waiters, highest priority first; the caller holds the lock."""
+        for priority in PRIORITIES:
+            while sum(self.running.values()) < self.max_concurrency and self.running[priority] < self.limits[priority]:
+                waiter = self._next(priority)
+                if waiter is None:
+                    break
+                self.running[priority] += 1
+                self._counters["admitted"] += 1
+                waiter.grant()
+    
+    def _enqueue(self, waiter: _Waiter) -> None:
+        priority, tenant = waiter.priority, waiter.tenant
+        with self._lock:
+            self._queues[priority].setdefault(tenant, deque()).append(waiter)
+            self._dispatch()
+            if not waiter.granted:
+                self._counters["queued"] += 1
+    
+    def _deadline(self, waiter: _Waiter) -> Optional[float]:
+        max_wait = self.max_wait.get(waiter.priority, 0)
+        return waiter.enqueued + max_wait if max_wait > 0 else None
+    
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Withdraw a waiter that was not granted in time; False if it got a slot after all."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            queue = self._queues[waiter.priority]
+            waiters = queue.get(waiter.tenant)
+            if waiters is not None:
+                waiters.remove(waiter)
+                if not waiters:
+                    del queue[waiter.tenant]
+            return True
+    
+    def _admitted(self, waiter: _Waiter) -> None:
+        metrics.scheduler_wait.observe(time.monotonic() - waiter.enqueued, provider=self.name, priority=waiter.priority)
+    
+    def _cancelled(self, waiter: _Waiter) -> None:
+        metrics.cancellations.inc(provider=self.name, stage="queued")
+    
+    def _shed(self, waiter: _Waiter) -> RequestShedError:
+        with self._lock:
+            self._counters["shed"] += 1
+        metrics.scheduler_shed.inc(provider=self.name, priority=waiter.priority)
+        return RequestShedError(self.name, waiter.priority, time.monotonic() - waiter.enqueued)
+    
+    def release(self, priority: str) -> None:
+        with self._lock:
+            self.running[priority] -= 1
+            self._dispatch()
+    
+    def acquire(self, priority: str, tenant: str) -> None:
+        """Block until a slot is free; raise RequestShedError past the class's deadline.
+        
+        Cancelling the caller's token (see cancellation.py) takes the request
+        out of the queue and raises RequestCancelled.
+        """
+        token = current_token()
+        waiter = _Waiter(priority, tenant)
+        self._enqueue(waiter)
+        deadline = self._deadline(waiter)
+        try:
+            with on_cancel(waiter.event.set):
+                waiter.event.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except BaseException:
+            if not self._give_up(waiter):
+                self.release(priority)
+            raise
+        if not waiter.granted and self._give_up(waiter):
+            if token is not None and token.cancelled:
+                self._cancelled(waiter)
+                raise RequestCancelled(token.reason)
+            raise self._shed(waiter)
+        self._admitted(waiter)
+    
+    async def acquire_async(self, priority: str, tenant: str) -> None:
+        """Coroutine counterpart of acquire(); never blocks the event loop."""
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        def wake() -> None:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # The waiting loop has closed
+        
+        waiter = _Waiter(priority, tenant)
+        waiter.wake = wake
+        self._enqueue(waiter)
+        
+        deadline = self._deadline(waiter)
+        try:
+            await asyncio.wait({future}, timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except BaseException as exc:
+            # Cancelled while queued: leave the queue, or hand back a slot granted meanwhile
+            if not self._give_up(waiter):
+                self.release(priority)
+            elif is_cancellation(type(exc)):
+                self._cancelled(waiter)
+            raise
+        if not waiter.granted and self._give_up(waiter):
+            raise self._shed(waiter)
+        self._admitted(waiter)
+    
+    @contextlib.contextmanager
+    def slot(self, priority: str, tenant: str) -> Iterator[None]:
+        self.acquire(priority, tenant)
+        try:
+            yield
+        finally:
+            self.release(priority)
+    
+    @contextlib.asynccontextmanager
+    async def aslot(self, priority: str, tenant: str) -> AsyncIterator[None]:
+        await self.acquire_async(priority, tenant)
+        try:
+            yield
+        finally:
+            self.release(priority)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._counters)
+            stats["running"] = dict(self.running)
+            stats["waiting"] = {
+                priority: sum(len(waiters) for waiters in queue.values()) for priority, queue in self._queues.items()
+            }
+            stats["tenants_waiting"] = {priority: len(queue) for priority, queue in self._queues.items()}
+        stats["max_concurrency"] = self.max_concurrency
+        return stats
+
+
+class SchedulingProvider(ProviderWrapper):
+    """Provider wrapper that takes a Scheduler slot for every upstream request."""
+    
+    def __init__(self, provider: AIProvider, scheduler: Optional[Scheduler] = None):
+        super().__init__(provider)
+        self.scheduler = scheduler or get_scheduler(provider.display_name)
+    
+    def call(self, prompt: str) -> str:
+        with self.scheduler.slot(*current_scheduling()):
+            return self.provider.call(prompt)
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        # The slot is held until the stream is finished or closed
+        with self.scheduler.slot(*current_scheduling()):
+            yield from self.provider.stream(prompt)
+    
+    async def acall(self, prompt: str) -> str:
+        async with self.scheduler.aslot(*current_scheduling()):
+            return await self.provider.acall(prompt)
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        async with self.scheduler.aslot(*current_scheduling()):
+            async for chunk in self.provider.astream(prompt):
+                yield chunk
+
+
+_schedulers: Dict[str, Scheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name: str) -> Scheduler:
+    """Return the process-wide scheduler for a provider, creating it on first use."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(name)
+        if scheduler is None:
+            scheduler = Scheduler(name)
+            _schedulers[name] = scheduler
+        return scheduler
+
+
+def scheduler_stats() -> Dict[str, Dict[str, Any]]:
+    with _schedulers_lock:
+        return {name: scheduler.stats() for name, scheduler in _schedulers.items()}
@@ -0,0 +1,315 @@
+"""
+Local semantic answer cache for free-form questions.
+
+Questions are vectorized locally with NumPy (hashed word and character n-grams
+weighted by TF-IDF, no network calls) and compared by cosine similarity within
+a scope of (provider, framework, industry). Near-duplicate questions such as
+"reduce waste on assembly line" and "cut waste in my assembly line" reuse the
+stored answer instead of calling the LLM again.
+
+A wrong answer served with confidence is worse than a miss, so questions that
+differ in intent or subject never match however many words they share: intent
+verbs and negations ("implement" / "remove", "with" / "without") are heavily
+weighted features, and a question in which a content word was swapped for
+another ("paint shop" / "body shop") is rejected outright.
+
+Created by: Saqeb Newaz
+"""
+
+import atexit
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from config import (
+    SEMANTIC_CACHE_PATH,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_DIMENSIONS,
+)
+from metrics import metrics
+
+Scope = Tuple[str, str, str]
+
+# Words that carry no meaning for matching Lean questions
+STOP_WORDS = frozenset(
+    "a an the in on at of for to and or my our your we i me us how can do does is are be with "
+    "using use what which should could would please from into by it this that".split()
+)
+
+# Verbs and negations that decide what a question asks for; synonyms share one intent
+INTENT_WORDS: Dict[str, str] = {
+    word: intent
+    for intent, words in {
+        "reduce": "reduce reducing cut cutting lower lowering decrease decreasing minimize minimise shorten shrink",
+        "increase": "increase increasing raise raising boost boosting maximize maximise grow expand extend",
+        "add": "implement implementing introduce introducing add adding start starting adopt adopting deploy "
+               "launch begin create set",
+        "remove": "remove removing eliminate eliminating stop stopping drop dropping abolish discontinue",
+        "not": "not no without never don doesn isn aren cannot avoid",
+        "outsource": "outsource outsourcing",
+        "insource": "insource insourcing",
+    }.items()
+    for word in words.split()
+}
+INTENTS = frozenset(INTENT_WORDS.values())
+
+
+def normalize(text: str) -> List[str]:
+    """Lowercase, strip punctuation, drop stop words and map intent synonyms to their intent."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return [INTENT_WORDS.get(word, word) for word in words if word not in STOP_WORDS]
+
+
+def content_words(text: str) -> Set[str]:
+    """Normalized words of three letters or more, with a plural "s" dropped."""
+    words = set()
+    for word in normalize(text):
+        if len(word) < 3:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+def substituted(question: str, stored: str) -> bool:
+    """Whether each question has a content word the other lacks, i.e. one was swapped for another.
+    
+    Added words ("the assembly line" for "assembly") are allowed; a swap
+    ("body shop" for "paint shop") changes what is asked about.
+    """
+    asked, answered = content_words(question), content_words(stored)
+    return bool(asked - answered) and bool(answered - asked)
+
+
+class HashingVectorizer:
+    """Maps text to a fixed-size term-frequency vector using hashed n-grams."""
+    
+    # Bumped whenever features or weights change, so saved indexes are rebuilt
+    version = 2
+    # Per feature kind: words, word bigrams, character n-grams and intents
+    weights = {"w": 1.0, "b": 1.0, "c": 0.5, "i": 6.0}
+    
+    def __init__(self, dimensions: int = SEMANTIC_CACHE_DIMENSIONS, char_ngrams: Tuple[int, int] = (3, 5)):
+        self.dimensions = dimensions
+        self.char_ngrams = char_ngrams
+    
+    def features(self, text: str) -> List[str]:
+        words = normalize(text)
+        features = [f"w:{word}" for word in words]
+        features += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+        features += [f"i:{word}" for word in words if word in INTENTS]
+        low, high = self.char_ngrams
+        for word in words:
+            padded = f" {word} "
+            for n in range(low, high + 1):
+                features += [f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1)]
+        return features
+    
+    def transform(self, text: str) -> np.ndarray:
+        """Sublinear weighted term frequencies; crc32 keeps hashes stable across processes."""
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self.features(text):
+            vector[zlib.crc32(feature.encode("utf-8")) % self.dimensions] += self.weights[feature[0]]
+        np.log1p(vector, out=vector)
+        return vector
+
+
+class _ScopeIndex:
+    """Term-frequency matrix, document frequencies and answers for one scope."""
+    
+    def __init__(self, dimensions: int):
+        self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self.document_frequency = np.zeros(dimensions, dtype=np.float32)
+        self.questions: List[str] = []
+        self.answers: List[str] = []
+        self.last_used: List[float] = []
+    
+    def __len__(self) -> int:
+        return len(self.questions)
+    
+    def idf(self) -> np.ndarray:
+        count = len(self) + 1
+        return np.log((1.0 + count) / (1.0 + self.document_frequency)) + 1.0
+    
+    def add(self, vector: np.ndarray, question: str, answer: str) -> None:
+        self.vectors = np.vstack([self.vectors, vector[None, :]])
+        self.document_frequency += vector > 0
+        self.questions.append(question)
+        self.answers.append(answer)
+        self.last_used.append(time.time())
+    
+    def remove(self, index: int) -> None:
+        self.document_frequency -= self.vectors[index] > 0
+        self.vectors = np.delete(self.vectors, index, axis=0)
+        del self.questions[index], self.answers[index], self.last_used[index]
+
+
+class SemanticCache:
+    """Similarity-matched answers per (provider, framework, industry) scope."""
+    
+    def __init__(
+        self,
+        path: Optional[str] = SEMANTIC_CACHE_PATH,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        dimensions: int = SEMANTIC_CACHE_DIMENSIONS,
+        save_interval: float = 5.0,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self.vectorizer = HashingVectorizer(dimensions)
+        
+        self._scopes: Dict[Scope, _ScopeIndex] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Orders concurrent saves, newest snapshot last
+        self._dirty = False
+        self._last_save = 0.0
+        self._counters = {"hits": 0, "misses": 0, "added": 0, "evicted": 0}
+        
+        if path:
+            self.load()
+            atexit.register(self.save)
+    
+    @staticmethod
+    def scope(provider: str, framework: str, industry: str) -> Scope:
+        return (provider, framework, industry.strip().lower())
+    
+    def _similarities(self, index: _ScopeIndex, vector: np.ndarray) -> np.ndarray:
+        idf = index.idf()
+        matrix = index.vectors * idf
+        query = vector * idf
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        norms[norms == 0] = 1.0
+        return matrix @ query / norms
+    
+    def lookup(self, scope: Scope, question: str) -> Optional[Tuple[str, float]]:
+        """Return (answer, similarity) of the closest stored question above the threshold."""
+        vector = self.vectorizer.transform(question)
+        with self._lock:
+            index = self._scopes.get(scope)
+            if index is None or not len(index):
+                self._counters["misses"] += 1
+                metrics.cache_lookup("semantic", hit=False)
+                return None
+            
+            similarities = self._similarities(index, vector)
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold or substituted(question, index.questions[best]):
+                self._counters["misses"] += 1
+                metrics.cache_lookup("semantic", hit=False)
+                return None
+            
+            index.last_used[best] = time.time()
+            self._counters["hits"] += 1
+            metrics.cache_lookup("semantic", hit=True)
+            return index.answers[best], similarity
+    
+    def add(self, scope: Scope, question: str, answer: str) -> None:
+        """Store an answer, evicting the least recently used entries beyond max_entries."""
+        vector = self.vectorizer.transform(question)
+        with self._lock:
+            index = self._scopes.setdefault(scope, _ScopeIndex(self.vectorizer.dimensions))
+            index.add(vector, question, answer)
+            while len(index) > self.max_entries:
+                index.remove(int(np.argmin(index.last_used)))
+                self._counters["evicted"] += 1
+            self._counters["added"] += 1
+            self._dirty = True
+            due = time.monotonic() - self._last_save >= self.save_interval
+        if due:
+            self.save()
+    
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats: Dict[str, float] = dict(self._counters)
+            stats["scopes"] = len(self._scopes)
+            stats["entries"] = sum(len(index) for index in self._scopes.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+    
+    def save(self) -> None:
+        """Persist the index as one compressed .npz, the text stored next to the vectors as JSON.
+        
+        The file is written under a unique temporary name and moved into place, so
+        concurrent saves and a crash mid-write never leave a torn or mismatched index.
+        """
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                scopes = list(self._scopes.items())
+                arrays = {f"vectors_{i}": index.vectors for i, (_, index) in enumerate(scopes)}
+                metadata = [
+                    {
+                        "scope": list(scope),
+                        "questions": list(index.questions),
+                        "answers": list(index.answers),
+                        "last_used": list(index.last_used),
+                    }
+                    for scope, index in scopes
+                ]
+                self._dirty = False
+                self._last_save = time.monotonic()
+            
+            header = {"dimensions": self.vectorizer.dimensions, "version": self.vectorizer.version, "scopes": metadata}
+            arrays["metadata"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(self.path), suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez_compressed(f, **arrays)
+                os.replace(temp_path, f"{self.path}.npz")
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+    
+    def load(self) -> None:
+        if not os.path.exists(f"{self.path}.npz"):
+            return
+        with np.load(f"{self.path}.npz") as arrays:
+            if "metadata" not in arrays:
+                return  # Saved by an older release as a vector/JSON file pair; start a fresh index
+            metadata = json.loads(arrays["metadata"].tobytes().decode("utf-8"))
+            if (metadata.get("dimensions"), metadata.get("version", 1)) != (
+                self.vectorizer.dimensions, self.vectorizer.version
+            ):
+                return  # Vectors built differently; start a fresh index
+            
+            with self._lock:
+                for i, entry in enumerate(metadata["scopes"]):
+                    index = _ScopeIndex(self.vectorizer.dimensions)
+                    index.vectors = arrays[f"vectors_{i}"]
+                    index.document_frequency = (index.vectors > 0).sum(axis=0).astype(np.float32)
+                    index.questions = entry["questions"]
+                    index.answers = entry["answers"]
+                    index.last_used = entry["last_used"]
+                    self._scopes[tuple(entry["scope"])] = index
+
+
+_default_cache: Optional[SemanticCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Return the process-wide semantic cache, loading the saved index on first use."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SemanticCache()
+        return _default_cache
\ No newline at end of file
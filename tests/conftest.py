@@ -0,0 +1,75 @@
+"""
+Shared fixtures: a local mock chat-completions server and providers pointed at it.
+
+Settings are read from the environment when config is first imported, so the
+test defaults are set here before any project module loads. Caches, history
+and the warm store stay off so tests never touch the working copy.
+
+Created by: Saqeb Newaz
+"""
+
+import os
+import tempfile
+
+_state_dir = tempfile.mkdtemp(prefix="lean-ai-tests-")
+for _name, _value in {
+    "OPENAI_API_KEY": "test-key",
+    "ASI1_MINI_API_KEY": "test-key",
+    "RESPONSE_CACHE_ENABLED": "false",
+    "WARM_STORE_ENABLED": "false",
+    "SEMANTIC_CACHE_ENABLED": "false",
+    "HISTORY_ENABLED": "false",
+    "METRICS_ENABLED": "true",
+    "RETRY_BASE_DELAY": "0.01",
+    "RETRY_MAX_DELAY": "0.05",
+    "TOKEN_USAGE_LOG": os.path.join(_state_dir, "token_usage.jsonl"),
+    "JOBS_PATH": os.path.join(_state_dir, "jobs.sqlite3"),
+    "HISTORY_PATH": os.path.join(_state_dir, "history.sqlite3"),
+    "RESPONSE_CACHE_PATH": os.path.join(_state_dir, "responses.sqlite3"),
+}.items():
+    os.environ.setdefault(_name, _value)
+
+import pytest  # noqa: E402
+
+import circuit_breaker  # noqa: E402
+import http_pool  # noqa: E402
+import rate_limit  # noqa: E402
+from ai_providers import provider_registry  # noqa: E402
+from mock_server import MockServer, MockSettings  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_providers():
+    """Each test starts with new pools, limiters, breakers and provider instances."""
+    yield
+    provider_registry.invalidate()
+    http_pool.close_pools()
+    with rate_limit._limiters_lock:
+        rate_limit._limiters.clear()
+    with circuit_breaker._breakers_lock:
+        circuit_breaker._breakers.clear()
+
+
+@pytest.fixture
+def mock_server():
+    server = MockServer(settings=MockSettings(latency=0.01, jitter=0.0, completion_tokens=20)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def openai(mock_server, monkeypatch):
+    """An OpenAIProvider talking to the mock server, without the registry's wrappers."""
+    from chat_providers import OpenAIProvider
+    
+    monkeypatch.setenv("OPENAI_API_URL", mock_server.url)
+    return OpenAIProvider()
+
+
+@pytest.fixture
+def asi1(mock_server, monkeypatch):
+    from chat_providers import ASI1MiniProvider
+    
+    monkeypatch.setenv("ASI1_MINI_API_URL", mock_server.url)
+    return ASI1MiniProvider()
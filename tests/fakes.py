@@ -0,0 +1,82 @@
+"""
+In-process stand-in for a provider, for tests of the wrappers around providers.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+
+from ai_providers import AIProvider, ProviderConnectionError
+from cancellation import RequestCancelled, sleep
+
+
+class FakeProvider(AIProvider):
+    """Answers after ``delay`` seconds (streams ``chunks`` pieces, ``chunk_delay`` apart), or fails.
+    
+    Waits end at once when the current cancel token fires, as a real request's
+    socket would be shut down.
+    """
+    
+    def __init__(self, name="Fake", delay=0.0, fail=False, chunks=3, chunk_delay=0.0):
+        self.display_name = name
+        self.delay = delay
+        self.fail = fail
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self.cancelled = 0
+        self.threads = set()
+        self._lock = threading.Lock()
+    
+    def _started(self):
+        with self._lock:
+            self.calls += 1
+            self.threads.add(threading.get_ident())
+    
+    def _wait(self, seconds):
+        try:
+            sleep(seconds)
+        except RequestCancelled:
+            with self._lock:
+                self.cancelled += 1
+            raise
+    
+    def _answer(self, prompt):
+        """The answer "<name>: <prompt>", cut into ``chunks`` pieces."""
+        if self.fail:
+            raise ProviderConnectionError(self.display_name, "unreachable")
+        text = f"{self.display_name}: {prompt}"
+        return [text[len(text) * i // self.chunks:len(text) * (i + 1) // self.chunks] for i in range(self.chunks)]
+    
+    def call(self, prompt):
+        self._started()
+        self._wait(self.delay)
+        return "".join(self._answer(prompt))
+    
+    def stream(self, prompt):
+        self._started()
+        self._wait(self.delay)
+        for chunk in self._answer(prompt):
+            yield chunk
+            self._wait(self.chunk_delay)
+    
+    async def acall(self, prompt):
+        self._started()
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            with self._lock:
+                self.cancelled += 1
+            raise
+        return "".join(self._answer(prompt))
+    
+    async def astream(self, prompt):
+        self._started()
+        await asyncio.sleep(self.delay)
+        for chunk in self._answer(prompt):
+            yield chunk
+            await asyncio.sleep(self.chunk_delay)
+    
+    def request_fingerprint(self, prompt):
+        return f"{self.display_name}:{prompt}"
@@ -0,0 +1,137 @@
+"""
+HTTP API: status codes for failed requests, and SSE framing of streamed answers.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import functools
+import json
+
+import pytest
+from aiohttp import ClientTimeout
+from aiohttp.test_utils import TestClient, TestServer
+
+import api_server
+import main
+from ai_providers import ProviderTimeoutError
+from api_server import AssistantAPI
+from circuit_breaker import CircuitOpenError
+from tests.fakes import FakeProvider
+from tokens import fit_user_input
+
+QUESTION = {"framework": "5S", "industry": "Automotive", "question": "How do I start?"}
+
+
+class BrokenProvider(FakeProvider):
+    """Raises ``error`` before its first chunk, or after ``after`` chunks."""
+    
+    def __init__(self, error, after=0):
+        super().__init__(name="Broken", chunks=3)
+        self.error = error
+        self.after = after
+    
+    async def astream(self, prompt):
+        sent = 0
+        async for chunk in super().astream(prompt):
+            if sent == self.after:
+                raise self.error
+            sent += 1
+            yield chunk
+
+
+PROVIDERS = {
+    "fake": FakeProvider(),
+    "open": BrokenProvider(CircuitOpenError("Broken", 12)),
+    "slow": BrokenProvider(ProviderTimeoutError("Broken", "read timed out")),
+    "cut": BrokenProvider(ProviderTimeoutError("Broken", "read timed out"), after=1),
+    "bug": BrokenProvider(RuntimeError("boom"), after=2),
+}
+
+
+@pytest.fixture(autouse=True)
+def providers(monkeypatch):
+    monkeypatch.setattr(api_server, "get_shared_provider", lambda name: PROVIDERS[name])
+
+
+def request(path, body, api=None):
+    """POST ``body`` (a dict, or raw bytes) to a fresh app; (status, headers, text)."""
+    async def send():
+        client = TestClient(TestServer((api or AssistantAPI(default_provider="fake")).build_app()))
+        await client.start_server()
+        try:
+            data = body if isinstance(body, bytes) else json.dumps(body)
+            response = await client.post(path, data=data, timeout=ClientTimeout(total=10))
+            return response.status, response.headers, await response.text()
+        finally:
+            await client.close()
+    
+    return asyncio.run(send())
+
+
+def events(text):
+    """SSE frames as (event, data) pairs."""
+    frames = []
+    for frame in text.split("\n\n"):
+        if frame:
+            lines = dict(line.split(": ", 1) for line in frame.split("\n"))
+            frames.append((lines.get("event", "message"), json.loads(lines["data"])))
+    return frames
+
+
+def test_answer_as_json():
+    status, _, text = request("/v1/assistant", QUESTION)
+    assert status == 200
+    assert json.loads(text)["response"].startswith("Fake: ")
+
+
+@pytest.mark.parametrize("body", [{"framework": "5S"}, b"not json", [1, 2], {**QUESTION, "priority": "urgent"}])
+def test_malformed_requests_are_400(body):
+    status, _, text = request("/v1/assistant", body)
+    assert status == 400
+    assert json.loads(text)["error"]
+
+
+def test_oversized_body_is_413():
+    status, _, _ = request("/v1/assistant", {**QUESTION, "question": "x" * 2000}, AssistantAPI(max_body_bytes=1000))
+    assert status == 413
+
+
+def test_question_over_the_token_limit_is_413(monkeypatch):
+    monkeypatch.setattr(main, "fit_user_input", functools.partial(fit_user_input, max_tokens=5, overflow="reject"))
+    status, _, text = request("/v1/assistant", {**QUESTION, "question": "How do I start 5S in a plant with 3 shifts?"})
+    assert status == 413
+    assert "tokens" in json.loads(text)["error"]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_open_circuit_is_503_with_retry_after(stream):
+    status, headers, _ = request("/v1/assistant", {**QUESTION, "provider": "open", "stream": stream})
+    assert status == 503
+    assert headers["Retry-After"] == "12"
+
+
+def test_timeout_is_504():
+    status, _, _ = request("/v1/templates/kpi_metrics", {**QUESTION, "provider": "slow"})
+    assert status == 504
+
+
+def test_stream_is_sse_deltas_then_done():
+    status, headers, text = request("/v1/assistant", {**QUESTION, "stream": True})
+    
+    assert status == 200
+    assert headers["Content-Type"] == "text/event-stream"
+    frames = events(text)
+    assert [event for event, _ in frames] == ["message"] * 3 + ["done"]
+    assert "".join(data["delta"] for _, data in frames[:-1]).startswith("Fake: ")
+
+
+@pytest.mark.parametrize("provider, status", [("cut", 504), ("bug", 500)])
+def test_failure_mid_stream_ends_with_an_error_event(provider, status):
+    code, _, text = request("/v1/assistant", {**QUESTION, "provider": provider, "stream": True})
+    
+    assert code == 200  # Already sent with the first delta
+    frames = events(text)
+    assert frames[0][0] == "message"
+    assert frames[-1] == ("error", {"error": frames[-1][1]["error"], "status": status})
+    assert "done" not in [event for event, _ in frames]
@@ -0,0 +1,114 @@
+"""
+Batch runner: resuming after a kill, and stopping when the provider is unavailable.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from ai_providers import ProviderHTTPError
+from batch import BatchRunner, Checkpoint
+from circuit_breaker import CircuitOpenError
+from tests.fakes import FakeProvider
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FlakyProvider(FakeProvider):
+    """Rejects one question as a bad request, and has its circuit open from call ``down_from`` on."""
+    
+    def __init__(self, down_from=None, bad_question=None):
+        super().__init__()
+        self.down_from = down_from
+        self.bad_question = bad_question
+    
+    async def acall(self, prompt):
+        if self.down_from is not None and self.calls + 1 >= self.down_from:
+            raise CircuitOpenError(self.display_name, 30)
+        if self.bad_question and self.bad_question in prompt:
+            self.calls += 1
+            raise ProviderHTTPError(self.display_name, "bad request", 400)
+        return await super().acall(prompt)
+
+
+@pytest.fixture
+def questions(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    rows = [{"id": i, "framework": "5S", "industry": "Automotive", "question": f"Question {i}?"} for i in range(12)]
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+    return str(path), str(tmp_path / "answers.jsonl")
+
+
+def written(output_path):
+    with open(output_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_killed_run_resumes_without_duplicates_or_gaps(questions, mock_server, monkeypatch):
+    input_path, output_path = questions
+    mock_server.settings.latency = 0.2
+    env = dict(os.environ, OPENAI_API_URL=mock_server.url)
+    run = subprocess.Popen(
+        [sys.executable, "batch.py", input_path, output_path, "--provider", "openai", "--concurrency", "2"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    checkpoint = Checkpoint(f"{output_path}.ckpt", input_path)
+    deadline = time.monotonic() + 20
+    try:
+        while checkpoint.next_line < 4:
+            assert time.monotonic() < deadline and run.poll() is None, "the batch never got going"
+            time.sleep(0.05)
+            try:
+                checkpoint.load()
+            except ValueError:
+                pass  # Read while it was being replaced
+    finally:
+        run.send_signal(signal.SIGKILL)
+        run.wait()
+    with open(output_path, "ab") as out:
+        out.write(b'{"line": 99, "response": "torn wri')  # As if killed mid-write
+    
+    monkeypatch.setenv("OPENAI_API_URL", mock_server.url)
+    mock_server.settings.latency = 0.01
+    asyncio.run(BatchRunner(input_path, output_path, provider="openai", concurrency=4, report_every=100).run())
+    
+    rows = written(output_path)
+    assert [row["line"] for row in rows] == list(range(12))
+    assert all(row.get("response") and not row.get("error") for row in rows)
+
+
+def test_unavailable_provider_stops_the_run_before_the_row(questions):
+    input_path, output_path = questions
+    runner = BatchRunner(input_path, output_path, provider=FlakyProvider(down_from=4), concurrency=1, report_every=100)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(runner.run())
+    
+    assert [row["line"] for row in written(output_path)] == [0, 1, 2]
+    assert runner.checkpoint.next_line == 3
+    
+    # Resuming once the provider is back answers the rows the outage interrupted
+    asyncio.run(BatchRunner(input_path, output_path, provider=FakeProvider(), concurrency=4, report_every=100).run())
+    rows = written(output_path)
+    assert [row["line"] for row in rows] == list(range(12))
+    assert not any(row.get("error") for row in rows)
+
+
+def test_rejected_rows_are_written_with_their_error(questions):
+    input_path, output_path = questions
+    provider = FlakyProvider(bad_question="Question 5?")
+    asyncio.run(BatchRunner(input_path, output_path, provider=provider, concurrency=4, report_every=100).run())
+    
+    rows = written(output_path)
+    assert [row["line"] for row in rows] == list(range(12))
+    assert [row["line"] for row in rows if row.get("error")] == [5]
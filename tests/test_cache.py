@@ -0,0 +1,51 @@
+"""
+Response cache in front of the providers, sync and on the event loop.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+
+from cache import CachedProvider, ResponseCache
+
+
+class ThreadRecordingCache(ResponseCache):
+    """ResponseCache noting the threads its SQLite store is used from."""
+    
+    def __init__(self):
+        super().__init__(":memory:")
+        self.threads = set()
+    
+    def get(self, key):
+        self.threads.add(threading.get_ident())
+        return super().get(key)
+    
+    def put(self, key, response):
+        self.threads.add(threading.get_ident())
+        super().put(key, response)
+
+
+def test_repeat_call_is_served_from_cache(openai, mock_server):
+    provider = CachedProvider(openai, ResponseCache(":memory:"))
+    first = provider.call("What is kaizen?")
+    assert provider.call("What is kaizen?") == first
+    assert "".join(provider.stream("What is kaizen?")) == first
+    assert mock_server.stats.snapshot()["requests"] == 1
+
+
+def test_async_lookups_stay_off_the_event_loop(openai, mock_server):
+    cache = ThreadRecordingCache()
+    provider = CachedProvider(openai, cache)
+    
+    async def main():
+        loop_thread = threading.get_ident()
+        first = await provider.acall("What is kaizen?")
+        assert await provider.acall("What is kaizen?") == first
+        assert "".join([chunk async for chunk in provider.astream("What is muda?")])
+        assert [chunk async for chunk in provider.astream("What is muda?")]
+        return loop_thread
+    
+    loop_thread = asyncio.run(main())
+    assert cache.threads and loop_thread not in cache.threads
+    assert mock_server.stats.snapshot()["requests"] == 2
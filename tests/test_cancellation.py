@@ -0,0 +1,135 @@
+"""
+Cancelling in-flight provider calls and streams, blocking and on the event loop.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cancellation import CancelToken, RequestCancelled, cancellable
+from http_pool import close_async_sessions
+from main import run_assistant, stream_assistant
+from metrics import metrics
+
+PROMPT = "What is kaizen?"
+
+
+def cancelled(stage: str) -> float:
+    return sum(value for labels, value in metrics.cancellations.series.items() if ("stage", stage) in labels)
+
+
+def tokens_saved() -> float:
+    return sum(metrics.cancelled_tokens_saved.series.values())
+
+
+@pytest.fixture
+def slow(mock_server):
+    """The mock server takes 5 seconds to answer."""
+    mock_server.settings.latency = 5.0
+    return mock_server
+
+
+@pytest.fixture
+def trickle(mock_server):
+    """The mock server streams its 20 tokens over about 2 seconds."""
+    mock_server.settings.tokens_per_second = 10
+    return mock_server
+
+
+def cancel_after(seconds: float) -> CancelToken:
+    token = CancelToken()
+    threading.Timer(seconds, token.cancel).start()
+    return token
+
+
+def test_waiting_call_is_cancelled_at_once(openai, slow):
+    before, saved = cancelled("waiting"), tokens_saved()
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled), cancellable(cancel_after(0.2)):
+        openai.call(PROMPT)
+    
+    assert time.monotonic() - started < 1.5
+    assert cancelled("waiting") == before + 1
+    assert tokens_saved() > saved
+
+
+def test_stream_is_cancelled_mid_answer(openai, trickle):
+    before = cancelled("streaming")
+    token = CancelToken()
+    received = []
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled), cancellable(token):
+        for chunk in openai.stream(PROMPT):
+            received.append(chunk)
+            token.cancel()
+    
+    assert len(received) == 1
+    assert time.monotonic() - started < 1.5
+    assert cancelled("streaming") == before + 1
+
+
+def test_waiting_acall_is_cancelled_at_once(openai, slow):
+    before = cancelled("waiting")
+    
+    async def main():
+        try:
+            task = asyncio.ensure_future(openai.acall(PROMPT))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            started = time.monotonic()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return time.monotonic() - started
+        finally:
+            await close_async_sessions()
+    
+    assert asyncio.run(main()) < 0.5
+    assert cancelled("waiting") == before + 1
+
+
+def test_astream_is_cancelled_mid_answer(openai, trickle):
+    before = cancelled("streaming")
+    
+    async def read(received):
+        async for chunk in openai.astream(PROMPT):
+            received.append(chunk)
+    
+    async def main():
+        try:
+            received = []
+            task = asyncio.ensure_future(read(received))
+            while not received:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return received
+        finally:
+            await close_async_sessions()
+    
+    assert len(asyncio.run(main())) < 20
+    assert cancelled("streaming") == before + 1
+
+
+def test_run_assistant_cancel_token_reaches_the_provider(openai, slow):
+    started = time.monotonic()
+    answer = run_assistant("5S", "Automotive", "openai", PROMPT, cancel=cancel_after(0.2))
+    
+    assert answer == "Error: Request cancelled"  # run_assistant reports every failure as text
+    assert time.monotonic() - started < 1.5
+
+
+def test_stream_assistant_stops_when_its_token_is_cancelled(openai, trickle):
+    token = CancelToken()
+    chunks = stream_assistant("5S", "Automotive", "openai", PROMPT, cancel=token)
+    assert next(chunks)
+    
+    token.cancel()
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        list(chunks)
+    assert time.monotonic() - started < 1.5
@@ -0,0 +1,191 @@
+"""
+Circuit breaker transitions, on their own and around real requests to the mock server.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ai_providers import ProviderConnectionError, ProviderHTTPError, RateLimitError
+from cancellation import CancelToken, RequestCancelled, cancellable
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from http_pool import close_async_sessions
+
+OPEN_SECONDS = 0.2
+
+
+def make_breaker(**kwargs):
+    return CircuitBreaker("Test", min_requests=2, failure_threshold=0.5, open_seconds=OPEN_SECONDS, **kwargs)
+
+
+def opened(breaker):
+    for _ in range(breaker.min_requests):
+        breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    return breaker
+
+
+def half_open(breaker):
+    """Open ``breaker``, wait out the cool-down and return the probe id."""
+    opened(breaker)
+    time.sleep(OPEN_SECONDS)
+    probe = breaker.allow()
+    assert breaker.state == HALF_OPEN and probe is not None
+    return probe
+
+
+@pytest.fixture
+def breaker(openai, mock_server):
+    """A quick breaker in front of the mock server, which fails until told otherwise."""
+    openai.breaker = make_breaker()
+    mock_server.settings.error_rate = 1.0
+    mock_server.settings.error_status = 503
+    mock_server.settings.retry_after = 0
+    return openai.breaker
+
+
+def test_failures_open_the_circuit_and_it_rejects_at_once():
+    breaker = opened(make_breaker())
+    
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.allow()
+    assert 0 < excinfo.value.retry_after <= OPEN_SECONDS
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_one_probe_at_a_time_once_half_open():
+    breaker = make_breaker()
+    half_open(breaker)
+    
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_probe_success_closes_and_failure_reopens():
+    breaker = make_breaker()
+    half_open(breaker)
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["requests"] == 0  # A clean window after recovery
+    
+    half_open(breaker)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+
+@pytest.mark.parametrize("error", [
+    ProviderHTTPError("Test", "bad request", 400),
+    ProviderHTTPError("Test", "unauthorized", 401),
+    RateLimitError("Test", "slow down", 429),
+])
+def test_errors_that_say_nothing_about_health_are_neutral(error):
+    breaker = make_breaker()
+    breaker.record(error)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["requests"] == 0
+    
+    probe = half_open(breaker)
+    breaker.record(error, probe)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is not None  # The next probe may go
+
+
+def test_release_ignores_a_probe_that_was_replaced():
+    breaker = make_breaker(max_timeout=0.05)
+    stale = half_open(breaker)
+    time.sleep(0.1)
+    current = breaker.allow()  # The first probe never reported back
+    
+    breaker.release_probe(stale)
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.release_probe(current)
+    assert breaker.allow() is not None
+
+
+def test_outage_and_recovery_through_the_provider(openai, mock_server, breaker):
+    with pytest.raises(CircuitOpenError):
+        openai.call("What is kaizen?")  # Retries trip the breaker, and the next attempt is refused
+    sent = mock_server.stats.snapshot()["requests"]
+    assert sent == breaker.min_requests
+    
+    with pytest.raises(CircuitOpenError):
+        openai.call("What is kaizen?")
+    assert mock_server.stats.snapshot()["requests"] == sent
+    
+    time.sleep(OPEN_SECONDS)
+    mock_server.settings.error_rate = 0.0
+    assert openai.call("What is kaizen?")
+    assert breaker.state == CLOSED
+
+
+def test_bad_request_probe_makes_way_for_the_next(openai, mock_server, breaker):
+    with pytest.raises(CircuitOpenError):
+        openai.call("What is kaizen?")
+    time.sleep(OPEN_SECONDS)
+    
+    mock_server.settings.error_status = 400
+    with pytest.raises(ProviderHTTPError):
+        openai.call("What is kaizen?")
+    assert breaker.state == HALF_OPEN
+    
+    mock_server.settings.error_rate = 0.0
+    assert openai.call("What is kaizen?")
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_probe_makes_way_for_the_next(openai, mock_server, breaker):
+    with pytest.raises(CircuitOpenError):
+        openai.call("What is kaizen?")
+    time.sleep(OPEN_SECONDS)
+    mock_server.settings.error_rate = 0.0
+    mock_server.settings.latency = 5.0
+    
+    token = CancelToken()
+    threading.Timer(0.2, token.cancel).start()
+    with pytest.raises(RequestCancelled), cancellable(token):
+        openai.call("What is kaizen?")
+    assert breaker.state == HALF_OPEN
+    
+    mock_server.settings.latency = 0.01
+    assert openai.call("What is kaizen?")
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_async_probe_makes_way_for_the_next(openai, mock_server, breaker):
+    with pytest.raises(CircuitOpenError):
+        openai.call("What is kaizen?")
+    time.sleep(OPEN_SECONDS)
+    mock_server.settings.error_rate = 0.0
+    mock_server.settings.latency = 5.0
+    
+    async def main():
+        try:
+            task = asyncio.ensure_future(openai.acall("What is kaizen?"))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert breaker.state == HALF_OPEN
+            
+            mock_server.settings.latency = 0.01
+            return await openai.acall("What is kaizen?")
+        finally:
+            await close_async_sessions()
+    
+    assert asyncio.run(main())
+    assert breaker.state == CLOSED
+
+
+def test_unreachable_provider_trips_the_breaker(openai):
+    openai.breaker = make_breaker()
+    openai.api_url = "http://127.0.0.1:9/v1/chat/completions"  # Nothing listens on the discard port
+    
+    with pytest.raises((CircuitOpenError, ProviderConnectionError)):
+        openai.call("What is kaizen?")
+    assert openai.breaker.state == OPEN
@@ -0,0 +1,183 @@
+"""
+Sharing of identical in-flight calls and streams, and leaving a shared request.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cancellation import CancelToken, RequestCancelled, cancellable
+from coalesce import CoalescingProvider
+from tests.fakes import FakeProvider
+
+
+def cancel_after(seconds):
+    token = CancelToken()
+    threading.Timer(seconds, token.cancel).start()
+    return token
+
+
+def in_threads(function, count):
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        futures = [pool.submit(function) for _ in range(count)]
+        time.sleep(0.05)  # Let every caller join before the answer lands
+        return [future.result() for future in futures]
+
+
+def test_identical_calls_share_one_request():
+    upstream = FakeProvider(delay=0.2)
+    provider = CoalescingProvider(upstream)
+    answers = in_threads(lambda: provider.call("q"), 8)
+    assert answers == ["Fake: q"] * 8
+    assert upstream.calls == 1
+    assert provider.coalescing_stats()["coalesced"] == 7
+
+
+def test_identical_streams_share_one_request():
+    upstream = FakeProvider(delay=0.1, chunks=4, chunk_delay=0.05)
+    provider = CoalescingProvider(upstream)
+    answers = in_threads(lambda: list(provider.stream("q")), 6)
+    # Late joiners replay the chunks already received, so everyone gets every chunk
+    assert all("".join(chunks) == "Fake: q" and len(chunks) == 4 for chunks in answers)
+    assert upstream.calls == 1
+
+
+def test_a_call_does_not_join_a_stream():
+    upstream = FakeProvider(delay=0.05, chunks=4, chunk_delay=0.1)
+    provider = CoalescingProvider(upstream)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        stream = pool.submit(lambda: list(provider.stream("q")))
+        time.sleep(0.1)  # The stream has started delivering chunks
+        assert provider.call("q") == "Fake: q"
+        assert "".join(stream.result()) == "Fake: q"
+    assert upstream.calls == 2
+
+
+def test_a_cancelled_follower_stops_waiting():
+    upstream = FakeProvider(delay=1.0)
+    provider = CoalescingProvider(upstream)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(provider.call, "q")
+        time.sleep(0.05)
+        started = time.monotonic()
+        with cancellable(cancel_after(0.1)), pytest.raises(RequestCancelled):
+            provider.call("q")
+        assert time.monotonic() - started < 0.5
+        # The shared request carries on for the leader
+        assert leader.result() == "Fake: q"
+    assert upstream.cancelled == 0
+
+
+def test_a_cancelled_stream_follower_stops_waiting():
+    upstream = FakeProvider(delay=1.0, chunks=2)
+    provider = CoalescingProvider(upstream)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(lambda: list(provider.stream("q")))
+        time.sleep(0.05)
+        with cancellable(cancel_after(0.1)), pytest.raises(RequestCancelled):
+            list(provider.stream("q"))
+        assert "".join(leader.result()) == "Fake: q"
+
+
+def test_a_cancelled_leader_returns_at_once_and_the_others_keep_the_request():
+    upstream = FakeProvider(delay=0.5)
+    provider = CoalescingProvider(upstream)
+    
+    def follower():
+        time.sleep(0.02)  # Joins once the leader below has started the request
+        return provider.call("q")
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        started = time.monotonic()
+        followers = [pool.submit(follower) for _ in range(2)]
+        with cancellable(cancel_after(0.1)), pytest.raises(RequestCancelled):
+            provider.call("q")
+        assert time.monotonic() - started < 0.3
+        assert [follower.result() for follower in followers] == ["Fake: q"] * 2
+    assert upstream.calls == 1 and upstream.cancelled == 0
+
+
+def test_request_is_aborted_once_everyone_has_left():
+    upstream = FakeProvider(delay=5.0)
+    provider = CoalescingProvider(upstream)
+    token = cancel_after(0.1)
+    
+    def call():
+        with cancellable(token):
+            return provider.call("q")
+    
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(call) for _ in range(3)]
+        for future in futures:
+            with pytest.raises(RequestCancelled):
+                future.result()
+    assert time.monotonic() - started < 1.0
+    assert upstream.cancelled == 1
+
+
+def test_stream_pumps_use_a_bounded_pool():
+    upstream = FakeProvider(delay=0.05, chunks=2, chunk_delay=0.05)
+    provider = CoalescingProvider(upstream, stream_workers=2)
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        answers = list(pool.map(lambda i: "".join(provider.stream(f"q{i}")), range(6)))
+    assert answers == [f"Fake: q{i}" for i in range(6)]
+    assert len(upstream.threads) <= 2
+
+
+def test_async_calls_share_one_request_and_followers_can_be_cancelled():
+    upstream = FakeProvider(delay=0.5)
+    provider = CoalescingProvider(upstream)
+    
+    async def follower():
+        with cancellable(cancel_after(0.1)):
+            return await provider.acall("q")
+    
+    async def main():
+        leader = asyncio.ensure_future(provider.acall("q"))
+        await asyncio.sleep(0.01)
+        joined = asyncio.ensure_future(provider.acall("q"))
+        cancelled = asyncio.ensure_future(follower())
+        return await asyncio.gather(leader, joined, cancelled, return_exceptions=True)
+    
+    leader, joined, cancelled = asyncio.run(main())
+    assert leader == joined == "Fake: q"
+    assert isinstance(cancelled, RequestCancelled)
+    assert upstream.calls == 1
+
+
+def test_async_streams_share_one_request():
+    upstream = FakeProvider(delay=0.1, chunks=3, chunk_delay=0.02)
+    provider = CoalescingProvider(upstream)
+    
+    async def collect():
+        return "".join([chunk async for chunk in provider.astream("q")])
+    
+    async def main():
+        return await asyncio.gather(*(collect() for _ in range(4)))
+    
+    assert asyncio.run(main()) == ["Fake: q"] * 4
+    assert upstream.calls == 1
+
+
+def test_a_cancelled_async_leader_leaves_the_others_one_request():
+    upstream = FakeProvider(delay=0.3)
+    provider = CoalescingProvider(upstream)
+    
+    async def main():
+        leader = asyncio.ensure_future(provider.acall("q"))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.ensure_future(provider.acall("q")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+    
+    assert asyncio.run(main()) == ["Fake: q"] * 2
+    assert upstream.calls == 1 and upstream.cancelled == 0
@@ -0,0 +1,47 @@
+"""
+Answer history in front of the providers, sync and on the event loop.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+
+from history import HistoryProvider, HistoryStore
+from tests.fakes import FakeProvider
+
+
+class ThreadRecordingStore(HistoryStore):
+    """HistoryStore noting the threads answers are written from."""
+    
+    def __init__(self):
+        super().__init__(":memory:")
+        self.threads = set()
+    
+    def record(self, *args, **kwargs):
+        self.threads.add(threading.get_ident())
+        return super().record(*args, **kwargs)
+
+
+def test_answers_are_recorded_and_searchable():
+    store = HistoryStore(":memory:")
+    provider = HistoryProvider(FakeProvider(), store)
+    provider.call("What is kaizen?")
+    "".join(provider.stream("What is heijunka?"))
+    
+    assert [store.get(entry["id"])["response"] for entry in store.search("heijunka")] == ["Fake: What is heijunka?"]
+    assert store.stats()["entries"] == 2
+
+
+def test_async_writes_stay_off_the_event_loop():
+    store = ThreadRecordingStore()
+    provider = HistoryProvider(FakeProvider(), store)
+    
+    async def main():
+        await provider.acall("What is kaizen?")
+        assert [chunk async for chunk in provider.astream("What is muda?")]
+        return threading.get_ident()
+    
+    loop_thread = asyncio.run(main())
+    assert len(store.recent()) == 2
+    assert store.threads and loop_thread not in store.threads
@@ -0,0 +1,33 @@
+"""
+Connection reuse of the shared keep-alive pools.
+
+Created by: Saqeb Newaz
+"""
+
+from http_pool import pool_stats
+
+
+def test_calls_share_one_connection(openai, mock_server):
+    for _ in range(5):
+        assert openai.call("What is kaizen?")
+    
+    stats = next(iter(pool_stats(mock_server.url).values()))
+    assert stats["requests"] == 5
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 4
+    assert stats["idle_connections"] == 1
+    assert mock_server.stats.snapshot()["connections"] == 1
+
+
+def test_reconnects_are_counted(openai, mock_server):
+    openai.call("What is kaizen?")
+    for key in list(openai.transport.adapter.poolmanager.pools.keys()):
+        pool = openai.transport.adapter.poolmanager.pools[key]
+        for conn in list(pool.pool.queue):
+            if conn is not None:
+                conn.close()  # The server dropped the idle connection
+    openai.call("What is kaizen?")
+    
+    stats = next(iter(pool_stats(mock_server.url).values()))
+    assert stats["connections_opened"] == 2
+    assert stats["connections_opened"] == mock_server.stats.snapshot()["connections"]
@@ -0,0 +1,50 @@
+"""
+Cold start of the CLI: the HTTP clients, NumPy and tiktoken load on demand only.
+
+Created by: Saqeb Newaz
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import import_budget
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("requests", "numpy", "aiohttp", "tiktoken", "dotenv")
+
+
+def imported_modules(*args: str) -> set:
+    """Every module a fresh ``python -X importtime <args>`` imports."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        env=dict(os.environ, ENV_FILE=""),
+        timeout=60,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return {
+        line.rsplit("|", 1)[1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and "cumulative" not in line
+    }
+
+
+def test_cli_help_skips_heavy_modules():
+    imported = imported_modules("main.py", "--help")
+    
+    assert "config" in imported
+    assert sorted(name for name in HEAVY if name in imported) == []
+
+
+@pytest.mark.parametrize("module", sorted(import_budget.BUDGETS))
+def test_entry_modules_skip_on_demand_modules(module):
+    _, forbidden = import_budget.BUDGETS[module]
+    imported = imported_modules("-c", f"import {module}")
+    
+    assert sorted(name for name in forbidden if name in imported) == []
@@ -0,0 +1,129 @@
+"""
+Background job queue: per-session tenants, cancellation and re-claiming stale jobs.
+
+Created by: Saqeb Newaz
+"""
+
+import threading
+import time
+
+import pytest
+
+import main
+from cancellation import cancellable, sleep
+from jobs import JobQueue, JobStore
+from scheduler import current_scheduling
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def assistant(monkeypatch):
+    """Replace stream_assistant with one that waits ``delay`` before its first chunk."""
+    seen = {"delay": 0.0, "runs": 0, "tenants": []}
+    
+    def stream_assistant(framework, industry, provider, user_input, cancel=None):
+        seen["runs"] += 1
+        seen["tenants"].append(current_scheduling()[1])
+        with cancellable(cancel):
+            sleep(seen["delay"])
+        yield f"answer: {user_input}"
+    
+    monkeypatch.setattr(main, "stream_assistant", stream_assistant)
+    return seen
+
+
+def test_jobs_are_scheduled_per_session(store, assistant):
+    queue = JobQueue(store, workers=1).start()
+    first = queue.submit("5S", "Automotive", "openai", "a", session="tab-1")
+    second = queue.submit("5S", "Automotive", "openai", "b", session="tab-2")
+    wait_for(lambda: store.get(second)["status"] == "done")
+    
+    assert store.get(first)["output"] == "answer: a"
+    assert assistant["tenants"] == ["tab-1", "tab-2"]
+
+
+def test_older_job_databases_gain_a_session(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = JobStore(path)
+    store._db.execute("ALTER TABLE jobs DROP COLUMN session")
+    store._db.execute(
+        "INSERT INTO jobs (id, status, provider, framework, industry, question, created_at, updated_at)"
+        " VALUES ('old', 'queued', 'openai', '5S', 'Automotive', 'q', 0, 0)"
+    )
+    store._db.commit()
+    store.close()
+    
+    assert JobStore(path).claim()["session"] == "web"
+
+
+def test_cancel_queued_job_never_runs(store, assistant):
+    job_id = store.submit("5S", "Automotive", "openai", "q")
+    JobQueue(store, workers=0).cancel(job_id)
+    
+    assert store.get(job_id)["status"] == "cancelled"
+    assert store.claim() is None
+    assert assistant["runs"] == 0
+
+
+def test_cancel_running_job_stops_it_at_once(store, assistant):
+    assistant["delay"] = 30.0
+    queue = JobQueue(store, workers=1).start()
+    job_id = queue.submit("5S", "Automotive", "openai", "q")
+    wait_for(lambda: assistant["runs"] == 1)
+    
+    started = time.monotonic()
+    queue.cancel(job_id)
+    wait_for(lambda: store.get(job_id)["status"] == "cancelled")
+    
+    assert time.monotonic() - started < 2.0
+
+
+def test_silent_running_job_is_reclaimed_once_stale(store):
+    job_id = store.submit("5S", "Automotive", "openai", "q")
+    assert store.claim()["id"] == job_id
+    assert store.claim(stale_seconds=0.2) is None
+    
+    time.sleep(0.3)
+    assert store.claim(stale_seconds=0.2)["id"] == job_id
+
+
+def test_heartbeat_keeps_job_waiting_for_first_chunk_from_being_reclaimed(store, assistant):
+    assistant["delay"] = 1.0
+    queue = JobQueue(store, workers=1, heartbeat_interval=0.05).start()
+    job_id = queue.submit("5S", "Automotive", "openai", "q")
+    wait_for(lambda: assistant["runs"] == 1)
+    
+    # Another process polling the same database with a short stale timeout
+    reclaimed = []
+    deadline = time.monotonic() + 0.8
+    while time.monotonic() < deadline:
+        job = store.claim(stale_seconds=0.3)
+        if job is not None:
+            reclaimed.append(job["id"])
+        time.sleep(0.05)
+    wait_for(lambda: store.get(job_id)["status"] == "done")
+    
+    assert reclaimed == []
+    assert assistant["runs"] == 1
+
+
+def test_job_cancelled_from_another_process_stops(store, assistant):
+    assistant["delay"] = 30.0
+    queue = JobQueue(store, workers=1).start()
+    job_id = queue.submit("5S", "Automotive", "openai", "q")
+    wait_for(lambda: assistant["runs"] == 1)
+    
+    # The reaper notices the flag another process set in the database
+    threading.Thread(target=JobStore(store.path).cancel, args=(job_id,)).start()
+    wait_for(lambda: store.get(job_id)["status"] == "cancelled")
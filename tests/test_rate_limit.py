@@ -0,0 +1,122 @@
+"""
+Rate limiting, retries and typed errors of the chat-completions providers.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from ai_providers import ProviderHTTPError, RateLimitError
+from cancellation import CancelToken, RequestCancelled, cancellable
+from config import RETRY_MAX_ATTEMPTS
+from http_pool import close_async_sessions
+from rate_limit import RateLimiter, TokenBucket, backoff_delay, parse_retry_after
+
+
+def always_fail(mock_server, status):
+    mock_server.settings.error_rate = 1.0
+    mock_server.settings.error_status = status
+    mock_server.settings.retry_after = 0
+
+
+@pytest.fixture
+def throttled(openai):
+    """A limiter already cut as far as it goes, so further 429s leave the bucket size alone."""
+    limiter = RateLimiter("OpenAI", requests_per_minute=60000, tokens_per_minute=100000)
+    while limiter.scale > limiter.min_scale:
+        limiter.on_rate_limited()
+    openai.rate_limiter = limiter
+    return limiter
+
+
+def test_bucket_waits_once_empty():
+    bucket = TokenBucket(60)  # One token per second
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(2) == pytest.approx(2.0, abs=0.05)
+
+
+def drained_limiter():
+    """A limiter whose token bucket was just emptied, so the next reservation waits about 6 seconds."""
+    limiter = RateLimiter("Test", tokens_per_minute=6000)
+    limiter.acquire(6000)
+    return limiter
+
+
+def test_cancelled_wait_is_refunded():
+    limiter = drained_limiter()
+    token = CancelToken()
+    threading.Timer(0.1, token.cancel).start()
+    
+    with cancellable(token), pytest.raises(RequestCancelled):
+        limiter.acquire(600)
+    assert limiter.tokens.available >= 0
+
+
+def test_cancelled_async_wait_is_refunded():
+    limiter = drained_limiter()
+    
+    async def main():
+        task = asyncio.ensure_future(limiter.acquire_async(600))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    
+    asyncio.run(main())
+    assert limiter.tokens.available >= 0
+
+
+def test_retry_after_and_backoff():
+    assert parse_retry_after({"Retry-After": "3"}) == 3.0
+    assert parse_retry_after({}) is None
+    assert backoff_delay(1, retry_after=0.04) >= 0.04
+
+
+def test_rate_limited_attempts_are_refunded(openai, mock_server, throttled):
+    always_fail(mock_server, 429)
+    
+    with pytest.raises(RateLimitError):
+        openai.call("What is kaizen?")
+    
+    assert mock_server.stats.snapshot()["requests"] == RETRY_MAX_ATTEMPTS
+    assert throttled.tokens.capacity == 10000
+    assert throttled.tokens.available == pytest.approx(throttled.tokens.capacity)
+
+
+def test_server_errors_are_refunded(openai, mock_server):
+    always_fail(mock_server, 503)
+    bucket = openai.rate_limiter.tokens
+    
+    with pytest.raises(ProviderHTTPError) as excinfo:
+        list(openai.stream("What is kaizen?"))
+    
+    assert excinfo.value.status_code == 503
+    assert mock_server.stats.snapshot()["requests"] == RETRY_MAX_ATTEMPTS
+    assert bucket.available == pytest.approx(bucket.capacity)
+
+
+def test_async_rate_limited_attempts_are_refunded(openai, mock_server, throttled):
+    always_fail(mock_server, 429)
+    
+    async def main():
+        try:
+            await openai.acall("What is kaizen?")
+        finally:
+            await close_async_sessions()
+    
+    with pytest.raises(RateLimitError):
+        asyncio.run(main())
+    assert mock_server.stats.snapshot()["requests"] == RETRY_MAX_ATTEMPTS
+    assert throttled.tokens.available == pytest.approx(throttled.tokens.capacity)
+
+
+def test_client_errors_are_not_retried(openai, mock_server):
+    always_fail(mock_server, 400)
+    
+    with pytest.raises(ProviderHTTPError):
+        openai.call("What is kaizen?")
+    assert mock_server.stats.snapshot()["requests"] == 1
+    assert openai.rate_limiter.tokens.available == pytest.approx(openai.rate_limiter.tokens.capacity)
@@ -0,0 +1,97 @@
+"""
+Latency-aware routing, failover and hedged requests of the "auto" provider.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cancellation import CancelToken, RequestCancelled, cancellable
+from routing import RoutingProvider
+from tests.fakes import FakeProvider
+
+
+def router(*providers, **kwargs):
+    kwargs.setdefault("hedge_min_delay", 0.1)
+    kwargs.setdefault("hedge_budget", 1.0)
+    return RoutingProvider(list(providers), **kwargs)
+
+
+def test_fingerprint_is_apart_from_every_member():
+    first, second = FakeProvider("A"), FakeProvider("B")
+    auto = router(first, second)
+    key = auto.request_fingerprint("question")
+    assert key == auto.request_fingerprint("question")
+    assert key not in (first.request_fingerprint("question"), second.request_fingerprint("question"))
+
+
+def test_fast_primary_is_not_hedged():
+    first, second = FakeProvider("A", 0.01), FakeProvider("B")
+    auto = router(first, second)
+    assert auto.call("q") == "A: q"
+    assert second.calls == 0
+    assert auto.stats()["hedged"] == 0
+
+
+def test_primary_runs_on_the_callers_thread():
+    first, second = FakeProvider("A", 0.01), FakeProvider("B")
+    router(first, second).call("q")
+    assert first.threads == {threading.get_ident()}
+
+
+def test_slow_primary_is_hedged_and_aborted():
+    first, second = FakeProvider("A", 5.0), FakeProvider("B", 0.01)
+    auto = router(first, second)
+    started = time.monotonic()
+    assert auto.call("q") == "B: q"
+    assert time.monotonic() - started < 1.0
+    assert first.cancelled == 1
+    assert auto.stats()["hedge_wins"] == 1
+    # The loser took at least the hedge delay; that is recorded, as a lower bound
+    assert auto.health["A"].sample_count() == 1
+
+
+def test_primary_error_fails_over():
+    first, second = FakeProvider("A", fail=True), FakeProvider("B")
+    auto = router(first, second)
+    assert auto.call("q") == "B: q"
+    assert auto.stats()["failovers"] == 1
+    assert auto.health["A"].error_rate() == 1.0
+
+
+def test_cancelled_call_records_no_latency():
+    first, second = FakeProvider("A", 5.0), FakeProvider("B", 5.0)
+    auto = router(first, second, hedge_min_delay=0.05)
+    token = CancelToken()
+    threading.Timer(0.2, token.cancel).start()
+    started = time.monotonic()
+    with cancellable(token), pytest.raises(RequestCancelled):
+        auto.call("q")
+    assert time.monotonic() - started < 1.0
+    auto.executor.shutdown(wait=True)  # The duplicate was aborted too
+    assert first.cancelled == 1 and second.cancelled == 1
+    assert auto.health["A"].sample_count() == 0
+    assert auto.health["B"].sample_count() == 0
+
+
+def test_concurrency_is_not_capped_by_the_hedge_pool():
+    first, second = FakeProvider("A", 0.3), FakeProvider("B", 0.3)
+    auto = router(first, second, hedge=True, hedge_min_delay=10.0, hedge_workers=2)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=40) as callers:
+        answers = list(callers.map(auto.call, [str(i) for i in range(40)]))
+    assert len(answers) == 40
+    assert time.monotonic() - started < 1.5
+
+
+def test_async_hedge_records_the_loser():
+    first, second = FakeProvider("A", 5.0), FakeProvider("B", 0.01)
+    auto = router(first, second)
+    assert asyncio.run(auto.acall("q")) == "B: q"
+    assert auto.health["A"].sample_count() == 1
+    assert auto.stats()["hedge_wins"] == 1
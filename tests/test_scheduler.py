@@ -0,0 +1,172 @@
+"""
+Scheduler slots: priority order, per-tenant turns, the bulk share, shedding and cancellation.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cancellation import CancelToken, RequestCancelled, cancellable
+from scheduler import RequestShedError, Scheduler, SchedulingProvider, scheduling
+from tests.fakes import FakeProvider
+
+NO_DEADLINES = {"interactive": 0, "normal": 0, "bulk": 0}
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def waiting(scheduler: Scheduler) -> int:
+    return sum(scheduler.stats()["waiting"].values())
+
+
+def admission_order(scheduler: Scheduler, requests) -> list:
+    """Queue ``requests`` ((priority, tenant, label), ...) behind a held slot; the order they get it."""
+    order = []
+    
+    def take(priority, tenant, label):
+        with scheduler.slot(priority, tenant):
+            order.append(label)
+    
+    scheduler.acquire("interactive", "holder")
+    threads = []
+    for queued, request in enumerate(requests, 1):
+        thread = threading.Thread(target=take, args=request)
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: waiting(scheduler) == queued)  # Enqueued in exactly this order
+    scheduler.release("interactive")
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_higher_priority_classes_go_first():
+    scheduler = Scheduler("Test", max_concurrency=1, max_wait=NO_DEADLINES)
+    order = admission_order(scheduler, [
+        ("bulk", "batch", "bulk"),
+        ("normal", "cli", "normal"),
+        ("interactive", "web", "interactive"),
+    ])
+    assert order == ["interactive", "normal", "bulk"]
+
+
+def test_tenants_take_turns_within_a_class():
+    scheduler = Scheduler("Test", max_concurrency=1, max_wait=NO_DEADLINES)
+    order = admission_order(scheduler, [
+        ("interactive", "a", "a1"),
+        ("interactive", "a", "a2"),
+        ("interactive", "a", "a3"),
+        ("interactive", "b", "b1"),
+        ("interactive", "c", "c1"),
+    ])
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_bulk_fills_only_its_share_and_leaves_room_for_interactive():
+    scheduler = Scheduler("Test", max_concurrency=4, bulk_share=0.5, max_wait=NO_DEADLINES)
+    scheduler.acquire("bulk", "batch")
+    scheduler.acquire("bulk", "batch")
+    blocked = threading.Thread(target=scheduler.acquire, args=("bulk", "batch"))
+    blocked.start()
+    wait_for(lambda: waiting(scheduler) == 1)
+    
+    scheduler.acquire("interactive", "web")  # Admitted at once
+    scheduler.acquire("interactive", "web")
+    assert scheduler.stats()["running"] == {"interactive": 2, "normal": 0, "bulk": 2}
+    
+    scheduler.release("bulk")
+    blocked.join(5)
+    assert scheduler.stats()["running"]["bulk"] == 2
+
+
+def test_requests_past_their_deadline_are_shed():
+    scheduler = Scheduler("Test", max_concurrency=1, max_wait={"interactive": 0.1, "normal": 0, "bulk": 0})
+    scheduler.acquire("interactive", "holder")
+    
+    started = time.monotonic()
+    with pytest.raises(RequestShedError) as excinfo:
+        scheduler.acquire("interactive", "web")
+    assert 0.1 <= time.monotonic() - started < 1.0
+    assert excinfo.value.priority == "interactive"
+    assert excinfo.value.retry_after == 1.0
+    
+    stats = scheduler.stats()
+    assert stats["shed"] == 1 and waiting(scheduler) == 0
+    scheduler.release("interactive")
+    assert scheduler.stats()["running"]["interactive"] == 0  # The shed request never held a slot
+
+
+def test_bulk_without_a_deadline_waits_it_out():
+    scheduler = Scheduler("Test", max_concurrency=1, max_wait={"interactive": 0.05, "normal": 0.05, "bulk": 0})
+    scheduler.acquire("interactive", "holder")
+    threading.Timer(0.3, scheduler.release, args=("interactive",)).start()
+    
+    scheduler.acquire("bulk", "batch")  # Longer than any deadline, but bulk has none
+    assert scheduler.stats()["shed"] == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = Scheduler("Test", max_concurrency=1, max_wait=NO_DEADLINES)
+    scheduler.acquire("interactive", "holder")
+    token = CancelToken()
+    threading.Timer(0.1, token.cancel).start()
+    
+    with pytest.raises(RequestCancelled), cancellable(token):
+        scheduler.acquire("interactive", "web")
+    assert waiting(scheduler) == 0
+    
+    scheduler.release("interactive")
+    assert scheduler.stats()["running"]["interactive"] == 0
+
+
+def test_async_waiters_are_shed_and_cancelled():
+    scheduler = Scheduler("Test", max_concurrency=1, max_wait={"interactive": 0.1, "normal": 0, "bulk": 0})
+    scheduler.acquire("interactive", "holder")
+    
+    async def main():
+        with pytest.raises(RequestShedError):
+            await scheduler.acquire_async("interactive", "web")
+        
+        task = asyncio.ensure_future(scheduler.acquire_async("bulk", "batch"))
+        await asyncio.sleep(0.05)
+        assert waiting(scheduler) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    
+    asyncio.run(main())
+    assert waiting(scheduler) == 0
+    scheduler.release("interactive")
+    assert scheduler.stats()["running"] == {"interactive": 0, "normal": 0, "bulk": 0}
+
+
+def test_interactive_calls_overtake_a_bulk_backlog():
+    scheduler = Scheduler("Test", max_concurrency=2, bulk_share=0.5, max_wait=NO_DEADLINES)
+    provider = SchedulingProvider(FakeProvider(delay=0.05), scheduler)
+    
+    def bulk():
+        with scheduling("bulk", tenant="warm_store"):
+            provider.call("bulk question")
+    
+    backlog = [threading.Thread(target=bulk) for _ in range(10)]
+    for thread in backlog:
+        thread.start()
+    wait_for(lambda: waiting(scheduler) >= 5)
+    
+    started = time.monotonic()
+    with scheduling("interactive", tenant="web"):
+        provider.call("What is kaizen?")
+    # The free slot the bulk share leaves is taken at once, not after the queued bulk calls
+    assert time.monotonic() - started < 0.3
+    for thread in backlog:
+        thread.join(5)
+    assert scheduler.stats()["admitted"] == 11
@@ -0,0 +1,111 @@
+"""
+Semantic cache matching: paraphrases must hit, questions that ask something else must miss.
+
+Created by: Saqeb Newaz
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from semantic_cache import SemanticCache, substituted
+
+SCOPE = SemanticCache.scope("OpenAI", "Toyota Production System (TPS)", "Automotive")
+
+PARAPHRASES = [
+    ("reduce waste on assembly line", "cut waste in my assembly line"),
+    ("How do I implement kanban between assembly and paint shop?",
+     "How can we implement kanban between the assembly line and the paint shop?"),
+    ("How to reduce changeover time on stamping presses?", "How can I reduce changeover times on our stamping presses"),
+    ("What KPIs should I track for OEE?", "Which KPIs should we track for OEE"),
+    ("How can I lower scrap rates in injection molding?", "How to reduce the scrap rate in injection molding"),
+]
+
+NEAR_MISSES = [
+    ("How do I implement kanban between assembly and paint shop?",
+     "How do I remove kanban between assembly and paint shop?"),
+    ("How do I implement kanban between assembly and paint shop?",
+     "How do I implement kanban between assembly and body shop?"),
+    ("How do I increase inventory buffers before final assembly?",
+     "How do I reduce inventory buffers before final assembly?"),
+    ("How to start daily gemba walks in the plant?", "How to stop daily gemba walks in the plant?"),
+    ("How to run the line with andon cords?", "How to run the line without andon cords?"),
+    ("Should we outsource maintenance of the presses?", "Should we insource maintenance of the presses?"),
+]
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache(path=None)
+    # Every stored question is in the same scope, as in a busy deployment
+    for stored, _ in PARAPHRASES + NEAR_MISSES:
+        if cache.lookup(SCOPE, stored) is None:
+            cache.add(SCOPE, stored, f"answer to: {stored}")
+    return cache
+
+
+@pytest.mark.parametrize("stored, asked", PARAPHRASES)
+def test_paraphrases_hit(cache, stored, asked):
+    hit = cache.lookup(SCOPE, asked)
+    assert hit is not None
+    assert hit[0] == f"answer to: {stored}"
+
+
+@pytest.mark.parametrize("stored, asked", NEAR_MISSES)
+def test_near_misses_miss(cache, stored, asked):
+    assert cache.lookup(SCOPE, asked) is None
+
+
+@pytest.mark.parametrize("stored, asked", NEAR_MISSES[:1] + NEAR_MISSES[2:])
+def test_intent_alone_keeps_near_misses_below_threshold(stored, asked):
+    # Without the substitution check, the intent weights must still keep these apart
+    cache = SemanticCache(path=None)
+    cache.add(SCOPE, stored, "answer")
+    vector = cache.vectorizer.transform(asked)
+    assert cache._similarities(cache._scopes[SCOPE], vector)[0] < cache.threshold
+
+
+def test_substitution_is_not_insertion():
+    assert substituted("kanban between assembly and body shop", "kanban between assembly and paint shop")
+    assert not substituted("kanban between the assembly line and paint shop", "kanban between assembly and paint shop")
+
+
+def test_scopes_do_not_share_answers(cache):
+    other = SemanticCache.scope("OpenAI", "Lean Six Sigma (LSS)", "Automotive")
+    assert cache.lookup(other, PARAPHRASES[0][1]) is None
+
+
+def test_saved_index_from_another_vectorizer_is_not_loaded(tmp_path):
+    path = str(tmp_path / "index")
+    cache = SemanticCache(path=path)
+    cache.add(SCOPE, "What KPIs should I track for OEE?", "answer")
+    cache.save()
+    assert SemanticCache(path=path).lookup(SCOPE, "What KPIs should I track for OEE?") is not None
+    
+    class OlderVectorizer(type(cache.vectorizer)):
+        version = cache.vectorizer.version - 1
+    
+    stale = SemanticCache(path=None)
+    stale.path = path
+    stale.vectorizer = OlderVectorizer()
+    stale.load()
+    assert stale.lookup(SCOPE, "What KPIs should I track for OEE?") is None
+
+
+def test_concurrent_saves_leave_one_whole_index(tmp_path):
+    path = str(tmp_path / "index")
+    cache = SemanticCache(path=path, save_interval=3600)
+    questions = [stored for stored, _ in PARAPHRASES + NEAR_MISSES]
+    
+    def add_and_save(question):
+        cache.add(SCOPE, question, f"answer to: {question}")
+        cache.save()
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(add_and_save, questions))
+    
+    assert os.listdir(tmp_path) == ["index.npz"]  # No temporary files or sidecar left behind
+    reloaded = SemanticCache(path=path)
+    assert reloaded.stats()["entries"] == len(cache._scopes[SCOPE])
+    assert reloaded.lookup(SCOPE, PARAPHRASES[0][1])[0] == f"answer to: {PARAPHRASES[0][0]}"
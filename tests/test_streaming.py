@@ -0,0 +1,45 @@
+"""
+Streaming deltas and connection reuse of streamed responses.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+
+from http_pool import close_async_sessions, pool_stats
+
+
+def test_stream_yields_deltas(openai):
+    chunks = list(openai.stream("What is kaizen?"))
+    assert len(chunks) == 20
+    assert all(chunk.endswith(" ") for chunk in chunks)
+
+
+def test_streams_reuse_the_connection(openai, mock_server):
+    for _ in range(5):
+        assert "".join(openai.stream("What is kaizen?"))
+    
+    assert mock_server.stats.snapshot()["connections"] == 1
+    stats = next(iter(pool_stats(mock_server.url).values()))
+    assert stats["connections_opened"] == 1
+    assert stats["idle_connections"] == 1
+
+
+def test_streams_and_calls_share_the_connection(openai, mock_server):
+    for _ in range(3):
+        openai.call("What is kaizen?")
+        list(openai.stream("What is kaizen?"))
+    
+    assert mock_server.stats.snapshot()["connections"] == 1
+
+
+def test_async_streams_reuse_the_connection(openai, mock_server):
+    async def main():
+        try:
+            for _ in range(5):
+                assert [chunk async for chunk in openai.astream("What is kaizen?")]
+        finally:
+            await close_async_sessions()
+    
+    asyncio.run(main())
+    assert mock_server.stats.snapshot()["connections"] == 1
@@ -0,0 +1,64 @@
+"""
+Token budgets: completion budgets per template, oversized questions and the usage log.
+
+Created by: Saqeb Newaz
+"""
+
+import os
+
+import pytest
+
+from config import COMPLETION_BUDGETS, DEFAULT_COMPLETION_BUDGET
+from prompts import PromptTemplates
+from tokens import TRIM_MARKER, InputTooLongError, UsageLog, completion_budget, count_tokens, fit_user_input
+
+LONG_QUESTION = "How can we reduce changeover time on the stamping presses in our plant? " * 40
+
+
+def test_completion_budget_follows_the_template():
+    assert completion_budget(PromptTemplates.kpi_metrics("5S", "Automotive")) == COMPLETION_BUDGETS["kpi_metrics"]
+    assert completion_budget("What is kaizen?") == COMPLETION_BUDGETS.get("custom", DEFAULT_COMPLETION_BUDGET)
+
+
+def test_short_questions_are_untouched():
+    assert fit_user_input("What is kaizen?", max_tokens=50) == "What is kaizen?"
+    assert fit_user_input(LONG_QUESTION, max_tokens=0) == LONG_QUESTION  # Limit disabled
+
+
+def test_long_questions_are_trimmed_to_the_limit():
+    trimmed = fit_user_input(LONG_QUESTION, max_tokens=50, overflow="trim")
+    
+    assert trimmed.endswith(TRIM_MARKER)
+    assert LONG_QUESTION.startswith(trimmed[:-len(TRIM_MARKER)])
+    assert count_tokens(trimmed) <= 50
+
+
+def test_long_questions_are_refused_when_trimming_is_off():
+    with pytest.raises(InputTooLongError) as excinfo:
+        fit_user_input(LONG_QUESTION, max_tokens=50, overflow="reject")
+    assert "under 50 tokens" in str(excinfo.value)
+    assert isinstance(excinfo.value, ValueError)
+
+
+def test_usage_log_creates_its_directory_on_first_write(tmp_path):
+    log = UsageLog(str(tmp_path / "logs" / "usage.jsonl"))
+    assert not os.path.exists(tmp_path / "logs")
+    
+    log.record("OpenAI", PromptTemplates.kpi_metrics("5S", "Automotive"), {"prompt_tokens": 120, "completion_tokens": 300})
+    log.record("OpenAI", "What is kaizen?", {"prompt_tokens": 40, "completion_tokens": 80})
+    log.close()
+    
+    assert [entry["template"] for entry in log.entries()] == ["kpi_metrics", "custom"]
+
+
+def test_usage_log_rotates_at_its_size_cap(tmp_path):
+    path = str(tmp_path / "usage.jsonl")
+    log = UsageLog(path, max_bytes=1000)
+    for completion_tokens in range(50):
+        log.record("OpenAI", "What is kaizen?", {"prompt_tokens": 40, "completion_tokens": completion_tokens})
+    log.close()
+    
+    assert os.path.getsize(path) <= 1000 and os.path.getsize(f"{path}.1") <= 1000
+    kept = [entry["completion_tokens"] for entry in log.entries()]
+    assert kept == list(range(50 - len(kept), 50))  # The newest entries, in order
+    assert log.report()["custom"]["max"] == 49
@@ -0,0 +1,100 @@
+"""
+Recording provider traffic to a cassette and replaying it, exactly or loosely matched.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+
+import pytest
+
+import chat_providers
+import tokens
+from http_pool import close_async_sessions, get_pool
+from prompts import TemplatePrompt
+from transport import AsyncReplayTransport, Cassette, CassetteMissError, RecordingTransport, ReplayTransport
+
+FIELDS = {"framework": "5S", "industry": "Automotive"}
+
+
+def kpi_prompt(wording: str) -> TemplatePrompt:
+    return TemplatePrompt(f"{wording} KPIs for 5S in Automotive.", "kpi_metrics", dict(FIELDS))
+
+
+@pytest.fixture
+def recorded(openai, tmp_path):
+    """A cassette holding one KPI answer and one free-form answer, called and streamed."""
+    path = str(tmp_path / "traffic.jsonl.gz")
+    cassette = Cassette(path)
+    openai.transport = RecordingTransport(get_pool(openai.api_url), openai.display_name, cassette)
+    answers = {
+        "kpi": openai.call(kpi_prompt("List the")),
+        "kpi_stream": "".join(openai.stream(kpi_prompt("List the"))),
+        "custom": openai.call("What is kaizen?"),
+    }
+    cassette.close()
+    return path, answers
+
+
+def replay(openai, path: str, match: str) -> Cassette:
+    cassette = Cassette(path, match=match)
+    openai.transport = ReplayTransport(openai.display_name, cassette, speed=0)
+    return cassette
+
+
+def test_exact_replay_answers_identical_requests_only(openai, mock_server, recorded):
+    path, answers = recorded
+    sent = mock_server.stats.snapshot()["requests"]
+    replay(openai, path, "exact")
+    
+    assert openai.call(kpi_prompt("List the")) == answers["kpi"]
+    assert openai.call("What is kaizen?") == answers["custom"]
+    with pytest.raises(CassetteMissError):
+        openai.call(kpi_prompt("Suggest five"))
+    assert mock_server.stats.snapshot()["requests"] == sent
+
+
+def test_loose_replay_survives_prompt_and_budget_changes(openai, mock_server, recorded, monkeypatch):
+    path, answers = recorded
+    sent = mock_server.stats.snapshot()["requests"]
+    cassette = replay(openai, path, "loose")
+    monkeypatch.setitem(tokens.COMPLETION_BUDGETS, "kpi_metrics", 123)
+    monkeypatch.setitem(tokens.COMPLETION_BUDGETS, "custom", 77)
+    
+    assert openai.call(kpi_prompt("Suggest five")) == answers["kpi"]
+    assert "".join(openai.stream(kpi_prompt("Suggest five"))) == answers["kpi_stream"]
+    assert openai.call("What is kaizen?") == answers["custom"]
+    assert cassette.stats()["replayed"] == 3
+    assert mock_server.stats.snapshot()["requests"] == sent
+
+
+def test_loose_replay_still_tells_requests_apart(openai, recorded):
+    path, _ = recorded
+    replay(openai, path, "loose")
+    
+    other = TemplatePrompt("List the KPIs for 5S in Healthcare.", "kpi_metrics", {**FIELDS, "industry": "Healthcare"})
+    with pytest.raises(CassetteMissError):
+        openai.call(other)
+    with pytest.raises(CassetteMissError):
+        openai.call("What is muda?")
+
+
+def test_loose_async_replay(openai, recorded, monkeypatch):
+    path, answers = recorded
+    cassette = Cassette(path, match="loose")
+    monkeypatch.setattr(
+        chat_providers, "get_async_transport", lambda provider, url: AsyncReplayTransport(provider, cassette, speed=0)
+    )
+    
+    async def main():
+        try:
+            return "".join([chunk async for chunk in openai.astream(kpi_prompt("Suggest five"))])
+        finally:
+            await close_async_sessions()
+    
+    assert asyncio.run(main()) == answers["kpi_stream"]
+
+
+def test_unknown_match_mode_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "traffic.jsonl.gz"), match="fuzzy")
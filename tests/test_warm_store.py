@@ -0,0 +1,63 @@
+"""
+Warm store: lookups off the event loop, and generation runs that outlive failed entries.
+
+Created by: Saqeb Newaz
+"""
+
+import asyncio
+import sqlite3
+import threading
+
+import warm_store
+from cancellation import RequestCancelled
+from tests.fakes import FakeProvider
+from warm_store import WarmEntry, WarmStore, WarmStoreProvider, generate
+
+
+class PickyProvider(FakeProvider):
+    """Fails the roadmap prompts with ``error``; answers the rest."""
+    
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+    
+    def call(self, prompt):
+        if "roadmap" in prompt.lower():
+            raise self.error
+        return super().call(prompt)
+
+
+def test_async_lookups_leave_the_event_loop_free(tmp_path):
+    store = WarmStore(str(tmp_path / "warm.sqlite3"))
+    provider = FakeProvider()
+    store.put(provider.request_fingerprint("q"), WarmEntry("kpi_metrics", "5S", "Automotive"), "v1", "Fake", "stored")
+    threads = []
+    original_get = store.get
+    
+    def get(fingerprint):
+        threads.append(threading.get_ident())
+        return original_get(fingerprint)
+    
+    store.get = get
+    wrapped = WarmStoreProvider(provider, store)
+    
+    async def main():
+        answers = [await wrapped.acall("q"), "".join([chunk async for chunk in wrapped.astream("q")])]
+        return answers, threading.get_ident()
+    
+    answers, loop_thread = asyncio.run(main())
+    assert answers == ["stored", "stored"]
+    assert provider.calls == 0
+    assert len(threads) == 2 and loop_thread not in threads
+
+
+def test_generation_counts_every_kind_of_failure(tmp_path, monkeypatch):
+    templates = ["kpi_metrics", "implementation_roadmap"]
+    for error in (RequestCancelled("stopped"), sqlite3.OperationalError("database is locked"), RuntimeError("boom")):
+        monkeypatch.setattr(warm_store, "get_shared_provider", lambda name, error=error: PickyProvider(error))
+        path = str(tmp_path / f"{type(error).__name__}.sqlite3")
+        
+        counts = generate("fake", workers=4, templates=templates, path=path)
+        
+        entries = len(list(warm_store.template_matrix(["kpi_metrics"])))
+        assert counts == {"generated": entries, "retagged": 0, "skipped": 0, "failed": entries}
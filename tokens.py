@@ -0,0 +1,222 @@
+"""
+Local token counting, per-template completion budgets and usage accounting.
+
+Prompt tokens are counted before a request is sent, using tiktoken when it is
+installed and a four-characters-per-token estimate otherwise. Each
+PromptTemplates method gets its own max_tokens budget, oversized user input is
+trimmed or rejected up front, and the usage reported by the provider is logged
+so the budgets can be tuned from real data.
+
+Usage:
+    python tokens.py report
+    python tokens.py count "How can I reduce waste on my assembly line?"
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+from config import (
+    COMPLETION_BUDGETS, DEFAULT_COMPLETION_BUDGET, MAX_USER_INPUT_TOKENS, USER_INPUT_OVERFLOW, TOKEN_USAGE_LOG,
+    TOKEN_USAGE_LOG_MAX_BYTES,
+)
+
+
+TRIM_MARKER = " [...]"
+
+
+class InputTooLongError(ValueError):
+    """The user's question exceeds MAX_USER_INPUT_TOKENS and trimming is disabled."""
+
+
+@functools.lru_cache(maxsize=1)
+def _tiktoken():
+    """The tiktoken module, imported on the first count, or None if it is not installed."""
+    try:
+        import tiktoken
+    except ImportError:  # Optional: fall back to the character estimate
+        return None
+    return tiktoken
+
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model: str):
+    tiktoken = _tiktoken()
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Number of tokens in ``text`` for ``model``."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(messages: List[Dict[str, Any]], model: str = "gpt-4o") -> int:
+    """Prompt tokens of a chat-completions message list, including per-message overhead."""
+    return sum(count_tokens(str(message.get("content", "")), model) + 3 for message in messages) + 3
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    """Keep the first ``max_tokens`` tokens of ``text``."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def completion_budget(prompt: str) -> int:
+    """max_tokens for the template that produced ``prompt``."""
+    return COMPLETION_BUDGETS.get(getattr(prompt, "template", "custom"), DEFAULT_COMPLETION_BUDGET)
+
+
+def fit_user_input(user_input: str, max_tokens: int = MAX_USER_INPUT_TOKENS, overflow: str = USER_INPUT_OVERFLOW) -> str:
+    """Trim or reject a question longer than ``max_tokens`` before anything is sent."""
+    if max_tokens <= 0 or len(user_input) <= max_tokens:
+        return user_input  # Fewer characters than tokens allowed: cannot be over
+    tokens = count_tokens(user_input)
+    if tokens <= max_tokens:
+        return user_input
+    if overflow == "reject":
+        raise InputTooLongError(
+            f"Your question is about {tokens} tokens; please shorten it to under {max_tokens} tokens."
+        )
+    return truncate_to_tokens(user_input, max_tokens - count_tokens(TRIM_MARKER)) + TRIM_MARKER
+
+
+class UsageLog:
+    """Append-only JSON-lines log of reported token usage per call, rotated at ``max_bytes``."""
+    
+    def __init__(self, path: str = TOKEN_USAGE_LOG, max_bytes: int = TOKEN_USAGE_LOG_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file: Optional[TextIO] = None
+        self._size = 0
+        self._close_registered = False
+    
+    def _open(self) -> TextIO:
+        """The log file, opened (and its directory created) on the first write."""
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Line buffered: every entry reaches the file as it is written
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._size = self._file.tell()
+            if not self._close_registered:
+                atexit.register(self.close)
+                self._close_registered = True
+        return self._file
+    
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        os.replace(self.path, f"{self.path}.1")
+    
+    def record(self, provider: str, prompt: str, usage: Dict[str, Any]) -> None:
+        if not self.path:
+            return
+        entry = {
+            "time": round(time.time(), 3),
+            "provider": provider,
+            "template": getattr(prompt, "template", "custom"),
+            "budget": completion_budget(prompt),
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self.max_bytes > 0 and self._file is not None and self._size + len(line) > self.max_bytes:
+                self._rotate()
+            self._open().write(line)
+            self._size += len(line)
+    
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    
+    def entries(self) -> List[Dict[str, Any]]:
+        """Logged entries, oldest first, including the rotated file."""
+        entries: List[Dict[str, Any]] = []
+        if not self.path:
+            return entries
+        for path in (f"{self.path}.1", self.path):
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    entries.extend(json.loads(line) for line in f if line.strip())
+        return entries
+    
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """Completion length per template against its current budget."""
+        by_template: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in self.entries():
+            if entry.get("completion_tokens") is not None:
+                by_template.setdefault(entry["template"], []).append(entry)
+        
+        report = {}
+        for template, entries in sorted(by_template.items()):
+            lengths = sorted(entry["completion_tokens"] for entry in entries)
+            at_budget = sum(entry["completion_tokens"] >= entry["budget"] for entry in entries)
+            budget = COMPLETION_BUDGETS.get(template, DEFAULT_COMPLETION_BUDGET)
+            p95 = lengths[min(len(lengths) - 1, int(len(lengths) * 0.95))]
+            report[template] = {
+                "calls": len(lengths),
+                "p50": lengths[len(lengths) // 2],
+                "p95": p95,
+                "max": lengths[-1],
+                "budget": budget,
+                # Answers that stopped at max_tokens were probably cut off
+                "at_budget": round(at_budget / len(lengths), 3),
+                "suggested": int(round(p95 * 1.2, -1)),
+            }
+        return report
+
+
+usage_log = UsageLog()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Token counting and completion budget report.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Completion length per template vs. its budget")
+    report_parser.add_argument("--log", default=TOKEN_USAGE_LOG, help="Usage log path")
+    count_parser = subparsers.add_parser("count", help="Count the tokens of a text")
+    count_parser.add_argument("text")
+    args = parser.parse_args()
+    
+    if args.command == "count":
+        method = "tiktoken" if _tiktoken() is not None else "estimate"
+        print(f"{count_tokens(args.text)} tokens ({method})")
+        return
+    
+    report = UsageLog(args.log).report()
+    if not report:
+        print(f"No usage recorded in {args.log}")
+        sys.exit(1)
+    print(f"{'template':34} {'calls':>6} {'p50':>6} {'p95':>6} {'max':>6} {'budget':>7} {'at budget':>10} {'suggested':>10}")
+    for template, row in report.items():
+        print(
+            f"{template:34} {row['calls']:>6} {row['p50']:>6} {row['p95']:>6} {row['max']:>6} "
+            f"{row['budget']:>7} {row['at_budget']:>10.1%} {row['suggested']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,579 @@
+"""
+Record/replay transport for provider HTTP traffic.
+
+With LLM_TRANSPORT=record every chat-completions request goes out as usual
+and is also appended to a cassette: the request body, the response status and
+headers, the time to the response headers and each body chunk with the delay
+before it. With LLM_TRANSPORT=replay the providers never open a connection;
+requests are answered from the cassette on the recorded schedule, sped up by
+LLM_REPLAY_SPEED. Requests match on provider and exact request body, and a
+request recorded several times gets its recorded responses in turn. With
+LLM_REPLAY_MATCH=loose a template request matches on its template and fields
+instead, and any other request on its body without max_tokens, so a cassette
+survives prompt wording and budget changes.
+
+Cassettes are gzipped JSON lines, one request per line, without API keys.
+``python benchmark.py --cassette <file>`` runs a recorded session back through
+run_assistant and compares its latency and throughput with an earlier run.
+
+Usage:
+    LLM_TRANSPORT=record streamlit run app.py
+    python transport.py info .cache/cassettes/traffic.jsonl.gz
+    python benchmark.py --cassette .cache/cassettes/traffic.jsonl.gz --speed 10
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import asyncio
+import atexit
+import contextlib
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, IO, Iterator, List, Optional, Tuple, Union
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from ai_providers import ProviderError
+from cancellation import RequestCancelled, sleep
+from config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, LLM_CASSETTE, LLM_REPLAY_MATCH, LLM_REPLAY_SPEED, LLM_TRANSPORT,
+)
+from http_pool import ConnectionPool, get_async_session, get_pool
+
+if TYPE_CHECKING:
+    import aiohttp
+
+TRANSPORTS = ("live", "record", "replay")
+REPLAY_MATCHES = ("exact", "loose")
+
+# Request fields a loose match ignores for requests not built from a template
+LOOSE_IGNORED = ("max_tokens",)
+
+# Response headers the providers read; dates, request ids and cookies are not kept
+KEPT_HEADERS = ("Content-Type", "Retry-After")
+
+_origin: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("lean_ai_origin", default=None)
+
+
+class CassetteMissError(ProviderError):
+    """Replay found no recorded response for the request."""
+    
+    def __init__(self, provider: str, path: str):
+        super().__init__(provider, f"No recorded {provider} response for this request in {path}.")
+
+
+@contextlib.contextmanager
+def origin(prompt: str) -> Iterator[None]:
+    """Note the template and fields behind the requests sent inside, so a replay can rebuild them."""
+    name = getattr(prompt, "template", "custom")
+    token = _origin.set(None if name == "custom" else {"template": name, "fields": dict(prompt.fields)})
+    try:
+        yield
+    finally:
+        _origin.reset(token)
+
+
+def request_key(provider: str, payload: Dict[str, Any]) -> str:
+    """Identify a request by provider and exact request body."""
+    return hashlib.sha256(json.dumps([provider, payload], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def loose_request_key(provider: str, payload: Dict[str, Any], origin_fields: Optional[Dict[str, Any]]) -> str:
+    """Identify a request by what it asks: its template and fields, else its body without LOOSE_IGNORED."""
+    if origin_fields is not None:
+        # Whether it streams decides the shape of the recorded response, so it still has to agree
+        basis: Dict[str, Any] = {"origin": origin_fields, "stream": bool(payload.get("stream"))}
+    else:
+        basis = {name: value for name, value in payload.items() if name not in LOOSE_IGNORED}
+    return hashlib.sha256(json.dumps([provider, basis], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """One cassette file: appended to while recording, indexed by request while replaying."""
+    
+    def __init__(self, path: str = LLM_CASSETTE, match: str = LLM_REPLAY_MATCH):
+        if match not in REPLAY_MATCHES:
+            raise ValueError(f"Unknown LLM_REPLAY_MATCH '{match}'. Available: {', '.join(REPLAY_MATCHES)}")
+        self.path = path
+        self.match = match
+        self._lock = threading.Lock()
+        self._file: Optional[IO[str]] = None
+        self._index: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._turns: Dict[str, int] = {}
+        self._counters = {"recorded": 0, "replayed": 0, "misses": 0}
+    
+    def _open(self, mode: str) -> IO[str]:
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+    
+    def interactions(self) -> Iterator[Dict[str, Any]]:
+        """Every recorded request in recording order."""
+        if not os.path.exists(self.path):
+            return
+        with self._open("r") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            except (EOFError, ValueError):
+                return  # Cut off mid-write, e.g. the recording process was killed
+    
+    def append(self, interaction: Dict[str, Any]) -> None:
+        line = json.dumps(interaction, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = self._open("a")
+            self._file.write(line)
+            # A sync flush keeps everything so far readable even if the process dies
+            self._file.flush()
+            self._counters["recorded"] += 1
+    
+    def match_key(self, provider: str, payload: Dict[str, Any], origin_fields: Optional[Dict[str, Any]]) -> str:
+        """Key that replay looks a request up by, following ``match``."""
+        if self.match == "loose":
+            return loose_request_key(provider, payload, origin_fields)
+        return request_key(provider, payload)
+    
+    def next_response(self, key: str) -> Optional[Dict[str, Any]]:
+        """The next recorded exchange for a match_key(), cycling through repeats; None if never recorded."""
+        with self._lock:
+            if self._index is None:
+                self._index = {}
+                for interaction in self.interactions():
+                    if self.match == "exact":
+                        key_of = interaction["key"]
+                    else:
+                        key_of = self.match_key(interaction["provider"], interaction["request"], interaction.get("origin"))
+                    self._index.setdefault(key_of, []).append(interaction)
+            recorded = self._index.get(key)
+            if not recorded:
+                self._counters["misses"] += 1
+                return None
+            turn = self._turns.get(key, 0)
+            self._turns[key] = turn + 1
+            self._counters["replayed"] += 1
+            return recorded[turn % len(recorded)]
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+            if self._index is not None:
+                stats["recorded_requests"] = sum(len(recorded) for recorded in self._index.values())
+            return stats
+    
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _interaction(provider: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    interaction: Dict[str, Any] = {"at": round(time.time(), 3), "provider": provider, "key": request_key(provider, payload)}
+    origin_fields = _origin.get()
+    if origin_fields is not None:
+        interaction["origin"] = origin_fields
+    interaction["request"] = payload
+    return interaction
+
+
+def _response_fields(interaction: Dict[str, Any], status: int, reason: str, headers: Any, ttfb: float) -> None:
+    interaction["status"] = status
+    interaction["reason"] = reason
+    interaction["headers"] = {name: headers[name] for name in KEPT_HEADERS if name in headers}
+    interaction["ttfb"] = round(ttfb, 4)
+
+
+def _error_fields(interaction: Dict[str, Any], exc: Exception, timed_out: bool, elapsed: float) -> None:
+    interaction["error"] = "timeout" if timed_out else "connection"
+    interaction["message"] = str(exc)[:300]
+    interaction["ttfb"] = round(elapsed, 4)
+
+
+class _Recording:
+    """One exchange being recorded; written to the cassette once its body is finished or closed."""
+    
+    def __init__(self, cassette: Cassette, interaction: Dict[str, Any]):
+        self.cassette = cassette
+        self.interaction = interaction
+        self.chunks: List[List[Any]] = []
+        interaction["chunks"] = self.chunks
+        self._last = time.monotonic()
+        self._finished = False
+    
+    def chunk(self, data: bytes) -> None:
+        now = time.monotonic()
+        if data:
+            # latin-1 maps bytes to characters one to one, so split UTF-8 sequences survive
+            self.chunks.append([round(now - self._last, 4), data.decode("latin-1")])
+        self._last = now
+    
+    def finish(self) -> None:
+        if not self._finished:
+            self._finished = True
+            self.cassette.append(self.interaction)
+
+
+def _schedule(chunks: List[List[Any]], speed: float) -> Iterator[Tuple[float, bytes]]:
+    """(seconds after the response headers, chunk) for each recorded chunk at ``speed``."""
+    offset = 0.0
+    for delay, data in chunks:
+        offset += delay
+        yield (offset / speed if speed > 0 else 0.0), data.encode("latin-1")
+
+
+def _pause(seconds: float) -> None:
+    """Wait out recorded time; a cancelled caller gets the error an aborted live socket gives."""
+    try:
+        sleep(seconds)
+    except RequestCancelled:
+        raise requests.ConnectionError("Connection aborted (replayed)") from None
+
+
+class _RecordingBody:
+    """Wraps urllib3's response body and records each chunk as requests reads it."""
+    
+    def __init__(self, raw: Any, recording: _Recording):
+        self._raw = raw
+        self._recording = recording
+    
+    def stream(self, amt: Optional[int] = None, decode_content: Optional[bool] = None) -> Iterator[bytes]:
+        try:
+            for chunk in self._raw.stream(amt, decode_content=decode_content):
+                self._recording.chunk(chunk)
+                yield chunk
+        finally:
+            self._recording.finish()
+    
+    def close(self) -> None:
+        self._recording.finish()
+        self._raw.close()
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._raw, name)
+
+
+class _ReplayBody:
+    """Stands in for urllib3's response body, handing out recorded chunks on their schedule."""
+    
+    def __init__(self, chunks: List[List[Any]], speed: float):
+        self._chunks = chunks
+        self._speed = speed
+    
+    def stream(self, amt: Optional[int] = None, decode_content: Optional[bool] = None) -> Iterator[bytes]:
+        started = time.monotonic()
+        for at, data in _schedule(self._chunks, self._speed):
+            remaining = started + at - time.monotonic()
+            if remaining > 0:
+                _pause(remaining)
+            yield data
+    
+    def close(self) -> None:
+        pass
+    
+    def release_conn(self) -> None:
+        pass
+
+
+class RecordingTransport:
+    """Sends through the live connection pool and records every exchange to a cassette."""
+    
+    def __init__(self, pool: ConnectionPool, provider: str, cassette: Cassette):
+        self.pool = pool
+        self.provider = provider
+        self.cassette = cassette
+        self.timeout = pool.timeout
+    
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        interaction = _interaction(self.provider, kwargs["json"])
+        started = time.monotonic()
+        try:
+            response = self.pool.post(url, **kwargs)
+        except requests.RequestException as exc:
+            _error_fields(interaction, exc, isinstance(exc, requests.Timeout), time.monotonic() - started)
+            self.cassette.append(interaction)
+            raise
+        _response_fields(interaction, response.status_code, response.reason, response.headers, time.monotonic() - started)
+        recording = _Recording(self.cassette, interaction)
+        if kwargs.get("stream"):
+            response.raw = _RecordingBody(response.raw, recording)
+        else:
+            # Without stream=True requests has already read the body with the headers
+            recording.chunk(response.content)
+            recording.finish()
+        return response
+
+
+class _AsyncRecordingResponse:
+    """aiohttp response proxy that records the body as the provider reads it."""
+    
+    def __init__(self, response: "aiohttp.ClientResponse", recording: _Recording):
+        self._response = response
+        self._recording = recording
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+    
+    @property
+    def content(self) -> AsyncIterator[bytes]:
+        return self._lines()
+    
+    async def _lines(self) -> AsyncIterator[bytes]:
+        async for line in self._response.content:
+            self._recording.chunk(line)
+            yield line
+    
+    async def read(self) -> bytes:
+        body = await self._response.read()
+        self._recording.chunk(body)
+        return body
+    
+    async def text(self) -> str:
+        return (await self.read()).decode("utf-8", errors="replace")
+    
+    async def json(self, content_type: Optional[str] = None) -> Any:
+        return json.loads(await self.read())
+    
+    def release(self) -> None:
+        self._recording.finish()
+        self._response.release()
+
+
+class AsyncRecordingTransport:
+    """Async counterpart of RecordingTransport around the loop's aiohttp session."""
+    
+    def __init__(self, session: "aiohttp.ClientSession", provider: str, cassette: Cassette):
+        self.session = session
+        self.provider = provider
+        self.cassette = cassette
+    
+    async def post(self, url: str, **kwargs: Any) -> _AsyncRecordingResponse:
+        import aiohttp
+        
+        interaction = _interaction(self.provider, kwargs["json"])
+        started = time.monotonic()
+        try:
+            response = await self.session.post(url, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            _error_fields(interaction, exc, isinstance(exc, asyncio.TimeoutError), time.monotonic() - started)
+            self.cassette.append(interaction)
+            raise
+        _response_fields(interaction, response.status, response.reason or "", response.headers, time.monotonic() - started)
+        return _AsyncRecordingResponse(response, _Recording(self.cassette, interaction))
+
+
+class _Replayer:
+    """Looks requests up in a cassette and scales recorded delays."""
+    
+    def __init__(self, provider: str, cassette: Cassette, speed: float = LLM_REPLAY_SPEED):
+        self.provider = provider
+        self.cassette = cassette
+        self.speed = speed
+        self.timeout: Tuple[float, float] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    
+    def _lookup(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        interaction = self.cassette.next_response(self.cassette.match_key(self.provider, payload, _origin.get()))
+        if interaction is None:
+            raise CassetteMissError(self.provider, self.cassette.path)
+        return interaction
+    
+    def _scaled(self, seconds: float) -> float:
+        return seconds / self.speed if self.speed > 0 else 0.0
+    
+    @staticmethod
+    def _times_out(interaction: Dict[str, Any], read_timeout: Optional[float]) -> bool:
+        """Whether the caller's read timeout would have fired before the recorded headers arrived."""
+        return bool(read_timeout) and interaction["ttfb"] > read_timeout
+
+
+class ReplayTransport(_Replayer):
+    """Answers blocking requests from a cassette with the recorded timing; never opens a connection."""
+    
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        interaction = self._lookup(kwargs["json"])
+        timeout = kwargs.get("timeout", self.timeout)
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        if self._times_out(interaction, read_timeout):
+            _pause(self._scaled(read_timeout))
+            raise requests.ReadTimeout(f"Read timed out after {read_timeout:.1f}s (replayed)")
+        _pause(self._scaled(interaction["ttfb"]))
+        
+        error = interaction.get("error")
+        if error == "timeout":
+            raise requests.ReadTimeout(interaction.get("message", error))
+        if error is not None:
+            raise requests.ConnectionError(interaction.get("message", error))
+        
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction.get("reason", "")
+        response.headers = CaseInsensitiveDict(interaction.get("headers", {}))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = url
+        response.raw = _ReplayBody(interaction.get("chunks", []), self.speed)
+        if not kwargs.get("stream"):
+            response.content  # Read the body up front, as requests does without stream=True
+        return response
+
+
+class _AsyncReplayResponse:
+    """The parts of an aiohttp response the providers use, served from a recorded exchange."""
+    
+    def __init__(self, interaction: Dict[str, Any], speed: float):
+        self.status = interaction["status"]
+        self.reason = interaction.get("reason", "")
+        self.headers = CaseInsensitiveDict(interaction.get("headers", {}))
+        self._chunks = interaction.get("chunks", [])
+        self._speed = speed
+    
+    async def _paced(self) -> AsyncIterator[bytes]:
+        started = time.monotonic()
+        for at, data in _schedule(self._chunks, self._speed):
+            remaining = started + at - time.monotonic()
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            yield data
+    
+    @property
+    def content(self) -> AsyncIterator[bytes]:
+        return self._lines()
+    
+    async def _lines(self) -> AsyncIterator[bytes]:
+        # aiohttp's stream reader iterates by line, whatever the recorded chunking was
+        pending = b""
+        async for data in self._paced():
+            *lines, pending = (pending + data).split(b"\n")
+            for line in lines:
+                yield line + b"\n"
+        if pending:
+            yield pending
+    
+    async def read(self) -> bytes:
+        return b"".join([data async for data in self._paced()])
+    
+    async def text(self) -> str:
+        return (await self.read()).decode("utf-8", errors="replace")
+    
+    async def json(self, content_type: Optional[str] = None) -> Any:
+        return json.loads(await self.read())
+    
+    def release(self) -> None:
+        pass
+
+
+class AsyncReplayTransport(_Replayer):
+    """Async counterpart of ReplayTransport; waits on the event loop instead of a thread."""
+    
+    async def post(self, url: str, **kwargs: Any) -> _AsyncReplayResponse:
+        interaction = self._lookup(kwargs["json"])
+        read_timeout = getattr(kwargs.get("timeout"), "sock_read", None) or self.timeout[1]
+        if self._times_out(interaction, read_timeout):
+            await asyncio.sleep(self._scaled(read_timeout))
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(self._scaled(interaction["ttfb"]))
+        
+        error = interaction.get("error")
+        if error == "timeout":
+            raise asyncio.TimeoutError()
+        if error is not None:
+            import aiohttp
+            raise aiohttp.ClientConnectionError(interaction.get("message", error))
+        return _AsyncReplayResponse(interaction, self.speed)
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path: str = LLM_CASSETTE) -> Cassette:
+    """Return the process-wide cassette for ``path``, creating it on first use."""
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = Cassette(path)
+            _cassettes[path] = cassette
+            # Completes the gzip stream of a recording
+            atexit.register(cassette.close)
+        return cassette
+
+
+def cassette_stats() -> Dict[str, Dict[str, int]]:
+    with _cassettes_lock:
+        return {path: cassette.stats() for path, cassette in _cassettes.items()}
+
+
+def _mode() -> str:
+    if LLM_TRANSPORT not in TRANSPORTS:
+        raise ValueError(f"Unknown LLM_TRANSPORT '{LLM_TRANSPORT}'. Available: {', '.join(TRANSPORTS)}")
+    return LLM_TRANSPORT
+
+
+def get_transport(provider: str, url: str) -> Union[ConnectionPool, RecordingTransport, ReplayTransport]:
+    """Transport for a provider's blocking requests: the shared pool, or a recorder or player."""
+    mode = _mode()
+    if mode == "record":
+        return RecordingTransport(get_pool(url), provider, get_cassette())
+    if mode == "replay":
+        return ReplayTransport(provider, get_cassette())
+    return get_pool(url)
+
+
+def get_async_transport(
+    provider: str, url: str
+) -> Union["aiohttp.ClientSession", AsyncRecordingTransport, AsyncReplayTransport]:
+    """Transport for a provider's requests on the running event loop."""
+    mode = _mode()
+    if mode == "record":
+        return AsyncRecordingTransport(get_async_session(url), provider, get_cassette())
+    if mode == "replay":
+        return AsyncReplayTransport(provider, get_cassette())
+    return get_async_session(url)
+
+
+def describe(path: str) -> Dict[str, Any]:
+    """Request count, time span, providers and latency of a cassette."""
+    interactions = list(Cassette(path).interactions())
+    if not interactions:
+        return {"requests": 0}
+    arrivals = [interaction["at"] for interaction in interactions]
+    ttfb = [interaction["ttfb"] for interaction in interactions if "error" not in interaction]
+    return {
+        "requests": len(interactions),
+        "span_s": round(max(arrivals) - min(arrivals), 1),
+        "providers": dict(Counter(interaction["provider"] for interaction in interactions)),
+        "templates": dict(Counter(
+            (interaction.get("origin") or {}).get("template", "custom") for interaction in interactions
+        )),
+        "streamed": sum(bool(interaction["request"].get("stream")) for interaction in interactions),
+        "errors": sum("error" in interaction or interaction.get("status", 200) >= 400 for interaction in interactions),
+        "ttfb_p50_s": round(statistics.median(ttfb), 3) if ttfb else None,
+        "ttfb_max_s": round(max(ttfb), 3) if ttfb else None,
+        "size_kb": round(os.path.getsize(path) / 1024, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect recorded provider traffic.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info", help="Summarize a cassette")
+    info_parser.add_argument("path", nargs="?", default=LLM_CASSETTE)
+    args = parser.parse_args()
+    
+    for name, value in describe(args.path).items():
+        print(f"{name:12} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Offline pre-generation ("warm store") for PromptTemplates answers.
+
+The template inputs are a small closed set (FRAMEWORKS x INDUSTRY_EXAMPLES x
+templates), so every answer can be generated ahead of time into a versioned
+SQLite artifact and served without a live call. Entries are looked up by the
+provider's request fingerprint and tagged with a hash of the template source,
+so editing one template in prompts.py only invalidates that template's entries.
+
+Usage:
+    python warm_store.py generate --provider openai --workers 8
+    python warm_store.py generate --template kpi_metrics
+    python warm_store.py prune
+    python warm_store.py stats
+
+Created by: Saqeb Newaz
+"""
+
+import argparse
+import contextvars
+import hashlib
+import inspect
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional
+
+from ai_providers import AIProvider, ProviderWrapper, get_shared_provider
+from config import FRAMEWORKS, INDUSTRY_EXAMPLES, DEFAULT_AI_PROVIDER, WARM_STORE_PATH
+from metrics import metrics
+from prompts import PromptTemplates
+from scheduler import scheduling
+
+# Template name -> which arguments it takes
+TEMPLATE_ARGS: Dict[str, tuple] = {
+    "framework_comparison": ("industry",),
+    "framework_guide": ("framework", "industry"),
+    "implementation_roadmap": ("framework", "industry"),
+    "kpi_metrics": ("framework", "industry"),
+    "ai_tools_recommendation": ("framework", "industry"),
+    "crisis_communication_integration": (),
+}
+
+
+class WarmEntry(NamedTuple):
+    """One template invocation in the pre-generation matrix."""
+    template: str
+    framework: Optional[str]
+    industry: Optional[str]
+    
+    def prompt(self) -> str:
+        method = getattr(PromptTemplates, self.template)
+        kwargs = {"framework": self.framework, "industry": self.industry}
+        return method(*[kwargs[arg] for arg in TEMPLATE_ARGS[self.template]])
+
+
+def template_version(template: str) -> str:
+    """Hash of a template's source; changes whenever that template is edited."""
+    source = inspect.getsource(getattr(PromptTemplates, template))
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+
+def template_matrix(templates: Optional[List[str]] = None) -> Iterator[WarmEntry]:
+    """Enumerate every (template, framework, industry) combination."""
+    for template in templates or list(TEMPLATE_ARGS):
+        args = TEMPLATE_ARGS[template]
+        frameworks = list(FRAMEWORKS.values()) if "framework" in args else [None]
+        industries = INDUSTRY_EXAMPLES if "industry" in args else [None]
+        for framework in frameworks:
+            for industry in industries:
+                yield WarmEntry(template, framework, industry)
+
+
+class WarmStore:
+    """SQLite artifact of pre-generated answers keyed by request fingerprint."""
+    
+    def __init__(self, path: str = WARM_STORE_PATH, readonly: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        
+        if readonly:
+            if os.path.exists(path):
+                self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " template TEXT NOT NULL,"
+            " template_version TEXT NOT NULL,"
+            " framework TEXT,"
+            " industry TEXT,"
+            " provider TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS artifacts_template ON artifacts (template, template_version)")
+        self._db.commit()
+    
+    def get(self, fingerprint: str) -> Optional[str]:
+        """Return the pre-generated answer for a request, if present."""
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT response FROM artifacts WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.cache_lookup("warm_store", hit=False)
+                return None
+            self.hits += 1
+            metrics.cache_lookup("warm_store", hit=True)
+            return row[0]
+    
+    def version_of(self, fingerprint: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT template_version FROM artifacts WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+            return row[0] if row else None
+    
+    def put(self, fingerprint: str, entry: WarmEntry, version: str, provider: str, response: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO artifacts"
+                " (fingerprint, template, template_version, framework, industry, provider, response, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint, entry.template, version, entry.framework, entry.industry, provider, response, time.time()),
+            )
+            self._db.commit()
+    
+    def set_version(self, fingerprint: str, version: str) -> None:
+        """Re-tag an entry whose rendered prompt did not change after a template edit."""
+        with self._lock:
+            self._db.execute("UPDATE artifacts SET template_version = ? WHERE fingerprint = ?", (version, fingerprint))
+            self._db.commit()
+    
+    def prune(self) -> int:
+        """Delete entries produced by template versions that no longer exist."""
+        removed = 0
+        with self._lock:
+            for template in TEMPLATE_ARGS:
+                removed += self._db.execute(
+                    "DELETE FROM artifacts WHERE template = ? AND template_version != ?",
+                    (template, template_version(template)),
+                ).rowcount
+            placeholders = ", ".join("?" for _ in TEMPLATE_ARGS)
+            removed += self._db.execute(
+                f"DELETE FROM artifacts WHERE template NOT IN ({placeholders})", tuple(TEMPLATE_ARGS)
+            ).rowcount
+            self._db.commit()
+        return removed
+    
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Entry counts per template, split into current and stale versions."""
+        stats: Dict[str, Dict[str, int]] = {}
+        if self._db is None:
+            return stats
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT template, template_version, COUNT(*) FROM artifacts GROUP BY template, template_version"
+            ).fetchall()
+        for template, version, count in rows:
+            current = template in TEMPLATE_ARGS and version == template_version(template)
+            bucket = stats.setdefault(template, {"current": 0, "stale": 0})
+            bucket["current" if current else "stale"] += count
+        return stats
+
+
+class WarmStoreProvider(ProviderWrapper):
+    """Serves pre-generated answers first and falls back to the wrapped provider."""
+    
+    def __init__(self, provider: AIProvider, store: Optional[WarmStore] = None):
+        super().__init__(provider)
+        self.store = store or get_warm_store()
+    
+    def call(self, prompt: str) -> str:
+        stored = self.store.get(self.provider.request_fingerprint(prompt))
+        if stored is not None:
+            return stored
+        return self.provider.call(prompt)
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        stored = self.store.get(self.provider.request_fingerprint(prompt))
+        if stored is not None:
+            return iter([stored])
+        return self.provider.stream(prompt)
+    
+    async def acall(self, prompt: str) -> str:
+        import asyncio  # Only async callers pay for the event loop machinery
+        
+        stored = await asyncio.to_thread(self.store.get, self.provider.request_fingerprint(prompt))
+        if stored is not None:
+            return stored
+        return await self.provider.acall(prompt)
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        import asyncio
+        
+        stored = await asyncio.to_thread(self.store.get, self.provider.request_fingerprint(prompt))
+        if stored is not None:
+            yield stored
+            return
+        async for chunk in self.provider.astream(prompt):
+            yield chunk
+
+
+_default_store: Optional[WarmStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_warm_store() -> WarmStore:
+    """Return the process-wide read-only warm store."""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = WarmStore(readonly=True)
+        return _default_store
+
+
+def generate(
+    provider_name: str = DEFAULT_AI_PROVIDER,
+    workers: int = 8,
+    templates: Optional[List[str]] = None,
+    force: bool = False,
+    path: str = WARM_STORE_PATH,
+) -> Dict[str, int]:
+    """Generate every missing entry of the matrix in parallel."""
+    ai = get_shared_provider(provider_name)
+    store = WarmStore(path)
+    versions = {template: template_version(template) for template in templates or TEMPLATE_ARGS}
+    counts = {"generated": 0, "retagged": 0, "skipped": 0, "failed": 0}
+    
+    pending = []
+    for entry in template_matrix(templates):
+        prompt = entry.prompt()
+        fingerprint = ai.request_fingerprint(prompt)
+        existing_version = store.version_of(fingerprint)
+        if existing_version is not None and not force:
+            if existing_version != versions[entry.template]:
+                # Template source changed but this rendered prompt did not
+                store.set_version(fingerprint, versions[entry.template])
+                counts["retagged"] += 1
+            else:
+                counts["skipped"] += 1
+            continue
+        pending.append((entry, prompt, fingerprint))
+    
+    print(f"Generating {len(pending)} answers with {workers} workers ({counts['skipped']} already stored)")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor, scheduling("bulk", tenant="warm_store"):
+        futures = {
+            executor.submit(contextvars.copy_context().run, ai.call, prompt): (entry, fingerprint)
+            for entry, prompt, fingerprint in pending
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            entry, fingerprint = futures[future]
+            label = " / ".join(part for part in entry if part)
+            try:
+                store.put(fingerprint, entry, versions[entry.template], ai.display_name, future.result())
+                counts["generated"] += 1
+                print(f"[{done}/{len(pending)}] ✅ {label}")
+            except Exception as exc:  # One bad entry (provider, cancelled, SQLite) must not end the run
+                counts["failed"] += 1
+                print(f"[{done}/{len(pending)}] ❌ {label}: {exc}")
+    
+    print(f"Done in {time.monotonic() - started:.1f}s: {counts}")
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-generate template answers into the warm store.")
+    parser.add_argument("command", choices=["generate", "prune", "stats"])
+    parser.add_argument("--provider", default=DEFAULT_AI_PROVIDER, help="AI provider ('openai' or 'asi1')")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel generation calls")
+    parser.add_argument("--template", action="append", choices=list(TEMPLATE_ARGS), help="Limit to a template")
+    parser.add_argument("--force", action="store_true", help="Regenerate entries that already exist")
+    parser.add_argument("--path", default=WARM_STORE_PATH, help="Artifact path")
+    args = parser.parse_args()
+    
+    if args.command == "generate":
+        counts = generate(args.provider, args.workers, args.template, args.force, args.path)
+        sys.exit(1 if counts["failed"] else 0)
+    elif args.command == "prune":
+        print(f"Removed {WarmStore(args.path).prune()} stale entries")
+    else:
+        for template, counts in sorted(WarmStore(args.path).stats().items()):
+            print(f"{template:36} current={counts['current']:4} stale={counts['stale']:4}")
+
+
+if __name__ == "__main__":
+    main()